@@ -0,0 +1,252 @@
+"""
+Approximate nearest neighbour search with an inverted-file (IVF) index.
+
+The normalized embedding matrix is partitioned with spherical k-means into
+``nlist`` lists. A query is scored against the list centroids first and
+only the rows of the ``nprobe`` closest lists are scanned exactly, so a
+search touches roughly nprobe / nlist of the matrix. ``nprobe`` is the
+recall-vs-latency knob: nprobe == nlist is an exact search.
+
+Rows appended to a store after the index was built are always scanned
+exactly, and tombstoned rows are filtered out, so an index stays correct
+(only slower) until the store is compacted and the index rebuilt.
+
+Usage:
+    python ann_index.py build <store_dir> [--nlist N] [--nprobe N]
+    python ann_index.py bench <store_dir> [--queries N] [--k K] [--nprobe 1,4,16]
+    python ann_index.py bench --synthetic 200000 --dim 256
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+ANN_FILE = "ann_ivf.npz"
+
+# k-means training sample: points per list, capped to bound memory
+TRAIN_POINTS_PER_LIST = 64
+MAX_TRAIN_POINTS = 100000
+KMEANS_ITERATIONS = 10
+
+# Rows scored per matrix product while assigning rows to lists
+ASSIGN_BLOCK_ROWS = 65536
+
+def default_nlist(count):
+    """Number of lists for a corpus of count rows (about 4 * sqrt(count))"""
+    return max(1, min(count, int(4 * np.sqrt(count))))
+
+def default_nprobe(nlist):
+    """Lists scanned per query by default: ~1/16 of the lists, at least 8"""
+    return max(1, min(nlist, max(8, nlist // 16)))
+
+def top_k_rows(scores, top_k):
+    """Positions of the top_k highest scores, best first (ties keep row order)"""
+    if top_k < len(scores):
+        rows = np.sort(np.argpartition(-scores, top_k - 1)[:top_k])
+    else:
+        rows = np.arange(len(scores))
+    return rows[np.argsort(-scores[rows], kind="stable")]
+
+def _assign(matrix, centroids, rows=None):
+    """Index of the closest centroid (by inner product) for each row"""
+    count = len(matrix) if rows is None else len(rows)
+    lists = np.empty(count, dtype=np.int64)
+    for start in range(0, count, ASSIGN_BLOCK_ROWS):
+        stop = min(start + ASSIGN_BLOCK_ROWS, count)
+        block = matrix[start:stop] if rows is None else matrix[rows[start:stop]]
+        lists[start:stop] = np.argmax(np.asarray(block, dtype=np.float32) @ centroids.T, axis=1)
+    return lists
+
+def train_centroids(sample, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means: unit-length centroids maximizing inner product with their points"""
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(sample, dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        lists = _assign(sample, centroids)
+        # Sum the points of each list via a sort + reduceat instead of a Python loop
+        order = np.argsort(lists, kind="stable")
+        sorted_lists = lists[order]
+        starts = np.flatnonzero(np.r_[True, sorted_lists[1:] != sorted_lists[:-1]])
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+        centroids[sorted_lists[starts]] = sums
+
+        # Re-seed empty lists with random points so every list gets used
+        empty = np.setdiff1d(np.arange(nlist), sorted_lists[starts])
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids /= norms
+    return centroids
+
+class IVFIndex:
+    """Inverted lists over the rows of a normalized matrix.
+
+    ``order`` holds row ids grouped by list and ``offsets[l]:offsets[l + 1]``
+    is the slice of list l. Only the first ``built_rows`` rows are indexed;
+    ``generation`` ties the index to the store data files it was built from.
+    """
+
+    def __init__(self, centroids, order, offsets, built_rows, nprobe=None, generation=0):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.order = np.asarray(order, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.built_rows = int(built_rows)
+        self.nprobe = nprobe or default_nprobe(self.nlist)
+        self.generation = generation
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix, nlist=None, nprobe=None, exclude=None, generation=0, seed=0):
+        """Train centroids on a sample of matrix and assign every row to a list.
+
+        Rows set in the boolean mask ``exclude`` (e.g. tombstones) are left
+        out of the lists.
+        """
+        count = len(matrix)
+        rows = np.arange(count) if exclude is None else np.flatnonzero(~exclude)
+        if len(rows) == 0:
+            raise ValueError("Cannot build an ANN index over an empty matrix")
+        nlist = min(nlist or default_nlist(len(rows)), len(rows))
+
+        rng = np.random.default_rng(seed)
+        train_size = min(len(rows), max(nlist, min(MAX_TRAIN_POINTS, nlist * TRAIN_POINTS_PER_LIST)))
+        sample_rows = np.sort(rng.choice(rows, train_size, replace=False))
+        print(f"Training {nlist} lists on {train_size} of {len(rows)} vectors...")
+        centroids = train_centroids(matrix[sample_rows], nlist, seed=seed)
+
+        print("Assigning vectors to lists...")
+        lists = _assign(matrix, centroids, rows)
+        order = rows[np.argsort(lists, kind="stable")]
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(lists, minlength=nlist), out=offsets[1:])
+        return cls(centroids, order, offsets, count, nprobe=nprobe, generation=generation)
+
+    def save(self, path):
+        """Write the index to an .npz file (atomically)"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                order=self.order,
+                offsets=self.offsets,
+                info=np.array([self.built_rows, self.nprobe, self.generation], dtype=np.int64)
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            built_rows, nprobe, generation = (int(value) for value in data["info"])
+            return cls(data["centroids"], data["order"], data["offsets"], built_rows, nprobe, generation)
+
+    def candidates(self, query, nprobe=None):
+        """Row ids to scan for a normalized query: the nprobe closest lists plus unindexed rows"""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        lists = top_k_rows(self.centroids @ query, nprobe)
+        parts = [self.order[self.offsets[l]:self.offsets[l + 1]] for l in lists]
+        rows = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+        # Sorted ids read the memory-mapped matrix front to back
+        return np.sort(rows)
+
+    def search(self, matrix, query, top_k, nprobe=None, deleted=None):
+        """Return (rows, scores) of the best top_k candidates, best first"""
+        rows = self.candidates(query, nprobe)
+        if len(matrix) > self.built_rows:
+            rows = np.concatenate([rows, np.arange(self.built_rows, len(matrix))])
+        if deleted is not None:
+            rows = rows[~deleted[rows]]
+        scores = np.asarray(matrix[rows], dtype=np.float32) @ query
+        best = top_k_rows(scores, top_k)
+        return rows[best], scores[best]
+
+def recall_at_k(index, matrix, queries, k=10, nprobes=(1, 2, 4, 8, 16, 32, 64), deleted=None):
+    """Recall@k and mean latency of each nprobe against exact search over the live rows"""
+    exact = []
+    start = time.perf_counter()
+    for query in queries:
+        scores = np.asarray(matrix @ query, dtype=np.float32)
+        if deleted is not None:
+            # Tombstoned rows are never returned, so they are no part of the ground truth either
+            scores[deleted] = -np.inf
+        exact.append(set(top_k_rows(scores, k).tolist()))
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    results = [{"nprobe": "exact", "recall": 1.0, "latency_ms": exact_ms}]
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            continue
+        found = 0
+        start = time.perf_counter()
+        for query, truth in zip(queries, exact):
+            rows, _ = index.search(matrix, query, k, nprobe, deleted)
+            found += len(truth.intersection(rows.tolist()))
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        results.append({"nprobe": nprobe, "recall": found / (k * len(queries)), "latency_ms": latency_ms})
+    return results
+
+def synthetic_matrix(count, dim, clusters=256, seed=0):
+    """Clustered random unit vectors, a rough stand-in for real embeddings"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    matrix = centers[rng.integers(clusters, size=count)] + 0.5 * rng.normal(size=(count, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+def _main(argv):
+    parser = argparse.ArgumentParser(description="Build or benchmark the IVF index of an embedding store")
+    parser.add_argument("command", choices=["build", "bench"])
+    parser.add_argument("store", nargs="?", default="embeddings_store")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", default=None, help="build: default nprobe; bench: comma-separated values")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--synthetic", type=int, default=0, help="bench on N random vectors instead of a store")
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        from embedding_store import EmbeddingStore
+        store = EmbeddingStore(args.store)
+        start = time.perf_counter()
+        index = store.build_ann(nlist=args.nlist, nprobe=int(args.nprobe) if args.nprobe else None)
+        print(f"Built {index.nlist} lists over {index.built_rows} rows in {time.perf_counter() - start:.1f}s "
+              f"(default nprobe {index.nprobe})")
+        return
+
+    deleted = None
+    if args.synthetic:
+        matrix = synthetic_matrix(args.synthetic, args.dim)
+        index = IVFIndex.build(matrix, nlist=args.nlist)
+    else:
+        from embedding_store import EmbeddingStore
+        store = EmbeddingStore(args.store)
+        matrix = store.vectors()
+        deleted = store.deleted_mask()
+        index = store.load_ann() or IVFIndex.build(matrix, nlist=args.nlist, exclude=deleted)
+
+    # Queries are perturbed copies of stored (live) vectors, so they resemble real questions about the corpus
+    rng = np.random.default_rng(1)
+    live = np.arange(len(matrix)) if deleted is None else np.flatnonzero(~deleted)
+    queries = np.asarray(matrix[np.sort(rng.choice(live, min(args.queries, len(live)), replace=False))],
+                         dtype=np.float32)
+    queries = queries + 0.05 * rng.normal(size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    nprobes = [int(n) for n in args.nprobe.split(",")] if args.nprobe else [1, 2, 4, 8, 16, 32, 64]
+    print(f"recall@{args.k} over {len(queries)} queries, {len(live)} vectors, {index.nlist} lists")
+    print(f"{'nprobe':>8} {'recall':>8} {'ms/query':>10}")
+    for result in recall_at_k(index, matrix, queries, args.k, nprobes, deleted):
+        print(f"{result['nprobe']:>8} {result['recall']:>8.3f} {result['latency_ms']:>10.2f}")
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
@@ -0,0 +1,230 @@
+"""
+Batch question answering for question files.
+
+Reads questions from a JSONL file ({"id": ..., "question": ..., "model": ...}
+per line, id and model optional) or a CSV file with a "question" column,
+and writes one JSON result per line to the output file as each answer
+completes:
+
+    {"id", "question", "model", "answer", "context", "hits": [...], "block_size",
+     "timings": {"retrieval_ms", "answer_ms"}, "tokens": {"in", "out"}, "error"}
+
+Hits carry "similarity" (cosine) in vector mode and "score" (BM25 or
+fused rank score) in lexical and hybrid mode, as in qa_server.
+
+Retrieval runs per block of questions: one batched embeddings request and
+one multi-query matrix product over the index. LLM calls run concurrently
+up to --concurrency. Re-running with the same output file resumes: ids that
+already have a successful result are skipped, failed ones are retried.
+
+Usage:
+    python batch_qa.py questions.jsonl results.jsonl [--store embeddings_store]
+        [--model gpt-4o] [--concurrency 16] [--top-k 3] [--block 256] [--trace-log traces.jsonl]
+        [--source manual.pdf ...] [--filter '{"author": "Jane Doe", "pages": [1, 20]}']
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import asyncio
+import argparse
+from embeddings_manager import load_index, DEFAULT_STORE_PATH, LEGACY_EMBEDDINGS_FILE
+from qa_pipeline import QAPipeline
+from vector_search import SearchFilter, RETRIEVAL_MODES
+from qa_server import StubClient
+from tracing import start_trace, set_trace_log
+
+# Questions retrieved together in one embed request and one matrix product
+RETRIEVAL_BLOCK = 256
+
+DEFAULT_CONCURRENCY = 16
+
+def read_questions(path):
+    """Return [{"id", "question", "model"}] from a JSONL or CSV file"""
+    questions = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for number, row in enumerate(rows, 1):
+            question = (row.get("question") or "").strip()
+            if not question:
+                print(f"Skipping entry {number}: no question")
+                continue
+            questions.append({
+                "id": str(row.get("id") or number),
+                "question": question,
+                "model": row.get("model") or None
+            })
+    return questions
+
+def completed_ids(output_path):
+    """Ids that already have a successful result in an earlier output file"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by an interrupted run
+            if not result.get("error"):
+                done.add(str(result["id"]))
+    return done
+
+def _hit_summary(index, hits, score="similarity"):
+    return [
+        {
+            "source_file": index.metadata[row].get("source_file", ""),
+            "page": index.metadata[row].get("page"),
+            "page_end": index.metadata[row].get("page_end", index.metadata[row].get("page")),
+            "chunk_id": index.metadata[row].get("chunk_id"),
+            score: round(sim, 6)
+        }
+        for row, sim in hits
+    ]
+
+async def run_batch(pipeline, questions, output, block=RETRIEVAL_BLOCK, concurrency=DEFAULT_CONCURRENCY,
+                    search_filter=None):
+    """Answer questions and append a result line to ``output`` as each finishes; returns counts"""
+    index = pipeline.index
+    # Cosine similarity for vector hits; BM25 or fused rank scores otherwise (as in qa_server)
+    score = "similarity" if pipeline.retrieval_mode(index) == "vector" else "score"
+    slots = asyncio.Semaphore(concurrency)
+    counts = {"answered": 0, "failed": 0}
+
+    def write(result):
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output.flush()
+        counts["failed" if result.get("error") else "answered"] += 1
+        finished = counts["answered"] + counts["failed"]
+        if finished % 50 == 0 or finished == len(questions):
+            print(f"Answered {finished}/{len(questions)} questions ({counts['failed']} failed)")
+
+    async def answer(item, context, result):
+        async with slots:
+            start = time.perf_counter()
+            with start_trace("batch_answer", question=item["question"], model=result["model"], id=item["id"]) as trace:
+                try:
+                    result["answer"] = await pipeline.generate(item["question"], context, item["model"], index)
+                except Exception as e:
+                    result["error"] = f"{type(e).__name__}: {e}"
+            result["timings"]["answer_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            result["tokens"] = {"in": trace.total("tokens_in"), "out": trace.total("tokens_out")}
+        write(result)
+
+    tasks = set()
+    for start in range(0, len(questions), block):
+        items = questions[start:start + block]
+
+        # Step 1: retrieval for the whole block at once
+        retrieval_start = time.perf_counter()
+        try:
+            all_hits = await pipeline.search_block([item["question"] for item in items], pipeline.context_candidates, index,
+                                                   search_filter=search_filter)
+        except Exception as e:
+            for item in items:
+                write({"id": item["id"], "question": item["question"], "error": f"retrieval failed: {e}"})
+            continue
+        retrieval_ms = round((time.perf_counter() - retrieval_start) * 1000, 1)
+
+        # Step 2: generation, bounded by the semaphore; retrieval of the next block overlaps with it
+        for item, hits in zip(items, all_hits):
+            context = pipeline.build_context(index, hits, item["model"])
+            result = {
+                "id": item["id"],
+                "question": item["question"],
+                "model": item["model"] or pipeline.model,
+                "answer": None,
+                "context": context,
+                "hits": _hit_summary(index, hits[:pipeline.top_k], score),
+                "block_size": len(items),
+                "timings": {"retrieval_ms": retrieval_ms}
+            }
+            task = asyncio.ensure_future(answer(item, context, result))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        # Keep the number of queued answers bounded so memory stays flat for huge files
+        while len(tasks) > concurrency * 4:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+    if tasks:
+        await asyncio.wait(tasks)
+    return counts
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Answer a file of questions against the document index")
+    parser.add_argument("questions", help="JSONL or CSV file of questions")
+    parser.add_argument("output", help="JSONL file for results (appended to; re-run to resume)")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH)
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--top-k", type=int, default=3, help="hits listed per result")
+    parser.add_argument("--context-tokens", type=int, help="context budget per prompt (default: per model)")
+    parser.add_argument("--mode", choices=RETRIEVAL_MODES, help="retrieval mode (default: hybrid if the store has a BM25 index)")
+    parser.add_argument("--source", action="append", help="only retrieve from this document (repeatable)")
+    parser.add_argument("--filter", help="JSON search filter: pages, author, creation_date... (see SearchFilter)")
+    parser.add_argument("--block", type=int, default=RETRIEVAL_BLOCK)
+    parser.add_argument("--no-cache", action="store_true", help="bypass the query and answer caches")
+    parser.add_argument("--stub", action="store_true", help="use a local fake model client instead of the API")
+    parser.add_argument("--trace-log", help="append a JSONL trace of every answer to this file")
+    args = parser.parse_args(argv)
+
+    if args.trace_log:
+        set_trace_log(args.trace_log)
+    try:
+        fields = json.loads(args.filter) if args.filter else {}
+        if args.source:
+            fields["source_files"] = args.source
+        search_filter = SearchFilter.from_dict(fields)
+    except ValueError as e:
+        parser.error(f"invalid --filter: {e}")
+
+    questions = read_questions(args.questions)
+    done = completed_ids(args.output)
+    pending = [item for item in questions if item["id"] not in done]
+    print(f"{len(questions)} questions, {len(questions) - len(pending)} already answered, {len(pending)} to go")
+    if not pending:
+        return
+
+    index = load_index(args.store, LEGACY_EMBEDDINGS_FILE)
+    pipeline = QAPipeline(
+        index,
+        model=args.model,
+        client=StubClient(index.matrix.shape[1] or 1536) if args.stub else None,
+        concurrency=args.concurrency,
+        top_k=args.top_k,
+        token_budget=args.context_tokens,
+        mode=args.mode,
+        use_cache=not (args.no_cache or args.stub)
+    )
+
+    async def run():
+        try:
+            # Finish a line cut short by an interrupted run so the next result starts cleanly
+            # (checked in binary mode: a text-mode seek could land inside a multibyte character)
+            cut_short = False
+            if os.path.exists(args.output) and os.path.getsize(args.output) > 0:
+                with open(args.output, "rb") as existing:
+                    existing.seek(-1, os.SEEK_END)
+                    cut_short = existing.read(1) != b"\n"
+            with open(args.output, "a", encoding="utf-8") as output:
+                if cut_short:
+                    output.write("\n")
+                return await run_batch(pipeline, pending, output, args.block, args.concurrency, search_filter)
+        finally:
+            await pipeline.aclose()
+
+    start = time.perf_counter()
+    counts = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    print(f"Done in {elapsed:.1f}s: {counts['answered']} answered, {counts['failed']} failed "
+          f"({len(pending) / elapsed:.1f} questions/s)")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the hot paths.
+
+Everything runs locally and deterministically: synthetic PDFs and seeded
+embeddings stand in for real documents, and a fake OpenAI-compatible HTTP
+server answers embedding and chat requests with configurable latency. The
+real client code paths (batching, retries, streaming parsing) are
+exercised end to end, only the model is fake.
+
+Timed stages: load_and_chunk, clean_pages, create_embeddings, save/load of the legacy
+JSON file and the binary store, find_most_relevant, search, search_many,
+search over int8 and product-quantized codes, lexical_search and ask_gpt.
+Each reports p50/p95/p99/mean latency in ms and throughput, and
+the whole report is JSON so runs can be compared between versions:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json --tolerance 0.2
+
+With --baseline the exit status is 1 if any stage's p50 regressed by more
+than the tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import hashlib
+import argparse
+import platform
+import contextlib
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+WORDS = (
+    "device network setting configure password firmware update sensor battery signal "
+    "install connect reset manual display power cable module channel frequency "
+    "interface protocol temperature calibrate warranty support error status mode"
+).split()
+
+# ---------------------------------------------------------------------------
+# Fake OpenAI-compatible server
+# ---------------------------------------------------------------------------
+
+def fake_embedding(text, dim):
+    """Deterministic unit vector for a text"""
+    seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+    vector = np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+class _FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        server.requests += 1
+
+        if self.path.endswith("/embeddings"):
+            time.sleep(server.embed_latency)
+            texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            tokens = sum(len(text) // 4 + 1 for text in texts)
+            self._send_json({
+                "object": "list",
+                "model": body.get("model"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(text, server.dim)}
+                    for i, text in enumerate(texts)
+                ],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+            })
+        elif self.path.endswith("/chat/completions"):
+            self._chat(body)
+        else:
+            self._send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+    def _chat(self, body):
+        server = self.server
+        question = body["messages"][-1]["content"].split("Question: ", 1)[-1].split("\n", 1)[0]
+        rng = random.Random(question)
+        words = [f"Answer to '{question}':"] + [rng.choice(WORDS) for _ in range(server.answer_words)]
+        prompt_tokens = sum(len(m["content"]) // 4 + 1 for m in body["messages"])
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body.get("model")}
+
+        time.sleep(server.chat_latency)
+        if not body.get("stream"):
+            self._send_json(dict(
+                base,
+                object="chat.completion",
+                choices=[{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop"
+                }],
+                usage={"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                       "total_tokens": prompt_tokens + len(words)}
+            ))
+            return
+
+        # Server-sent events, one word per chunk, spread over the token latency
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for i, word in enumerate(words):
+                chunk = dict(base, object="chat.completion.chunk", choices=[
+                    {"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}
+                ])
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(server.token_latency)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                usage = dict(base, object="chat.completion.chunk", choices=[], usage={
+                    "prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                    "total_tokens": prompt_tokens + len(words)
+                })
+                self.wfile.write(f"data: {json.dumps(usage)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+        except ConnectionError:
+            pass  # the client closed the stream early (time-to-first-token runs do this)
+
+class FakeOpenAIServer:
+    """OpenAI-compatible /v1/embeddings and /v1/chat/completions served from a background thread"""
+
+    def __init__(self, dim=1536, embed_latency=0.0, chat_latency=0.0, token_latency=0.0, answer_words=60,
+                 host="127.0.0.1", port=0):
+        self.httpd = ThreadingHTTPServer((host, port), _FakeOpenAIHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.dim = dim
+        self.httpd.embed_latency = embed_latency
+        self.httpd.chat_latency = chat_latency
+        self.httpd.token_latency = token_latency
+        self.httpd.answer_words = answer_words
+        self.httpd.requests = 0
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def client(self):
+        from openai import OpenAI
+        return OpenAI(base_url=self.base_url, api_key="fake", max_retries=0)
+
+    def async_client(self):
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(base_url=self.base_url, api_key="fake", max_retries=0)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# ---------------------------------------------------------------------------
+# Synthetic corpora
+# ---------------------------------------------------------------------------
+
+def synthetic_text(rng, words):
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(8, 20))
+        sentence = " ".join(rng.choice(WORDS) for _ in range(length))
+        sentences.append(sentence.capitalize() + ".")
+        words -= length
+    return " ".join(sentences)
+
+def write_pdf(path, pages):
+    """Write a minimal text PDF with one page per string (Helvetica, one text line per ~90 chars)"""
+    out = [b"%PDF-1.4\n"]
+    offsets = []
+
+    def add(body):
+        offsets.append(sum(len(part) for part in out))
+        out.append(f"{len(offsets)} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    add(b"<< /Type /Catalog /Pages 2 0 R >>")
+    add(f"<< /Type /Pages /Kids [{' '.join(f'{p} 0 R' for p in page_ids)}] /Count {len(pages)} >>".encode())
+    add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for page_id, text in zip(page_ids, pages):
+        text = text.replace("\\", "").replace("(", "").replace(")", "")
+        lines = [text[i:i + 90] for i in range(0, len(text), 90)]
+        stream = ("BT /F1 10 Tf 40 760 Td 12 TL " + " ".join(f"({line}) '" for line in lines) + " ET").encode("latin-1")
+        add(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {page_id + 1} 0 R >>".encode())
+        add(f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+    xref = sum(len(part) for part in out)
+    out.append(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode()
+               + b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets))
+    out.append(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    with open(path, "wb") as f:
+        f.write(b"".join(out))
+
+def make_pdf_corpus(folder, count, pages, words_per_page=350, seed=0):
+    """Write count synthetic PDFs into folder; returns their paths"""
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    files = []
+    for i in range(count):
+        path = os.path.join(folder, f"synthetic_{i:04d}.pdf")
+        write_pdf(path, [synthetic_text(rng, words_per_page) for _ in range(pages)])
+        files.append(path)
+    return files
+
+def make_embeddings(count, dim, seed=0, chunks_per_doc=200):
+    """create_embeddings-style dicts with seeded random unit vectors"""
+    rng = np.random.default_rng(seed)
+    text_rng = random.Random(seed)
+    matrix = rng.normal(size=(count, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return [
+        {
+            "chunk": synthetic_text(text_rng, 40),
+            "embedding": matrix[i].tolist(),
+            "metadata": {
+                "source_file": f"synthetic_{i // chunks_per_doc:04d}.pdf",
+                "page": i % chunks_per_doc // 5 + 1,
+                "chunk_id": f"synthetic_{i // chunks_per_doc:04d}.pdf_c{i}"
+            }
+        }
+        for i in range(count)
+    ]
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def measure(fn, repeat, warmup=1):
+    """Run fn warmup + repeat times; returns the timed durations in seconds"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def summarize(samples, items_per_call=1, unit="calls"):
+    """Latency percentiles (ms) and throughput for a list of durations"""
+    ms = np.array(samples) * 1000
+    total = sum(samples)
+    return {
+        "calls": len(samples),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "throughput": round(items_per_call * len(samples) / total, 2) if total else None,
+        "throughput_unit": f"{unit}/s"
+    }
+
+def compare(report, baseline, tolerance):
+    """Print p50 changes against a baseline report; returns the stages that regressed"""
+    regressions = []
+    print(f"\n{'stage':<24} {'baseline p50':>14} {'p50':>10} {'change':>8}")
+    for stage, result in report["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before or not before.get("p50_ms"):
+            continue
+        change = result["p50_ms"] / before["p50_ms"] - 1
+        flag = "  REGRESSION" if change > tolerance else ""
+        print(f"{stage:<24} {before['p50_ms']:>12.2f}ms {result['p50_ms']:>8.2f}ms {change:>+7.0%}{flag}")
+        if change > tolerance:
+            regressions.append(stage)
+    return regressions
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+def run_benchmarks(args, workdir):
+    import embeddings_manager
+    import vector_search
+    import qa_agent
+    from document_loader import load_and_chunk, load_pdf
+    from text_cleaner import DEFAULT_CLEANER
+    from pdf_document import set_pdf_cache
+    from vector_search import find_most_relevant
+    from quantization import QuantizedIndex, PQ_SUBVECTOR_DIMS
+    from qa_agent import ask_gpt
+
+    stages = {}
+
+    def record(name, samples, items_per_call=1, unit="calls"):
+        stages[name] = summarize(samples, items_per_call, unit)
+        print(f"{name:<24} p50 {stages[name]['p50_ms']:>9.2f}ms  p95 {stages[name]['p95_ms']:>9.2f}ms  "
+              f"{stages[name]['throughput']} {unit}/s")
+
+    with FakeOpenAIServer(dim=args.dim, embed_latency=args.embed_latency_ms / 1000,
+                          chat_latency=args.chat_latency_ms / 1000,
+                          token_latency=args.token_latency_ms / 1000) as server:
+        # Point every module-level client at the fake server
+        client = server.client()
+        embeddings_manager.client = client
+        vector_search.client = client
+        qa_agent.client = client
+        vector_search.set_query_cache(False)
+        qa_agent.set_answer_cache(False)
+        set_pdf_cache(False)
+
+        # Stage 1: PDF extraction and chunking
+        files = make_pdf_corpus(os.path.join(workdir, "pdfs"), args.pdfs, args.pages, seed=args.seed)
+        chunks = []
+
+        def chunk():
+            chunks[:] = load_and_chunk(files, workers=args.workers)
+
+        record("load_and_chunk", measure(chunk, args.repeat), args.pdfs * args.pages, "pages")
+
+        # Page text cleaning on its own (extraction dominates load_and_chunk)
+        page_texts = [load_pdf(file_path) for file_path in files]
+        record("clean_pages", measure(
+            lambda: [DEFAULT_CLEANER.clean_pages(texts) for texts in page_texts], args.repeat
+        ), sum(len(texts) for texts in page_texts), "pages")
+
+        # Stage 2: embeddings through the batched client against the fake server
+        record("create_embeddings", measure(
+            lambda: embeddings_manager.create_embeddings(chunks, client=client, cache=False), args.repeat
+        ), len(chunks), "chunks")
+
+        # Stage 3: persistence, legacy JSON vs binary store
+        embeddings = make_embeddings(args.chunks, args.dim, seed=args.seed)
+        json_path = os.path.join(workdir, "embeddings.json")
+        store_path = os.path.join(workdir, "store")
+        record("save_embeddings_json", measure(
+            lambda: embeddings_manager.save_embeddings(embeddings, json_path), args.repeat
+        ), len(embeddings), "chunks")
+        record("load_embeddings_json", measure(
+            lambda: embeddings_manager.load_embeddings(json_path), args.repeat
+        ), len(embeddings), "chunks")
+        record("save_index", measure(
+            lambda: embeddings_manager.save_index(embeddings, store_path), args.repeat
+        ), len(embeddings), "chunks")
+        record("load_index", measure(
+            lambda: embeddings_manager.load_index(store_path, None), args.repeat
+        ), len(embeddings), "chunks")
+        del embeddings
+
+        # Stage 4: retrieval, one query at a time and batched
+        index = embeddings_manager.load_index(store_path, None)
+        rng = random.Random(args.seed)
+        queries = [synthetic_text(rng, 12) for _ in range(args.queries)]
+        query_iter = iter(queries * (args.repeat + 2))
+        record("find_most_relevant", measure(
+            lambda: find_most_relevant(next(query_iter), index, use_cache=False), args.queries
+        ))
+        vectors = [fake_embedding(query, args.dim) for query in queries]
+        record("search", measure(lambda: index.search(vectors[0], 3), args.queries))
+        if index.lexical is not None:
+            record("lexical_search", measure(lambda: index.lexical.search(next(query_iter), 3), args.queries))
+        record("search_many", measure(
+            lambda: index.search_many(vectors, 3), args.repeat
+        ), len(vectors), "queries")
+        query = np.asarray(vectors[0], dtype=np.float32) / np.linalg.norm(vectors[0])
+        for kind in ("int8", "pq"):
+            if kind == "pq" and args.dim % PQ_SUBVECTOR_DIMS:
+                continue
+            quantized = QuantizedIndex.build(index.matrix, kind)
+            record(f"search_{kind}", measure(lambda: quantized.search(index.matrix, query, 3), args.queries))
+
+        # Stage 5: answers from the fake chat endpoint
+        context = find_most_relevant(queries[0], index, use_cache=False)
+        record("ask_gpt", measure(
+            lambda: ask_gpt(queries[0], context, model=args.model, use_cache=False), args.asks
+        ))
+        record("ask_gpt_first_token", _first_token_samples(queries[0], context, args))
+
+        requests = server.requests
+
+    return {
+        "version": 1,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "tolerance")},
+        "fake_server_requests": requests,
+        "stages": stages
+    }
+
+def _first_token_samples(question, context, args):
+    """Time to first streamed delta from ask_gpt_stream"""
+    from qa_agent import ask_gpt_stream
+    samples = []
+    for _ in range(args.asks):
+        start = time.perf_counter()
+        stream = ask_gpt_stream(question, context, model=args.model, use_cache=False)
+        next(stream)
+        samples.append(time.perf_counter() - start)
+        stream.close()
+    return samples
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the document Q&A hot paths against a fake model backend")
+    parser.add_argument("--pdfs", type=int, default=10, help="synthetic PDFs for load_and_chunk")
+    parser.add_argument("--pages", type=int, default=10, help="pages per synthetic PDF")
+    parser.add_argument("--workers", type=int, default=1, help="load_and_chunk workers (0 = auto)")
+    parser.add_argument("--chunks", type=int, default=20000, help="synthetic chunks in the search index")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--asks", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of the bulk stages")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0)
+    parser.add_argument("--token-latency-ms", type=float, default=0.0, help="delay between streamed words")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="earlier JSON report to compare p50 latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p50 slowdown before flagging")
+    args = parser.parse_args(argv)
+    if args.workers == 0:
+        args.workers = None
+
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    workdir = tempfile.mkdtemp(prefix="docqa_bench_")
+    try:
+        # Progress goes to stderr so the JSON report on stdout stays parseable
+        with contextlib.redirect_stdout(sys.stderr):
+            report = run_benchmarks(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        with contextlib.redirect_stdout(sys.stderr):
+            if baseline.get("config") != report["config"]:
+                print("\nWarning: the baseline was run with a different configuration")
+            regressions = compare(report, baseline, args.tolerance)
+            if regressions:
+                print(f"\nRegressed stages: {', '.join(regressions)}")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
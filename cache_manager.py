@@ -0,0 +1,351 @@
+"""
+Persistent caches used by the ingestion and query paths.
+
+PersistentLRUCache is a size-bounded key/value table in SQLite with LRU
+eviction and hit/miss/eviction counters. EmbeddingCache builds on it to map
+(model, normalized chunk text) to an embedding vector, so re-processing a
+document set only sends new or changed chunks to the embeddings API.
+
+MemoryLRUCache is the in-process counterpart with an optional TTL.
+QueryEmbeddingCache layers it over an optional PersistentLRUCache so
+repeated questions are answered from memory, or from disk after a restart,
+without an embeddings API round-trip. AnswerCache keeps chat completions
+keyed by everything that determines them, including the index version, so
+answers go stale automatically when documents change. PdfInfoCache keeps
+each PDF's metadata and first-page preview keyed by (path, mtime, size),
+so listing known files needs no PDF parsing at all.
+"""
+
+import re
+import os
+import json
+import time
+import struct
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+DEFAULT_EMBEDDING_CACHE_PATH = "embedding_cache.sqlite"
+DEFAULT_EMBEDDING_CACHE_SIZE = 100000  # ~600 MB of 1536-dim float32 vectors
+
+DEFAULT_QUERY_CACHE_PATH = "query_cache.sqlite"
+DEFAULT_QUERY_CACHE_SIZE = 10000
+DEFAULT_QUERY_MEMORY_SIZE = 1024
+
+DEFAULT_ANSWER_CACHE_PATH = "answer_cache.sqlite"
+DEFAULT_ANSWER_CACHE_SIZE = 5000
+
+DEFAULT_PDF_CACHE_PATH = "pdf_cache.sqlite"
+DEFAULT_PDF_CACHE_SIZE = 10000
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_text(text):
+    """Canonical form of a text for cache keys: NFC unicode, collapsed whitespace"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+def normalize_query(text):
+    """Canonical form of a question: normalized text, case-folded, without trailing punctuation"""
+    return normalize_text(text).casefold().rstrip("?!. ")
+
+def hash_key(*parts):
+    """Stable SHA-256 key over string parts"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class PersistentLRUCache:
+    """Size-bounded LRU cache of bytes values stored in a SQLite file"""
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)")
+        self._conn.commit()
+        self._count, clock = self._conn.execute("SELECT COUNT(*), MAX(last_used) FROM cache").fetchone()
+        self._clock = clock or 0
+
+    def __len__(self):
+        return self._count
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def get_many(self, keys):
+        """Return {key: value} for the keys that are cached, marking them recently used"""
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({placeholders})", part
+                ).fetchall()
+                found.update(rows)
+            self._conn.executemany(
+                "UPDATE cache SET last_used = ? WHERE key = ?",
+                [(self._tick(), key) for key in found]
+            )
+            self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        """Insert or replace (key, value) pairs, evicting least recently used entries"""
+        items = list(items)
+        if not items:
+            return
+        with self._lock:
+            keys = [key for key, _ in items]
+            existing = 0
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                existing += self._conn.execute(
+                    f"SELECT COUNT(*) FROM cache WHERE key IN ({placeholders})", part
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, last_used) VALUES (?, ?, ?)",
+                [(key, sqlite3.Binary(value), self._tick()) for key, value in items]
+            )
+            self._count += len(set(keys)) - existing
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_used LIMIT ?)",
+                    (overflow,)
+                )
+                self._count -= overflow
+                self.evictions += overflow
+            self._conn.commit()
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+            self._count = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class EmbeddingCache(PersistentLRUCache):
+    """Chunk embeddings keyed by (model, hash of normalized chunk text)"""
+
+    def __init__(self, path=DEFAULT_EMBEDDING_CACHE_PATH, max_entries=DEFAULT_EMBEDDING_CACHE_SIZE):
+        super().__init__(path, max_entries)
+
+    @staticmethod
+    def key(model, text):
+        return hash_key(model, normalize_text(text))
+
+    def get_vectors(self, model, texts):
+        """Return a list with the cached vector (list of floats) or None for each text"""
+        keys = [self.key(model, text) for text in texts]
+        found = self.get_many(keys)
+        return [
+            np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+            for key in keys
+        ]
+
+    def put_vectors(self, model, texts, vectors):
+        self.put_many(
+            (self.key(model, text), np.asarray(vector, dtype=np.float32).tobytes())
+            for text, vector in zip(texts, vectors)
+            if vector is not None
+        )
+
+class AnswerCache(PersistentLRUCache):
+    """Chat answers keyed by a hash of (system prompt, context, question, model, temperature, index version).
+
+    The index version is part of the key, so once the index changes older
+    answers are never returned again and age out through LRU eviction.
+    """
+
+    def __init__(self, path=DEFAULT_ANSWER_CACHE_PATH, max_entries=DEFAULT_ANSWER_CACHE_SIZE):
+        super().__init__(path, max_entries)
+
+    @staticmethod
+    def key(system_prompt, context, question, model, temperature, index_version=None):
+        return hash_key(
+            "answer", system_prompt, context, normalize_text(question), model, repr(float(temperature)), index_version
+        )
+
+    def get_answer(self, *key_parts):
+        value = self.get(self.key(*key_parts))
+        return None if value is None else bytes(value).decode("utf-8")
+
+    def put_answer(self, *key_parts, answer):
+        self.put(self.key(*key_parts), answer.encode("utf-8"))
+
+class PdfInfoCache(PersistentLRUCache):
+    """PDF metadata and preview entries keyed by (absolute path, mtime, size).
+
+    An edited file gets a new key, so its old entry is never returned and
+    ages out through LRU eviction.
+    """
+
+    def __init__(self, path=DEFAULT_PDF_CACHE_PATH, max_entries=DEFAULT_PDF_CACHE_SIZE):
+        super().__init__(path, max_entries)
+
+    @staticmethod
+    def key(file_path, mtime, size):
+        return hash_key("pdf", os.path.abspath(file_path), repr(float(mtime)), int(size))
+
+    def get_entry(self, file_path, mtime, size):
+        value = self.get(self.key(file_path, mtime, size))
+        return None if value is None else json.loads(bytes(value).decode("utf-8"))
+
+    def put_entry(self, entry):
+        """Store an entry dict (it holds its own "path", "mtime" and "size" key fields)"""
+        self.put(self.key(entry["path"], entry["mtime"], entry["size"]), json.dumps(entry).encode("utf-8"))
+
+class MemoryLRUCache:
+    """In-process LRU cache with an optional time-to-live (seconds) per entry"""
+
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, created=None):
+        with self._lock:
+            self._entries[key] = (time.time() if created is None else created, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+class QueryEmbeddingCache:
+    """Query embeddings keyed by (model, normalized question).
+
+    Lookups go to an in-memory LRU first and then, if ``path`` is set, to a
+    persistent SQLite cache shared across runs and processes. With ``ttl``
+    set, entries older than that many seconds are treated as misses.
+    """
+
+    def __init__(self, path=DEFAULT_QUERY_CACHE_PATH, max_entries=DEFAULT_QUERY_CACHE_SIZE,
+                 memory_entries=DEFAULT_QUERY_MEMORY_SIZE, ttl=None):
+        self.ttl = ttl
+        self.memory = MemoryLRUCache(memory_entries, ttl)
+        self.disk = PersistentLRUCache(path, max_entries) if path else None
+
+    @staticmethod
+    def key(model, query):
+        return hash_key("query", model, normalize_query(query))
+
+    def get_vector(self, model, query):
+        """Return the cached vector (list of floats) for a query, or None"""
+        key = self.key(model, query)
+        vector = self.memory.get(key)
+        if vector is not None or self.disk is None:
+            return vector
+
+        value = self.disk.get(key)
+        if value is None:
+            return None
+        # Disk entries carry their creation time ahead of the float32 vector
+        created = struct.unpack("<d", value[:8])[0]
+        if self.ttl is not None and time.time() - created > self.ttl:
+            self.disk.hits -= 1
+            self.disk.misses += 1
+            return None
+        vector = np.frombuffer(value[8:], dtype=np.float32).tolist()
+        self.memory.put(key, vector, created)
+        return vector
+
+    def put_vector(self, model, query, vector):
+        key = self.key(model, query)
+        created = time.time()
+        self.memory.put(key, list(vector), created)
+        if self.disk is not None:
+            self.disk.put(key, struct.pack("<d", created) + np.asarray(vector, dtype=np.float32).tobytes())
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        """Counters of both tiers; "hit_rate" counts a hit in either tier"""
+        memory = self.memory.stats()
+        stats = {"memory": memory}
+        hits = memory["hits"]
+        lookups = memory["hits"] + memory["misses"]
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+            hits += stats["disk"]["hits"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
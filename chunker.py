@@ -0,0 +1,154 @@
+"""
+Span-based text chunking sized in tokens.
+
+The text is scanned once for sentence and paragraph boundaries, which cut
+it into units given as (start, end) offsets. Each unit's size is counted
+once with a pluggable counter (tokenizer.count_tokens by default, exact
+when tiktoken is installed), and units are packed greedily into chunks of
+at most ``max_tokens``. Consecutive chunks share whole trailing units of
+up to ``overlap_tokens``, so the overlap always starts on a sentence
+boundary and the final chunk never degenerates into a sliver of overlap.
+
+Chunks are (start, end) spans into the original text until a caller
+materializes them, so packing copies no text. A unit longer than a chunk
+is split at word boundaries into overlap-sized pieces (so its chunks still
+overlap), and a single over-long word (a URL, a base64
+blob) into equal slices of characters.
+
+A document's pages can be chunked as one text: join_pages concatenates
+them and records where each page starts, and span_pages maps a chunk's
+span back to the pages it covers, so chunks run across page breaks
+instead of stopping at them.
+
+Usage:
+    from chunker import chunk_spans, materialize
+    chunks = materialize(text, chunk_spans(text, max_tokens=256, overlap_tokens=50))
+"""
+
+import re
+from bisect import bisect_right
+from tokenizer import count_tokens
+
+# Default chunk size and overlap, in tokens (about 1000 and 200 characters of English)
+CHUNK_TOKENS = 256
+CHUNK_OVERLAP_TOKENS = 50
+
+# A paragraph break ends a chunk early once it is this full, so chunks tend to follow paragraphs
+PARAGRAPH_FILL = 0.7
+
+# A unit ends after sentence punctuation (and closing quotes/brackets) followed by whitespace, or at a blank line
+BOUNDARY_PATTERN = re.compile(r"[.!?]+[\"')\]]*\s+|\n[ \t]*\n\s*")
+WORD_PATTERN = re.compile(r"\S+\s*")
+
+# Joins consecutive pages; a sentence running over a page break reads on as one sentence
+PAGE_SEPARATOR = " "
+
+def text_units(text):
+    """Yield (start, end, paragraph_end) for the sentences and paragraphs of text, in one pass"""
+    start = 0
+    for match in BOUNDARY_PATTERN.finditer(text):
+        yield start, match.end(), match.group().count("\n") >= 2
+        start = match.end()
+    if start < len(text):
+        yield start, len(text), True
+
+def _split_unit(text, start, end, max_tokens, count):
+    """Cut an over-long unit into (start, end, tokens) pieces of at most max_tokens at word boundaries"""
+    piece_start, piece_tokens = start, 0
+    for match in WORD_PATTERN.finditer(text, start, end):
+        tokens = count(match.group())
+        if tokens > max_tokens:
+            # One word longer than a chunk: flush, then cut it by characters
+            if piece_tokens:
+                yield piece_start, match.start(), piece_tokens
+            step = max(1, (match.end() - match.start()) * max_tokens // tokens)
+            for cut in range(match.start(), match.end(), step):
+                cut_end = min(cut + step, match.end())
+                yield cut, cut_end, count(text[cut:cut_end])
+            piece_start, piece_tokens = match.end(), 0
+            continue
+        if piece_tokens and piece_tokens + tokens > max_tokens:
+            yield piece_start, match.start(), piece_tokens
+            piece_start, piece_tokens = match.start(), 0
+        piece_tokens += tokens
+    if piece_tokens:
+        yield piece_start, end, piece_tokens
+
+def _trimmed(text, start, end):
+    """Span without leading and trailing whitespace"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+def chunk_spans(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, count=None):
+    """Return the (start, end) spans of text's chunks.
+
+    ``count`` is the size measure of a piece of text (token counts by
+    default; ``len`` sizes chunks in characters). Runs in time linear in
+    the length of the text: every unit is counted once and enters and
+    leaves the packing window once.
+    """
+    if max_tokens <= 0:
+        raise ValueError("max_tokens must be positive")
+    if not 0 <= overlap_tokens < max_tokens:
+        raise ValueError("overlap_tokens must be at least 0 and smaller than max_tokens")
+    count = count or count_tokens
+
+    spans = []
+    window = []  # (start, end, tokens, paragraph_end) units of the chunk being packed
+    first = 0    # index of the window's first unit
+    total = 0
+    for start, end, paragraph_end in text_units(text):
+        tokens = count(text[start:end])
+        if tokens > max_tokens:
+            piece_tokens = overlap_tokens or max_tokens
+            pieces = [(s, e, t, False) for s, e, t in _split_unit(text, start, end, piece_tokens, count)]
+        else:
+            pieces = [(start, end, tokens, paragraph_end)]
+
+        for unit in pieces:
+            full = total + unit[2] > max_tokens
+            at_paragraph = first < len(window) and window[-1][3] and total >= max_tokens * PARAGRAPH_FILL
+            if first < len(window) and (full or at_paragraph):
+                span = _trimmed(text, window[first][0], window[-1][1])
+                if span[0] < span[1]:
+                    spans.append(span)
+                # Carry whole trailing units into the next chunk as its overlap
+                while first < len(window) and (total > overlap_tokens or total + unit[2] > max_tokens):
+                    total -= window[first][2]
+                    first += 1
+                # Drop consumed units now and then so the window stays small
+                if first > 1024:
+                    del window[:first]
+                    first = 0
+            window.append(unit)
+            total += unit[2]
+
+    if first < len(window):
+        span = _trimmed(text, window[first][0], window[-1][1])
+        if span[0] < span[1]:
+            spans.append(span)
+    return spans
+
+def materialize(text, spans):
+    """The chunk strings of a list of spans"""
+    return [text[start:end] for start, end in spans]
+
+def join_pages(pages):
+    """One text for a sequence of page texts, and the offset at which each page starts"""
+    parts, starts = [], []
+    offset = 0
+    for text in pages:
+        if parts:
+            parts.append(PAGE_SEPARATOR)
+            offset += len(PAGE_SEPARATOR)
+        starts.append(offset)
+        parts.append(text)
+        offset += len(text)
+    return "".join(parts), starts
+
+def span_pages(page_starts, start, end):
+    """Positions (in join_pages order) of the first and last page a [start, end) span covers"""
+    return bisect_right(page_starts, start) - 1, bisect_right(page_starts, max(start, end - 1)) - 1
@@ -0,0 +1,7 @@
+import os
+
+# test_markdown_demo.py is a GUI demo script (it opens a window on import), not a test module
+collect_ignore = ["test_markdown_demo.py"]
+
+# Modules create their OpenAI client on import; the tests never call the API
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,161 @@
+"""
+Exact and near-duplicate chunk detection.
+
+Manuals repeat the same boilerplate (legal footers, safety notices,
+headers) page after page. Embedding and storing every copy costs API
+calls and index space, and the copies crowd real content out of top_k.
+
+Exact duplicates (the same text after whitespace normalization and
+casefolding) are found by a hash. Near duplicates are found by MinHash
+signatures over word shingles, which estimate the Jaccard similarity of
+two chunks' shingle sets. Locality-sensitive hashing over bands of the
+signature finds candidate pairs without comparing every pair, and a
+candidate is a duplicate when its estimated similarity reaches
+DUPLICATE_THRESHOLD.
+
+collapse_duplicates keeps the first chunk of each group and lists where
+its copies were ('page', 'page_end', 'chunk_id') in its 'duplicates'
+entry, so one vector is embedded and stored for all of them.
+
+Only exact duplicates are collapsed by default. Near-duplicate collapse
+is opt-in (a threshold, or dedup="near" when loading): two chunks that
+differ only in an identifier (a part number, version or error code) are
+near duplicates, and since only the first copy's text is kept, the other
+identifier would drop out of both the vector and the keyword index. Chunks are
+compared within one document, so every stored row still belongs to
+exactly one document and removing or replacing a document never touches
+another's rows.
+
+Usage:
+    python dedup.py <file.pdf|file.txt> [--threshold 0.85]
+"""
+
+import re
+import sys
+import zlib
+import argparse
+import numpy as np
+from cache_manager import normalize_text
+
+# Words per shingle (chunks with fewer words are one shingle)
+SHINGLE_WORDS = 3
+
+# Signature length, cut into LSH bands of 4 values: pairs above ~0.5 similarity become candidates
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+
+# Estimated Jaccard similarity from which a chunk counts as a copy of an earlier one (near-duplicate mode)
+DUPLICATE_THRESHOLD = 0.85
+
+# "exact" collapses identical chunks only, "near" also collapses near duplicates at DUPLICATE_THRESHOLD
+DEDUP_MODES = ("exact", "near")
+
+# Fixed so signatures are the same in every process and run
+MINHASH_SEED = 1
+
+_PRIME = (1 << 31) - 1
+_WORD = re.compile(r"\w+")
+
+_rng = np.random.default_rng(MINHASH_SEED)
+_MULTIPLIERS = _rng.integers(1, _PRIME, MINHASH_PERMUTATIONS, dtype=np.int64)[:, None]
+_OFFSETS = _rng.integers(0, _PRIME, MINHASH_PERMUTATIONS, dtype=np.int64)[:, None]
+
+def shingles(text):
+    """Hashes of the casefolded word shingles of text"""
+    words = _WORD.findall(text.casefold())
+    if len(words) <= SHINGLE_WORDS:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    return np.unique(np.array([zlib.crc32(gram.encode("utf-8")) % _PRIME for gram in grams], dtype=np.int64))
+
+def minhash(text):
+    """MinHash signature of text's shingles, or None for a text without words"""
+    hashes = shingles(text)
+    if not len(hashes):
+        return None
+    return ((_MULTIPLIERS * hashes + _OFFSETS) % _PRIME).min(axis=1)
+
+def find_duplicates(texts, threshold=None):
+    """For each text, the index of the earlier text it duplicates (its own index if none).
+
+    Without a threshold (or one of 1 or more) only exact duplicates count.
+    """
+    canonical = list(range(len(texts)))
+    exact = {}
+    signatures = {}
+    buckets = {}  # (band, band values) -> indexes of kept texts
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    for i, text in enumerate(texts):
+        key = normalize_text(text).casefold()
+        if key in exact:
+            canonical[i] = exact[key]
+            continue
+        exact[key] = i
+        if threshold is None or threshold >= 1:
+            continue
+        signature = minhash(text)
+        if signature is None:
+            continue
+
+        bands = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(LSH_BANDS)]
+        checked = set()
+        match = None
+        for band in bands:
+            for j in buckets.get(band, ()):
+                if j in checked:
+                    continue
+                checked.add(j)
+                if np.mean(signatures[j] == signature) >= threshold:
+                    match = j
+                    break
+            if match is not None:
+                break
+        if match is not None:
+            canonical[i] = exact[key] = match
+            continue
+
+        signatures[i] = signature
+        for band in bands:
+            buckets.setdefault(band, []).append(i)
+    return canonical
+
+def _provenance(record):
+    return {key: record[key] for key in ("page", "page_end", "chunk_id") if key in record}
+
+def collapse_duplicates(records, threshold=None):
+    """One document's chunk records with copies folded into the 'duplicates' list of the first one.
+
+    Exact copies only, unless a near-duplicate threshold is given.
+    """
+    canonical = find_duplicates([record["text"] for record in records], threshold)
+    collapsed = {}
+    for i, record in enumerate(records):
+        if canonical[i] == i:
+            collapsed[i] = dict(record)
+        else:
+            collapsed[canonical[i]].setdefault("duplicates", []).append(_provenance(record))
+    return list(collapsed.values())
+
+def _main(argv):
+    from document_loader import iter_documents
+
+    parser = argparse.ArgumentParser(description="Report the duplicate chunks of documents")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--threshold", type=float, default=DUPLICATE_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    for file_path, records, error in iter_documents(args.files, dedup=None):
+        if error is not None:
+            print(f"Error processing {file_path}: {error}")
+            continue
+        kept = collapse_duplicates(records, args.threshold)
+        print(f"{file_path}: {len(records)} chunks, {len(records) - len(kept)} duplicates")
+        for record in kept:
+            if record.get("duplicates"):
+                pages = sorted({copy.get("page") for copy in record["duplicates"]})
+                print(f"  {len(record['duplicates']) + 1}x (p.{record.get('page')}, copies on p.{pages}): "
+                      f"{record['text'][:80]!r}")
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
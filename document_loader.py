@@ -1,93 +1,230 @@
-from PyPDF2 import PdfReader
-import re
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 import os
+from chunker import chunk_spans, materialize, join_pages, span_pages
+from dedup import collapse_duplicates, DEDUP_MODES, DUPLICATE_THRESHOLD
+from text_cleaner import DEFAULT_CLEANER
+from pdf_document import PdfDocument, get_pdf_cache
+
+# PDFs at least this large are split into page ranges across worker processes
+LARGE_PDF_BYTES = 20 * 1024 * 1024
+PAGES_PER_TASK = 50
+
+# "document" chunks a PDF as one text (chunks may span pages); "page" chunks every page on its own
+CHUNK_MODES = ("document", "page")
+DEFAULT_CHUNK_MODE = "document"
+
+def iter_pdf_pages(file_path, keep_empty=False):
+    """Yield the stripped text of each non-empty PDF page (every page with keep_empty), one page at a time"""
+    document = PdfDocument(file_path)
+    yield from document.iter_pages(keep_empty)
+    # Metadata and preview come from the same parse, so later lookups need not reopen the file
+    document.remember()
 
 def load_pdf(file_path):
     """Load PDF and extract text from all pages"""
-    reader = PdfReader(file_path)
-    texts = []
-    for page in reader.pages:
-        text = page.extract_text()
-        if text.strip():  # Only add non-empty pages
-            texts.append(text.strip())
-    return texts
-
-def clean_text(text):
-    """Clean and normalize text"""
-    # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text)
-    # Remove page numbers and headers/footers (simple patterns)
-    text = re.sub(r'^\d+\s*$', '', text, flags=re.MULTILINE)
-    return text.strip()
+    return list(iter_pdf_pages(file_path))
+
+def clean_text(text, cleaner=None):
+    """Clean and normalize text (ligatures, page-number lines, hyphenation, whitespace)"""
+    return (cleaner or DEFAULT_CLEANER).clean(text)
 
 def chunk_text(text, chunk_size=1000, overlap=200):
-    """Split text into overlapping chunks for better context preservation"""
-    if len(text) <= chunk_size:
-        return [text]
+    """Split text into overlapping chunks of at most chunk_size characters, broken at sentence boundaries"""
+    return materialize(text, chunk_spans(text, chunk_size, overlap, count=len))
+
+def _extract_page_range(file_path, start, stop):
+    """Extract stripped text for pages [start, stop) of a PDF (runs in worker processes).
+
+    The task holding the first page also returns the file's PDF info cache
+    entry (else None), read from the same parse; the parent process stores it.
+    """
+    document = PdfDocument(file_path, cache=False)
+    texts = list(document.iter_pages(True, start, stop))
+    return texts, document.entry() if start == 0 else None
+
+def _pdf_chunks(file_path, texts, chunk_mode=DEFAULT_CHUNK_MODE, cleaner=None):
+    """Chunk records for the page texts of one PDF (every page, so empty ones keep the numbering)"""
+    if chunk_mode not in CHUNK_MODES:
+        raise ValueError(f"Unknown chunk mode {chunk_mode!r}; choose one of {CHUNK_MODES}")
+    name = os.path.basename(file_path)
     
-    chunks = []
-    start = 0
+    # Clean the text (running headers/footers are learned from all pages of the document)
+    pages = list(enumerate((cleaner or DEFAULT_CLEANER).clean_pages(texts), 1))
+    pages = [(page_num, text) for page_num, text in pages if text]
     
-    while start < len(text):
-        end = start + chunk_size
-        
-        # Try to break at sentence boundaries
-        if end < len(text):
-            # Look for sentence endings within the last 100 characters
-            sentence_end = text.rfind('.', start, end)
-            if sentence_end > start + chunk_size * 0.7:  # If we found a sentence end reasonably close
-                end = sentence_end + 1
-        
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        
-        # Move start position with overlap
-        start = end - overlap
-        if start >= len(text):
-            break
+    if chunk_mode == "page":
+        for page_num, cleaned_text in pages:
+            # Chunk the text (sized in tokens, as the embedding API counts them)
+            chunks = materialize(cleaned_text, chunk_spans(cleaned_text))
+            
+            for chunk_num, chunk in enumerate(chunks):
+                yield {
+                    'text': chunk,
+                    'source_file': file_path,
+                    'page': page_num,
+                    'page_end': page_num,
+                    'chunk_id': f"{name}_p{page_num}_c{chunk_num}"
+                }
+        return
     
-    return chunks
+    # One text for the whole document, so short pages and sentences over a page break are not cut off
+    text, page_starts = join_pages([cleaned_text for _, cleaned_text in pages])
+    for chunk_num, (start, end) in enumerate(chunk_spans(text)):
+        first, last = span_pages(page_starts, start, end)
+        yield {
+            'text': text[start:end],
+            'source_file': file_path,
+            'page': pages[first][0],
+            'page_end': pages[last][0],
+            'chunk_id': f"{name}_p{pages[first][0]}_c{chunk_num}"
+        }
 
-def load_and_chunk(files):
-    """Load multiple PDFs and return all chunks with metadata"""
-    all_chunks = []
+def _text_file_chunks(file_path, cleaner=None):
+    """Chunk records for a plain text file"""
+    with open(file_path, "r", encoding="utf-8") as file:
+        text = file.read()
+    cleaned_text = clean_text(text, cleaner)
+    chunks = materialize(cleaned_text, chunk_spans(cleaned_text))
     
+    return [{
+        'text': chunk,
+        'source_file': file_path,
+        'page': 1,
+        'chunk_id': f"{os.path.basename(file_path)}_c{chunk_num}"
+    } for chunk_num, chunk in enumerate(chunks)]
+
+def _report_error(file_path, error, errors):
+    print(f"Error processing {file_path}: {error}")
+    if errors is not None:
+        errors.append((file_path, str(error)))
+
+def _iter_documents_serial(files, chunk_mode, cleaner):
     for file_path in files:
-        if file_path.endswith(".pdf"):
-            print(f"Processing PDF: {file_path}")
-            texts = load_pdf(file_path)
+        try:
+            if file_path.lower().endswith(".pdf"):
+                print(f"Processing PDF: {file_path}")
+                records = list(_pdf_chunks(file_path, iter_pdf_pages(file_path, keep_empty=True), chunk_mode, cleaner))
+            else:
+                # Handle other file types
+                records = _text_file_chunks(file_path, cleaner)
+        except Exception as e:
+            yield file_path, [], e
+            continue
+        yield file_path, records, None
+
+def _submit_file(executor, file_path):
+    """Queue extraction of one PDF, split into page ranges if it is large"""
+    if os.path.getsize(file_path) < LARGE_PDF_BYTES:
+        return [executor.submit(_extract_page_range, file_path, 0, None)]
+    num_pages = PdfDocument(file_path).page_count
+    return [
+        executor.submit(_extract_page_range, file_path, start, min(start + PAGES_PER_TASK, num_pages))
+        for start in range(0, num_pages, PAGES_PER_TASK)
+    ]
+
+def _iter_documents_parallel(files, workers, chunk_mode, cleaner):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep a bounded window of queued work so results stream back in file order
+        max_queued = workers * 4
+        queued = deque()
+        queued_tasks = 0
+        remaining = iter(files)
+        
+        while True:
+            while queued_tasks < max_queued:
+                file_path = next(remaining, None)
+                if file_path is None:
+                    break
+                futures = None
+                if file_path.lower().endswith(".pdf"):
+                    try:
+                        futures = _submit_file(executor, file_path)
+                    except Exception as e:
+                        futures = e
+                tasks = len(futures) if isinstance(futures, list) else 1
+                queued.append((file_path, futures, tasks))
+                queued_tasks += tasks
             
-            for page_num, text in enumerate(texts, 1):
-                # Clean the text
-                cleaned_text = clean_text(text)
-                if not cleaned_text:
-                    continue
-                
-                # Chunk the text
-                chunks = chunk_text(cleaned_text)
-                
-                for chunk_num, chunk in enumerate(chunks):
-                    all_chunks.append({
-                        'text': chunk,
-                        'source_file': file_path,
-                        'page': page_num,
-                        'chunk_id': f"{os.path.basename(file_path)}_p{page_num}_c{chunk_num}"
-                    })
-        else:
-            # Handle other file types
-            with open(file_path, "r", encoding="utf-8") as file:
-                text = file.read()
-                cleaned_text = clean_text(text)
-                chunks = chunk_text(cleaned_text)
-                
-                for chunk_num, chunk in enumerate(chunks):
-                    all_chunks.append({
-                        'text': chunk,
-                        'source_file': file_path,
-                        'page': 1,
-                        'chunk_id': f"{os.path.basename(file_path)}_c{chunk_num}"
-                    })
+            if not queued:
+                break
+            
+            file_path, futures, tasks = queued.popleft()
+            queued_tasks -= tasks
+            try:
+                if isinstance(futures, Exception):
+                    raise futures
+                if futures is None:
+                    # Handle other file types
+                    records = _text_file_chunks(file_path, cleaner)
+                else:
+                    print(f"Processing PDF: {file_path}")
+                    results = [future.result() for future in futures]
+                    pages = [text for texts, _ in results for text in texts]
+                    cache = get_pdf_cache()
+                    if cache is not False and results[0][1] is not None:
+                        cache.put_entry(results[0][1])
+                    records = list(_pdf_chunks(file_path, pages, chunk_mode, cleaner))
+            except Exception as e:
+                yield file_path, [], e
+                continue
+            yield file_path, records, None
+
+def auto_workers(files):
+    """Worker count for load_and_chunk: a process pool only pays off for several or large PDFs"""
+    pdfs = [file_path for file_path in files if file_path.lower().endswith(".pdf") and os.path.exists(file_path)]
+    if len(pdfs) < 2 and sum(os.path.getsize(file_path) for file_path in pdfs) < LARGE_PDF_BYTES:
+        return 1
+    return os.cpu_count() or 1
+
+def _collapse_documents(documents, threshold):
+    for file_path, records, error in documents:
+        yield file_path, collapse_duplicates(records, threshold), error
+
+def iter_documents(files, workers=1, chunk_mode=DEFAULT_CHUNK_MODE, dedup="exact", cleaner=None):
+    """Yield (file_path, chunk_records, error) for each file, in order.
+
+    With workers > 1 (or None for auto_workers) PDF text is extracted across
+    a process pool, large PDFs split into page ranges, and results are
+    yielded in the same order and with the same content as the serial path.
+    A file that fails to load yields its exception and no records.
+    Records carry the span of PDF pages they cover ('page' to 'page_end').
+    Duplicate chunks of a document are collapsed into the first copy, which
+    lists the others under 'duplicates': identical ones with dedup="exact",
+    near duplicates too with "near" (which can drop a copy that differs only
+    in an identifier), none with None.
+    ``cleaner`` is a text_cleaner.TextCleaner (all cleaning steps by default).
+    """
+    if dedup and dedup not in DEDUP_MODES:
+        raise ValueError(f"Unknown dedup mode {dedup!r}; choose one of {DEDUP_MODES} or None")
+    if workers is None:
+        workers = auto_workers(files)
+    if workers > 1:
+        documents = _iter_documents_parallel(files, workers, chunk_mode, cleaner)
+    else:
+        documents = _iter_documents_serial(files, chunk_mode, cleaner)
+    if not dedup:
+        return documents
+    return _collapse_documents(documents, DUPLICATE_THRESHOLD if dedup == "near" else None)
+
+def iter_chunks(files, workers=1, errors=None, chunk_mode=DEFAULT_CHUNK_MODE, dedup="exact", cleaner=None):
+    """Yield chunk records for files in order.
+
+    A file that fails to load is reported (and appended to ``errors`` as
+    (file_path, message)) without stopping the others.
+    """
+    for file_path, records, error in iter_documents(files, workers, chunk_mode, dedup, cleaner):
+        if error is not None:
+            _report_error(file_path, error, errors)
+            continue
+        yield from records
+
+def load_and_chunk(files, workers=1, errors=None, chunk_mode=DEFAULT_CHUNK_MODE, dedup="exact", cleaner=None):
+    """Load multiple PDFs and return all chunks with metadata"""
+    all_chunks = list(iter_chunks(files, workers=workers, errors=errors, chunk_mode=chunk_mode, dedup=dedup,
+                                  cleaner=cleaner))
     
-    print(f"Created {len(all_chunks)} chunks from {len(files)} files")
+    duplicates = sum(len(chunk.get('duplicates', ())) for chunk in all_chunks)
+    print(f"Created {len(all_chunks)} chunks from {len(files)} files"
+          + (f" ({duplicates} duplicate chunks collapsed)" if duplicates else ""))
     return all_chunks
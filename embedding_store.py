@@ -0,0 +1,688 @@
+"""
+Binary on-disk embedding store.
+
+A store is a directory holding:
+
+    manifest.json    format name/version, model, vector dimension, row count,
+                     the data files in use, per-document row ranges,
+                     fingerprints and PDF metadata, and the row ranges of
+                     deleted documents
+    vectors.f32      row-major float32 matrix of L2-normalized embeddings
+                     (vectors.f16, float16, in a store opened with dtype="float16")
+    records.jsonl    one {"chunk": ..., "metadata": ...} line per row
+    records.offsets  uint64 byte offset of every line in records.jsonl (plus the end)
+    records.pages    int32 page number of every row, for page-range filters
+    ann_ivf.npz      optional IVF index (see ann_index.py) for approximate search
+    lexical_bm25.npz BM25 inverted index over the chunk texts (see lexical_index.py),
+                     updated at ingestion time
+    quantized.npz    optional float16, int8 or product-quantized codes of the
+                     vectors (see quantization.py), scanned instead of
+                     the vectors to keep query nodes' memory small
+
+Vectors and record offsets are opened with np.memmap, so opening an index
+costs a few small reads no matter how many chunks it holds, and processes
+opening the same store share its pages through the OS page cache. Chunk
+texts and metadata are decoded only for the rows a search actually returns.
+
+The manifest is the single commit point: it is rewritten atomically after
+every change, and bytes past its row count (left by an interrupted write)
+are truncated the next time the store is written to. Data files are only
+ever appended to; removing a document tombstones its rows, and compaction
+writes a new generation of data files rather than rewriting the ones an
+open index may still have mapped.
+
+A store whose searches scan quantized codes only needs the full vectors
+to re-rank a few candidates per query, so they can be kept as float16
+(half the disk, see set_dtype); appends, compaction and every index then
+read and write float16 rows.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import threading
+import numpy as np
+from vector_search import VectorIndex, normalize_rows, document_row_ranges, page_numbers
+from ann_index import IVFIndex, ANN_FILE
+from lexical_index import LexicalIndex, LEXICAL_FILE
+from quantization import QuantizedIndex, QUANTIZED_FILE, PQ_SUBVECTOR_DIMS
+
+STORE_FORMAT = "document-qa-store"
+STORE_VERSION = 2
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.f32"
+
+# Element types the vectors file can hold, with their file name suffix
+VECTOR_DTYPES = {"float32": "f32", "float16": "f16"}
+RECORDS_FILE = "records.jsonl"
+OFFSETS_FILE = "records.offsets"
+PAGES_FILE = "records.pages"
+
+# Compact once this fraction of rows belongs to removed documents
+COMPACT_THRESHOLD = 0.25
+
+# Rows copied per step while compacting
+COMPACT_BLOCK_ROWS = 65536
+
+def _write_json_atomic(path, data):
+    """Write JSON to a temp file and move it into place"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _data_files(generation, dtype="float32"):
+    """File names for one generation of data files"""
+    if generation == 0:
+        return {"vectors": f"vectors.{VECTOR_DTYPES[dtype]}", "records": RECORDS_FILE, "offsets": OFFSETS_FILE,
+                "pages": PAGES_FILE}
+    return {
+        "vectors": f"vectors.{generation}.{VECTOR_DTYPES[dtype]}",
+        "records": f"records.{generation}.jsonl",
+        "offsets": f"records.{generation}.offsets",
+        "pages": f"records.{generation}.pages"
+    }
+
+def _merge_ranges(ranges):
+    """Sort [start, stop) ranges and merge the ones that touch"""
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return merged
+
+def file_fingerprint(file_path):
+    """Size, modification time and SHA-256 of a file, used to detect changes"""
+    stat = os.stat(file_path)
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest.hexdigest()}
+
+class RecordTable:
+    """Lazy, read-only view of records.jsonl indexed by row"""
+
+    def __init__(self, records_path, offsets):
+        self.records_path = records_path
+        self.offsets = offsets
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return max(len(self.offsets) - 1, 0)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        start, stop = int(self.offsets[row]), int(self.offsets[row + 1])
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.records_path, "rb")
+            self._file.seek(start)
+            data = self._file.read(stop - start)
+        return json.loads(data)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def column(self, key, default=None):
+        """Sequence view over one field of every record"""
+        return _RecordColumn(self, key, default)
+
+class _RecordColumn:
+    """Sequence of a single record field, decoded on access"""
+
+    def __init__(self, table, key, default):
+        self.table = table
+        self.key = key
+        self.default = default
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, row):
+        return self.table[row].get(self.key, self.default)
+
+    def __iter__(self):
+        for record in self.table:
+            yield record.get(self.key, self.default)
+
+class EmbeddingStore:
+    """Binary store of normalized embeddings plus their chunk records.
+
+    Rows are grouped into documents by their source_file; documents can be
+    added, removed and replaced in place without rebuilding the store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(self._join(MANIFEST_FILE), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != STORE_FORMAT:
+            raise ValueError(f"{path} is not an embedding store")
+        if self.manifest.get("version", 0) > STORE_VERSION:
+            raise ValueError(
+                f"Embedding store version {self.manifest['version']} is newer than supported ({STORE_VERSION})"
+            )
+        self._upgrade_manifest()
+        self.documents = self.manifest["documents"]
+
+    def _upgrade_manifest(self):
+        """Fill in fields missing from stores written by older versions"""
+        manifest = self.manifest
+        manifest.setdefault("generation", 0)
+        manifest.setdefault("files", _data_files(manifest["generation"]))
+        manifest.setdefault("revision", 0)
+        manifest.setdefault("deleted", [])
+        documents = manifest.setdefault("documents", {})
+        for source, doc in documents.items():
+            # Version 1 stored just the list of row ranges
+            if isinstance(doc, list):
+                documents[source] = {"rows": doc, "fingerprint": None}
+        manifest["version"] = STORE_VERSION
+
+    @classmethod
+    def create(cls, path, model="text-embedding-3-small", dtype="float32"):
+        """Create an empty store at path, replacing any existing one (vectors kept as float32 or float16)"""
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unknown vector dtype {dtype!r}; choose one of {tuple(VECTOR_DTYPES)}")
+        os.makedirs(path, exist_ok=True)
+
+        # Start a new generation so files an open index has mapped are left alone
+        generation = 0
+        if cls.exists(path):
+            try:
+                generation = cls(path).manifest["generation"] + 1
+            except (ValueError, KeyError):
+                generation = 1
+        files = _data_files(generation, dtype)
+
+        for key in ("vectors", "records", "pages"):
+            open(os.path.join(path, files[key]), "wb").close()
+        with open(os.path.join(path, files["offsets"]), "wb") as f:
+            f.write(np.zeros(1, dtype=np.uint64).tobytes())
+        _write_json_atomic(os.path.join(path, MANIFEST_FILE), {
+            "format": STORE_FORMAT,
+            "version": STORE_VERSION,
+            "model": model,
+            "dim": None,
+            "count": 0,
+            "dtype": dtype,
+            "normalized": True,
+            "revision": 0,
+            "generation": generation,
+            "files": files,
+            "documents": {},
+            "deleted": []
+        })
+        store = cls(path)
+        store._remove_stale_files()
+        return store
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+    def _join(self, name):
+        return os.path.join(self.path, name)
+
+    def _data(self, key):
+        return self._join(self.manifest["files"][key])
+
+    def __len__(self):
+        return self.manifest["count"]
+
+    @property
+    def dim(self):
+        return self.manifest["dim"]
+
+    @property
+    def dtype(self):
+        """Element type of the stored vectors (float32 or float16)"""
+        return np.dtype(self.manifest.get("dtype", "float32"))
+
+    @property
+    def revision(self):
+        """Counter bumped on every committed change, usable as an index version"""
+        return self.manifest["revision"]
+
+    @property
+    def deleted_count(self):
+        return sum(stop - start for start, stop in self.manifest["deleted"])
+
+    def commit(self):
+        """Atomically publish the in-memory manifest"""
+        self.manifest["revision"] += 1
+        _write_json_atomic(self._join(MANIFEST_FILE), self.manifest)
+
+    def _remove_stale_files(self):
+        """Delete data files from earlier generations (best effort: they may still be mapped)"""
+        current = set(self.manifest["files"].values())
+        for name in os.listdir(self.path):
+            if name.startswith(("vectors", "records")) and name not in current:
+                try:
+                    os.remove(self._join(name))
+                except OSError:
+                    pass
+
+    def _read_offset(self, row):
+        """Read one record offset without mapping the file (keeps it truncatable on Windows)"""
+        with open(self._data("offsets"), "rb") as f:
+            f.seek(row * 8)
+            return int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+
+    def _truncate_to_manifest(self):
+        """Drop bytes written after the last committed row"""
+        count = len(self)
+        sizes = {
+            "vectors": count * (self.dim or 0) * self.dtype.itemsize,
+            "offsets": (count + 1) * 8,
+            "records": self._read_offset(count),
+        }
+        if "pages" in self.manifest["files"]:
+            sizes["pages"] = count * 4
+        for key, size in sizes.items():
+            if os.path.getsize(self._data(key)) > size:
+                with open(self._data(key), "r+b") as f:
+                    f.truncate(size)
+
+    def _append_rows(self, embeddings):
+        """Write rows to the data files and record them in the manifest (uncommitted)"""
+        matrix = np.array([e["embedding"] for e in embeddings], dtype=np.float32)
+        if self.dim is None:
+            self.manifest["dim"] = int(matrix.shape[1])
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {matrix.shape[1]}")
+        matrix = normalize_rows(matrix).astype(np.float32)
+
+        self._ensure_pages()
+        self._truncate_to_manifest()
+        start = len(self)
+        end_offset = self._read_offset(start)
+
+        lines = []
+        offsets = []
+        for e in embeddings:
+            line = json.dumps({"chunk": e["chunk"], "metadata": e.get("metadata", {})}).encode("utf-8") + b"\n"
+            lines.append(line)
+            end_offset += len(line)
+            offsets.append(end_offset)
+
+        with open(self._data("vectors"), "ab") as f:
+            f.write(matrix.astype(self.dtype).tobytes())
+        with open(self._data("records"), "ab") as f:
+            f.write(b"".join(lines))
+        with open(self._data("offsets"), "ab") as f:
+            f.write(np.array(offsets, dtype=np.uint64).tobytes())
+        with open(self._data("pages"), "ab") as f:
+            f.write(page_numbers(e.get("metadata", {}) for e in embeddings).tobytes())
+
+        stop = start + len(embeddings)
+        ranges = document_row_ranges([e.get("metadata", {}) for e in embeddings], start)
+        for source, source_ranges in ranges.items():
+            doc = self.documents.setdefault(source, {"rows": [], "fingerprint": None})
+            doc["rows"] = _merge_ranges(doc["rows"] + source_ranges)
+        self.manifest["count"] = stop
+        return (start, stop)
+
+    def _ensure_pages(self):
+        """Write the page number file for a store created before it existed (uncommitted)"""
+        if "pages" in self.manifest["files"]:
+            return
+        name = _data_files(self.manifest["generation"])["pages"]
+        with open(self._join(name), "wb") as f:
+            f.write(page_numbers(self.records().column("metadata", {})).tobytes())
+        self.manifest["files"]["pages"] = name
+
+    def _remove_rows(self, source_file):
+        """Tombstone a document's rows (uncommitted); returns the number of rows removed"""
+        doc = self.documents.pop(source_file)
+        self.manifest["deleted"] = _merge_ranges(self.manifest["deleted"] + doc["rows"])
+        return sum(stop - start for start, stop in doc["rows"])
+
+    def set_fingerprint(self, source_file, fingerprint, commit=True):
+        """Record the file fingerprint of a document (marks it as completely indexed)"""
+        self.documents.setdefault(source_file, {"rows": [], "fingerprint": None})["fingerprint"] = fingerprint
+        if commit:
+            self.commit()
+
+    def set_document_info(self, source_file, info, commit=True):
+        """Record a document's PDF metadata (author, title, dates...) for filtered searches"""
+        self.documents.setdefault(source_file, {"rows": [], "fingerprint": None})["info"] = info
+        if commit:
+            self.commit()
+
+    def append(self, embeddings, commit=True):
+        """Append create_embeddings-style dicts; returns the new row range.
+
+        With commit=False the rows are written but only become visible (and
+        survive a crash) at the next commit, which lets bulk writers
+        checkpoint at their own pace.
+        """
+        if not embeddings:
+            return (len(self), len(self))
+        rows = self._append_rows(embeddings)
+        if commit:
+            self.commit()
+        return rows
+
+    def add_documents(self, embeddings, fingerprints=None):
+        """Append rows for one or more documents, recording their file fingerprints"""
+        if embeddings:
+            self._append_rows(embeddings)
+        for source_file, fingerprint in (fingerprints or {}).items():
+            self.set_fingerprint(source_file, fingerprint, commit=False)
+        self.commit()
+
+    def remove_document(self, source_file, commit=True):
+        """Tombstone every row of a document; returns the number of rows removed"""
+        if source_file not in self.documents:
+            return 0
+        removed = self._remove_rows(source_file)
+        if commit:
+            self.commit()
+        return removed
+
+    def remove_document_rows(self, source_file, start=0, stop=None, commit=True):
+        """Tombstone the rows of a document that lie in [start, stop); returns the number removed.
+
+        A document left without rows or a fingerprint (never completely
+        indexed) is forgotten.
+        """
+        doc = self.documents.get(source_file)
+        if doc is None:
+            return 0
+        stop = len(self) if stop is None else stop
+        removed, kept = [], []
+        for range_start, range_stop in doc["rows"]:
+            cut_start, cut_stop = max(range_start, start), min(range_stop, stop)
+            if cut_start < cut_stop:
+                removed.append([cut_start, cut_stop])
+                kept.extend(part for part in ([range_start, cut_start], [cut_stop, range_stop]) if part[0] < part[1])
+            else:
+                kept.append([range_start, range_stop])
+        doc["rows"] = kept
+        self.manifest["deleted"] = _merge_ranges(self.manifest["deleted"] + removed)
+        if not kept and not doc.get("fingerprint"):
+            del self.documents[source_file]
+        if commit:
+            self.commit()
+        return sum(range_stop - range_start for range_start, range_stop in removed)
+
+    def update_document(self, source_file, embeddings, fingerprint=None):
+        """Replace a document's rows with new ones in a single commit"""
+        if source_file in self.documents:
+            self._remove_rows(source_file)
+        if embeddings:
+            self._append_rows(embeddings)
+        self.set_fingerprint(source_file, fingerprint, commit=False)
+        self.commit()
+
+    def document_status(self, file_path):
+        """Return 'new', 'changed' or 'unchanged' for a file compared to its indexed version.
+
+        Size and mtime are checked first; the file is only hashed when the
+        size matches but the mtime does not, so an unchanged folder costs
+        one stat per file.
+        """
+        doc = self.documents.get(file_path)
+        if doc is None:
+            return "new"
+        fingerprint = doc.get("fingerprint")
+        if not fingerprint or not os.path.exists(file_path):
+            return "changed"
+        stat = os.stat(file_path)
+        if stat.st_size != fingerprint["size"]:
+            return "changed"
+        if stat.st_mtime == fingerprint["mtime"]:
+            return "unchanged"
+        current = file_fingerprint(file_path)
+        if current["sha256"] == fingerprint["sha256"]:
+            # Touched but not modified: remember the new mtime on the next commit
+            fingerprint["mtime"] = current["mtime"]
+            return "unchanged"
+        return "changed"
+
+    def needs_compaction(self, threshold=COMPACT_THRESHOLD):
+        return len(self) > 0 and self.deleted_count / len(self) >= threshold
+
+    def compact(self, dtype=None):
+        """Rewrite the data files without tombstoned rows as a new generation (vectors as ``dtype`` if given)"""
+        dtype = self.dtype.name if dtype is None else dtype
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unknown vector dtype {dtype!r}; choose one of {tuple(VECTOR_DTYPES)}")
+        if not self.manifest["deleted"] and dtype == self.dtype.name:
+            return
+
+        count = len(self)
+        live = np.ones(count, dtype=bool)
+        for start, stop in self.manifest["deleted"]:
+            live[start:stop] = False
+        new_rows = np.cumsum(live) - 1
+
+        generation = self.manifest["generation"] + 1
+        files = _data_files(generation, dtype)
+        self._ensure_pages()
+        offsets = self.offsets()
+        vectors = self.vectors()
+        pages = self.pages()
+        new_offsets = [0]
+
+        with open(self._join(files["vectors"]), "wb") as vec_out, \
+                open(self._join(files["records"]), "wb") as rec_out, \
+                open(self._data("records"), "rb") as rec_in:
+            for block_start in range(0, count, COMPACT_BLOCK_ROWS):
+                block_stop = min(block_start + COMPACT_BLOCK_ROWS, count)
+                mask = live[block_start:block_stop]
+                vec_out.write(np.ascontiguousarray(vectors[block_start:block_stop][mask], dtype=dtype).tobytes())
+                for row in np.flatnonzero(mask) + block_start:
+                    start, stop = int(offsets[row]), int(offsets[row + 1])
+                    rec_in.seek(start)
+                    rec_out.write(rec_in.read(stop - start))
+                    new_offsets.append(new_offsets[-1] + stop - start)
+        with open(self._join(files["offsets"]), "wb") as f:
+            f.write(np.array(new_offsets, dtype=np.uint64).tobytes())
+        with open(self._join(files["pages"]), "wb") as f:
+            f.write(np.ascontiguousarray(pages[live]).tobytes())
+
+        for doc in self.documents.values():
+            doc["rows"] = _merge_ranges(
+                [int(new_rows[start]), int(new_rows[stop - 1]) + 1] for start, stop in doc["rows"]
+            )
+        removed = self.deleted_count
+        self.manifest.update({
+            "count": int(live.sum()),
+            "generation": generation,
+            "files": files,
+            "dtype": dtype,
+            "deleted": []
+        })
+        self.commit()
+        self._remove_stale_files()
+        print(f"Compacted embedding store: dropped {removed} deleted rows, vectors stored as {dtype}")
+
+        # Row ids changed, so an existing ANN index is rebuilt with the same settings
+        ann = self.load_ann(current_only=False)
+        if ann is not None and len(self):
+            self.build_ann(nlist=ann.nlist, nprobe=ann.nprobe)
+        if os.path.exists(self._join(LEXICAL_FILE)):
+            self.build_lexical()
+        quantized = self.load_quantized(catch_up=False, current_only=False)
+        if quantized is not None and len(self):
+            subvector_dims = quantized.codebooks.shape[2] if quantized.kind == "pq" else None
+            self.build_quantized(quantized.kind, subvector_dims)
+
+    def compact_if_needed(self, threshold=COMPACT_THRESHOLD):
+        if self.needs_compaction(threshold):
+            self.compact()
+
+    def set_dtype(self, dtype):
+        """Rewrite the vectors as float32 or float16 (a new generation; the indexes are rebuilt)"""
+        self.compact(dtype)
+
+    def vectors(self):
+        """Memory-mapped (count, dim) matrix of normalized embeddings, float32 or float16 (see dtype)"""
+        count = len(self)
+        if count == 0:
+            return np.zeros((0, self.dim or 0), dtype=self.dtype)
+        return np.memmap(self._data("vectors"), dtype=self.dtype, mode="r", shape=(count, self.dim))
+
+    def offsets(self):
+        """Memory-mapped record offsets (count + 1 entries)"""
+        return np.memmap(self._data("offsets"), dtype=np.uint64, mode="r", shape=(len(self) + 1,))
+
+    def records(self):
+        return RecordTable(self._data("records"), self.offsets())
+
+    def pages(self):
+        """Memory-mapped int32 page number of every row, or None for a store written before it was kept"""
+        if "pages" not in self.manifest["files"]:
+            return None
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.int32)
+        return np.memmap(self._data("pages"), dtype=np.int32, mode="r", shape=(len(self),))
+
+    def deleted_mask(self):
+        """Boolean mask of tombstoned rows, or None when nothing is deleted"""
+        if not self.manifest["deleted"]:
+            return None
+        mask = np.zeros(len(self), dtype=bool)
+        for start, stop in self.manifest["deleted"]:
+            mask[start:stop] = True
+        return mask
+
+    def build_ann(self, nlist=None, nprobe=None):
+        """Build and save an IVF index over the live rows for approximate search"""
+        ann = IVFIndex.build(
+            self.vectors(), nlist=nlist, nprobe=nprobe,
+            exclude=self.deleted_mask(), generation=self.manifest["generation"]
+        )
+        ann.save(self._join(ANN_FILE))
+        return ann
+
+    def load_ann(self, current_only=True):
+        """Load the saved IVF index, or None if there is none or it predates the current data files"""
+        path = self._join(ANN_FILE)
+        if not os.path.exists(path):
+            return None
+        ann = IVFIndex.load(path)
+        if current_only and (ann.generation != self.manifest["generation"] or ann.built_rows > len(self)):
+            print(f"Ignoring stale ANN index in {self.path}; rebuild it with: python ann_index.py build {self.path}")
+            return None
+        return ann
+
+    def build_lexical(self):
+        """Build and save the BM25 index over every row's chunk text"""
+        lexical = LexicalIndex.build(self.records().column("chunk", ""), generation=self.manifest["generation"])
+        lexical.save(self._join(LEXICAL_FILE))
+        return lexical
+
+    def update_lexical(self):
+        """Index rows added since the BM25 index was saved (building it if there is none or it is stale)"""
+        lexical = self.load_lexical(catch_up=False)
+        if lexical is None:
+            return self.build_lexical()
+        if lexical.built_rows < len(self):
+            lexical = lexical.update(self.records().column("chunk", ""), len(self))
+            lexical.save(self._join(LEXICAL_FILE))
+        return lexical
+
+    def load_lexical(self, catch_up=True):
+        """Load the saved BM25 index, or None if there is none or it predates the current data files.
+
+        With catch_up, rows committed after it was saved (an interrupted
+        sync) are indexed in memory so they are still found.
+        """
+        path = self._join(LEXICAL_FILE)
+        if not os.path.exists(path):
+            return None
+        lexical = LexicalIndex.load(path)
+        if lexical.generation != self.manifest["generation"] or lexical.built_rows > len(self):
+            print(f"Ignoring stale lexical index in {self.path}; rebuild it with: python lexical_index.py build {self.path}")
+            return None
+        if catch_up and lexical.built_rows < len(self):
+            lexical = lexical.update(self.records().column("chunk", ""), len(self))
+        return lexical
+
+    def build_quantized(self, kind="int8", subvector_dims=None):
+        """Encode every row as float16, int8 or pq codes and save them for compact searches"""
+        quantized = QuantizedIndex.build(
+            self.vectors(), kind, subvector_dims or PQ_SUBVECTOR_DIMS,
+            exclude=self.deleted_mask(), generation=self.manifest["generation"]
+        )
+        quantized.save(self._join(QUANTIZED_FILE))
+        return quantized
+
+    def update_quantized(self):
+        """Encode rows added since the quantized codes were saved (nothing to do if there are none)"""
+        quantized = self.load_quantized(catch_up=False)
+        if quantized is not None and quantized.built_rows < len(self):
+            quantized = quantized.update(self.vectors())
+            quantized.save(self._join(QUANTIZED_FILE))
+        return quantized
+
+    def load_quantized(self, catch_up=True, current_only=True):
+        """Load the saved quantized codes, or None if there are none or they predate the current data files"""
+        path = self._join(QUANTIZED_FILE)
+        if not os.path.exists(path):
+            return None
+        quantized = QuantizedIndex.load(path)
+        if current_only and (quantized.generation != self.manifest["generation"] or quantized.built_rows > len(self)):
+            print(f"Ignoring stale quantized vectors in {self.path}; rebuild them with: "
+                  f"python quantization.py build {self.path} --kind {quantized.kind}")
+            return None
+        if catch_up and quantized.built_rows < len(self):
+            quantized = quantized.update(self.vectors())
+        return quantized
+
+    def load_index(self, use_ann=True, use_lexical=True, use_quantized=True, rerank=None):
+        """Open the store as a VectorIndex without copying vectors into memory"""
+        records = self.records()
+        return VectorIndex(
+            self.vectors(),
+            records.column("chunk", ""),
+            records.column("metadata", {}),
+            normalized=True,
+            documents={source: doc["rows"] for source, doc in self.documents.items()},
+            deleted=self.deleted_mask(),
+            version=self.revision,
+            ann=self.load_ann() if use_ann else None,
+            lexical=self.load_lexical() if use_lexical else None,
+            pages=self.pages(),
+            document_info={source: doc["info"] for source, doc in self.documents.items() if doc.get("info")},
+            quantized=self.load_quantized() if use_quantized else None,
+            rerank=rerank
+        )
+
+def save_store(embeddings, path, model="text-embedding-3-small"):
+    """Write create_embeddings output as a fresh binary store"""
+    store = EmbeddingStore.create(path, model=model)
+    store.append(embeddings)
+    store.build_lexical()
+    return store
+
+def convert_json_to_store(json_path, store_path, batch_size=10000):
+    """One-shot conversion of a legacy embeddings.json file into a binary store"""
+    with open(json_path, "r", encoding="utf-8") as f:
+        embeddings = json.load(f)
+
+    store = EmbeddingStore.create(store_path)
+    for start in range(0, len(embeddings), batch_size):
+        store.append(embeddings[start:start + batch_size])
+    store.build_lexical()
+    print(f"Converted {len(store)} embeddings from {json_path} to {store_path}")
+    return store
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python embedding_store.py <embeddings.json> [store_dir]")
+        sys.exit(1)
+    convert_json_to_store(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "embeddings_store")
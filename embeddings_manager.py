@@ -1,48 +1,211 @@
 import os
 import json
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from embedding_store import EmbeddingStore, save_store, convert_json_to_store
+from cache_manager import EmbeddingCache
+from tokenizer import estimate_tokens
 
 # Load environment variables
 load_dotenv()
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-def create_embeddings(chunks):
-    """Create embeddings for chunks with metadata"""
-    embeddings = []
-    print(f"Creating embeddings for {len(chunks)} chunks...")
-    
+DEFAULT_STORE_PATH = "embeddings_store"
+LEGACY_EMBEDDINGS_FILE = "embeddings.json"
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Batching and concurrency limits for embedding requests. The API accepts up
+# to 2048 inputs and roughly 300k tokens per request; staying well below
+# keeps individual requests fast and retries cheap.
+MAX_BATCH_ITEMS = 256
+MAX_BATCH_TOKENS = 100000
+MAX_WORKERS = 4
+
+# Retry policy for rate limits and transient errors
+MAX_RETRIES = 6
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+_embedding_cache = None
+
+def get_client():
+    """Return the module-level OpenAI client"""
+    return client
+
+class EmbeddingError(Exception):
+    """Raised when some chunks could not be embedded even after retrying.
+
+    ``embeddings`` holds everything that did succeed (in input order) and
+    ``failed`` the input indices of the chunks that did not.
+    """
+
+    def __init__(self, failed, embeddings):
+        super().__init__(f"Failed to embed {len(failed)} chunk(s): {failed[:10]}")
+        self.failed = failed
+        self.embeddings = embeddings
+
+def make_batches(texts, max_items=MAX_BATCH_ITEMS, max_tokens=MAX_BATCH_TOKENS):
+    """Group text indices into batches that respect the item and token budgets"""
+    batch, batch_tokens = [], 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def _retry_delay(attempt, error):
+    """Exponential backoff with jitter, honouring a Retry-After header when present"""
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * (0.5 + random.random() / 2)
+
+def _embed_batch(texts, client, model, max_retries):
+    """Embed one batch, retrying rate limits and transient failures"""
+    for attempt in range(max_retries + 1):
+        try:
+            response = client.embeddings.create(model=model, input=texts)
+            # The API may return items out of order; each carries its input index
+            data = sorted(response.data, key=lambda d: d.index)
+            return [d.embedding for d in data]
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            time.sleep(_retry_delay(attempt, e))
+
+def _embed_indices(texts, indices, client, model, max_retries):
+    """Embed a batch; if it fails for good, retry its chunks one at a time"""
+    try:
+        return dict(zip(indices, _embed_batch([texts[i] for i in indices], client, model, max_retries)))
+    except Exception as e:
+        if len(indices) == 1:
+            print(f"Error creating embedding for chunk {indices[0]}: {e}")
+            return {}
+        print(f"Batch of {len(indices)} chunks failed ({e}); retrying chunks individually")
+        results = {}
+        for i in indices:
+            results.update(_embed_indices(texts, [i], client, model, max_retries))
+        return results
+
+def get_embedding_cache():
+    """Return the shared on-disk embedding cache, opening it on first use"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+def embed_texts(texts, client=None, model=EMBEDDING_MODEL, max_batch_items=MAX_BATCH_ITEMS,
+                max_batch_tokens=MAX_BATCH_TOKENS, max_workers=MAX_WORKERS, max_retries=MAX_RETRIES,
+                cache=None, verbose=True):
+    """Embed texts in batched requests across a thread pool.
+
+    Returns one vector per text in input order, with None for texts that
+    could not be embedded. ``client`` defaults to the module OpenAI client;
+    pass any object with a compatible ``embeddings.create`` to test against
+    a stub or a local fake server. Texts already in ``cache`` (the shared
+    EmbeddingCache by default, disabled with ``cache=False``) are not sent
+    to the API, and new vectors are added to it as each batch completes.
+    """
+    client = client or get_client()
+    if cache is None:
+        cache = get_embedding_cache()
+    elif cache is False:
+        cache = None
+
+    if cache is not None:
+        vectors = cache.get_vectors(model, texts)
+    else:
+        vectors = [None] * len(texts)
+    pending = [i for i, vector in enumerate(vectors) if vector is None]
+    pending_texts = [texts[i] for i in pending]
+    if cache is not None and verbose:
+        print(f"Embedding cache: {len(texts) - len(pending)} hits, {len(pending)} chunks to embed")
+
+    batches = list(make_batches(pending_texts, max_batch_items, max_batch_tokens))
+    done = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_embed_indices, pending_texts, batch, client, model, max_retries)
+            for batch in batches
+        ]
+        for future in as_completed(futures):
+            results = future.result()
+            for i, vector in results.items():
+                vectors[pending[i]] = vector
+            if cache is not None:
+                cache.put_vectors(model, [pending_texts[i] for i in results], list(results.values()))
+            done += 1
+            if verbose:
+                print(f"Embedded batch {done}/{len(batches)}")
+
+    return vectors
+
+def prepare_chunks(chunks):
+    """Split chunk records into texts and the metadata stored alongside each embedding"""
+    texts = []
+    metadatas = []
     for i, chunk_data in enumerate(chunks):
-        if i % 10 == 0:  # Progress indicator
-            print(f"Processing chunk {i+1}/{len(chunks)}")
-        
         # Handle both old format (string) and new format (dict)
         if isinstance(chunk_data, dict):
-            chunk_text = chunk_data['text']
+            texts.append(chunk_data['text'])
             metadata = {
                 'source_file': chunk_data.get('source_file', ''),
                 'page': chunk_data.get('page', 1),
                 'chunk_id': chunk_data.get('chunk_id', f'chunk_{i}')
             }
+            # Document-level chunks can run over several pages
+            if chunk_data.get('page_end', metadata['page']) != metadata['page']:
+                metadata['page_end'] = chunk_data['page_end']
+            # Where the copies collapsed into this chunk were
+            if chunk_data.get('duplicates'):
+                metadata['duplicates'] = chunk_data['duplicates']
+            metadatas.append(metadata)
         else:
             # Legacy format - just text
-            chunk_text = chunk_data
-            metadata = {'chunk_id': f'legacy_chunk_{i}'}
-        
-        try:
-            emb = client.embeddings.create(
-                model="text-embedding-3-small",
-                input=chunk_text
-            )
-            embeddings.append({
-                "chunk": chunk_text,
-                "embedding": emb.data[0].embedding,
-                "metadata": metadata
-            })
-        except Exception as e:
-            print(f"Error creating embedding for chunk {i}: {e}")
-            continue
+            texts.append(chunk_data)
+            metadatas.append({'chunk_id': f'legacy_chunk_{i}'})
+    return texts, metadatas
+
+def create_embeddings(chunks, client=None, max_batch_items=MAX_BATCH_ITEMS,
+                      max_batch_tokens=MAX_BATCH_TOKENS, max_workers=MAX_WORKERS, cache=None):
+    """Create embeddings for chunks with metadata"""
+    print(f"Creating embeddings for {len(chunks)} chunks...")
+    
+    texts, metadatas = prepare_chunks(chunks)
+    
+    vectors = embed_texts(
+        texts,
+        client=client,
+        max_batch_items=max_batch_items,
+        max_batch_tokens=max_batch_tokens,
+        max_workers=max_workers,
+        cache=cache
+    )
+    
+    embeddings = [
+        {"chunk": text, "embedding": vector, "metadata": metadata}
+        for text, vector, metadata in zip(texts, vectors, metadatas)
+        if vector is not None
+    ]
+    failed = [i for i, vector in enumerate(vectors) if vector is None]
+    if failed:
+        raise EmbeddingError(failed, embeddings)
     
     print(f"Successfully created {len(embeddings)} embeddings")
     return embeddings
@@ -54,3 +217,37 @@ def save_embeddings(embeddings, file_path="embeddings.json"):
 def load_embeddings(file_path="embeddings.json"):
     with open(file_path, "r", encoding="utf-8") as f:
         return json.load(f)
+
+def save_index(embeddings, store_path=DEFAULT_STORE_PATH):
+    """Save embeddings to the binary store format"""
+    save_store(embeddings, store_path)
+
+def open_store(store_path=DEFAULT_STORE_PATH, legacy_file=LEGACY_EMBEDDINGS_FILE, create=False):
+    """Open the binary store, converting a legacy embeddings.json on first use"""
+    if not EmbeddingStore.exists(store_path):
+        if legacy_file and os.path.exists(legacy_file):
+            print(f"Converting {legacy_file} to binary store {store_path}...")
+            return convert_json_to_store(legacy_file, store_path)
+        if create:
+            return EmbeddingStore.create(store_path, model=EMBEDDING_MODEL)
+        raise FileNotFoundError(f"No embedding store found at {store_path}")
+    return EmbeddingStore(store_path)
+
+def load_index(store_path=DEFAULT_STORE_PATH, legacy_file=LEGACY_EMBEDDINGS_FILE):
+    """Open a binary store as a memory-mapped VectorIndex.
+
+    If the store does not exist yet but a legacy embeddings.json does, it is
+    converted once and the store is used from then on.
+    """
+    return open_store(store_path, legacy_file).load_index()
+
+def index_exists(store_path=DEFAULT_STORE_PATH, legacy_file=LEGACY_EMBEDDINGS_FILE):
+    """True if load_index can open (or convert) an index"""
+    return EmbeddingStore.exists(store_path) or bool(legacy_file and os.path.exists(legacy_file))
+
+def remove_from_index(source_file, store_path=DEFAULT_STORE_PATH):
+    """Remove one document's vectors from the store; returns the number of rows removed"""
+    store = EmbeddingStore(store_path)
+    removed = store.remove_document(source_file)
+    store.compact_if_needed()
+    return removed
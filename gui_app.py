@@ -3,9 +3,9 @@ from tkinter import ttk, filedialog, messagebox, scrolledtext
 import threading
 import os
 from document_loader import load_and_chunk
-from embeddings_manager import create_embeddings, save_embeddings, load_embeddings
-from vector_search import find_most_relevant
-from qa_agent import ask_gpt
+from embeddings_manager import create_embeddings, save_embeddings, load_embeddings, EmbeddingError
+from vector_search import find_most_relevant, SearchFilter, VectorIndex
+from qa_agent import ask_gpt, context_budget
 
 class DocumentQAGUI:
     def __init__(self, root):
@@ -16,7 +16,9 @@ class DocumentQAGUI:
         # Data storage
         self.loaded_pdfs = []
         self.embeddings = []
+        self.index = None  # VectorIndex over self.embeddings, built once per processing or load
         self.embeddings_file = "embeddings.json"
+        self.model = "gpt-4o"
         
         self.setup_ui()
         
@@ -40,7 +42,8 @@ class DocumentQAGUI:
         ttk.Button(pdf_frame, text="Load PDF Files", command=self.load_pdfs).grid(row=0, column=0, padx=(0, 10))
         
         # PDF listbox
-        self.pdf_listbox = tk.Listbox(pdf_frame, height=4)
+        # Selected PDFs limit which documents answers come from
+        self.pdf_listbox = tk.Listbox(pdf_frame, height=4, selectmode=tk.EXTENDED, exportselection=False)
         self.pdf_listbox.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=(0, 10))
         
         # Remove PDF button
@@ -125,24 +128,43 @@ class DocumentQAGUI:
             # Load and chunk documents
             chunks = load_and_chunk(self.loaded_pdfs)
             
-            # Create embeddings
-            embeddings = create_embeddings(chunks)
+            # Create embeddings (keeping the ones that succeeded if some chunks fail)
+            failed = []
+            try:
+                embeddings = create_embeddings(chunks)
+            except EmbeddingError as e:
+                print(f"Warning: {e}")
+                embeddings, failed = e.embeddings, e.failed
+                if not embeddings:
+                    raise
             
             # Save embeddings
             save_embeddings(embeddings, self.embeddings_file)
             
+            # Build the search index once here rather than on every question
+            index = VectorIndex.from_embeddings(embeddings)
+            
             # Update GUI in main thread
-            self.root.after(0, self._processing_complete, embeddings)
+            self.root.after(0, self._processing_complete, embeddings, index, len(failed))
             
         except Exception as e:
             self.root.after(0, self._processing_error, str(e))
     
-    def _processing_complete(self, embeddings):
+    def _processing_complete(self, embeddings, index, failed=0):
         """Called when PDF processing is complete"""
         self.embeddings = embeddings
+        self.index = index
         self.process_btn.config(state='normal', text="Process PDFs")
-        self.status_label.config(text=f"Successfully processed {len(self.loaded_pdfs)} PDF(s). Ready for questions!")
         self.ask_btn.config(state='normal')
+        if failed:
+            self.status_label.config(text=f"Processed {len(self.loaded_pdfs)} PDF(s), {failed} chunk(s) not embedded.")
+            messagebox.showwarning(
+                "Partially processed",
+                f"{failed} chunk(s) could not be embedded and will not be searched.\n"
+                f"The other {len(embeddings)} chunks are ready for questions."
+            )
+            return
+        self.status_label.config(text=f"Successfully processed {len(self.loaded_pdfs)} PDF(s). Ready for questions!")
         messagebox.showinfo("Success", "PDFs processed successfully! You can now ask questions.")
     
     def _processing_error(self, error_msg):
@@ -156,6 +178,7 @@ class DocumentQAGUI:
         if os.path.exists(self.embeddings_file):
             try:
                 self.embeddings = load_embeddings(self.embeddings_file)
+                self.index = VectorIndex.from_embeddings(self.embeddings)
                 self.status_label.config(text="Loaded existing embeddings. Ready for questions!")
                 self.ask_btn.config(state='normal')
             except Exception as e:
@@ -166,7 +189,7 @@ class DocumentQAGUI:
     
     def ask_question(self):
         """Ask a question using the loaded embeddings"""
-        if not self.embeddings:
+        if not self.embeddings or self.index is None:
             messagebox.showwarning("No Data", "Please process some PDFs first or ensure embeddings.json exists.")
             return
         
@@ -180,19 +203,24 @@ class DocumentQAGUI:
         self.answer_text.delete(1.0, tk.END)
         self.answer_text.insert(tk.END, "Processing your question...")
         
+        # Only the selected PDFs are searched (all of them when none is selected)
+        selected = [self.loaded_pdfs[i] for i in self.pdf_listbox.curselection()]
+        search_filter = SearchFilter(source_files=selected) if selected else None
+        
         # Run question answering in separate thread
-        thread = threading.Thread(target=self._ask_question_thread, args=(question,))
+        thread = threading.Thread(target=self._ask_question_thread, args=(question, search_filter))
         thread.daemon = True
         thread.start()
     
-    def _ask_question_thread(self, question):
+    def _ask_question_thread(self, question, search_filter=None):
         """Ask question in background thread"""
         try:
             # Find most relevant context
-            context = find_most_relevant(question, self.embeddings)
+            context = find_most_relevant(question, self.index, token_budget=context_budget(self.model),
+                                         model=self.model, search_filter=search_filter)
             
-            # Get answer from GPT
-            answer = ask_gpt(question, context)
+            # Get answer from GPT (the same model the context was packed for)
+            answer = ask_gpt(question, context, model=self.model)
             
             # Update GUI in main thread
             self.root.after(0, self._question_complete, answer)
@@ -0,0 +1,275 @@
+"""
+Streaming ingestion pipeline.
+
+    extract + clean + chunk  ->  batch + embed  ->  append to store
+      (background thread)       (thread pool)      (calling thread)
+
+Stages are generators joined by bounded queues, so only a few documents'
+chunks and a few embedding batches are held in memory at any time, however
+large the corpus is. Rows are appended to the embedding store as batches
+finish and committed at document boundaries (at most every
+CHECKPOINT_INTERVAL seconds). A document counts as indexed only once its
+file fingerprint is committed, so re-running after a crash skips finished
+documents and redoes partial ones, whose chunks then come from the
+embedding cache instead of the API.
+
+A changed document keeps its old rows searchable until its new version
+is completely embedded: the old rows are tombstoned only when the new
+ones are all appended, and if the new version fails (a parse error or
+chunks the API could not embed) only its partial new rows are dropped.
+"""
+
+import os
+import sys
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from document_loader import iter_documents
+from embedding_store import file_fingerprint
+from pdf_metadata import document_info
+from embeddings_manager import (
+    embed_texts, prepare_chunks, estimate_tokens, open_store,
+    DEFAULT_STORE_PATH, LEGACY_EMBEDDINGS_FILE, MAX_BATCH_ITEMS, MAX_BATCH_TOKENS, MAX_WORKERS
+)
+
+# Documents buffered between extraction and embedding
+QUEUE_SIZE = 8
+
+# Seconds between store commits while ingesting
+CHECKPOINT_INTERVAL = 5.0
+
+_END = object()
+
+class _Failure:
+    """Carries an exception from a producer thread to the consumer"""
+
+    def __init__(self, error):
+        self.error = error
+
+def threaded(iterable, maxsize=QUEUE_SIZE):
+    """Run an iterator in a background thread, handing items over through a bounded queue"""
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_END)
+        except BaseException as e:
+            put(_Failure(e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        # Unblock the producer if the consumer stops early
+        stop.set()
+
+def _embed_stage(documents, client, cache, max_batch_items, max_batch_tokens, concurrency):
+    """Turn a stream of documents into an ordered stream of store events.
+
+    Events are ("start", file_path, status), ("rows", embeddings, failed_sources)
+    and ("done", file_path, status, fingerprint, info, error). Batches may span
+    documents; a document's "done" event always follows the batch holding
+    its last chunk. At most 2 * concurrency batches are in flight.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        events = deque()
+        in_flight = 0
+        texts, metadatas, tokens = [], [], 0
+        held = []
+
+        def flush():
+            nonlocal texts, metadatas, tokens, in_flight
+            if texts:
+                future = executor.submit(
+                    embed_texts, texts, client=client, cache=cache,
+                    max_batch_items=max_batch_items, max_batch_tokens=max_batch_tokens,
+                    max_workers=1, verbose=False
+                )
+                events.append(("rows", future, texts, metadatas))
+                in_flight += 1
+                texts, metadatas, tokens = [], [], 0
+            events.extend(held)
+            held.clear()
+
+        def drain(limit):
+            nonlocal in_flight
+            while events and (in_flight > limit or events[0][0] != "rows"):
+                event = events.popleft()
+                if event[0] != "rows":
+                    yield event
+                    continue
+                in_flight -= 1
+                _, future, batch_texts, batch_metadatas = event
+                vectors = future.result()
+                embeddings = []
+                failed_sources = set()
+                for text, vector, metadata in zip(batch_texts, vectors, batch_metadatas):
+                    if vector is None:
+                        failed_sources.add(metadata.get("source_file", ""))
+                    else:
+                        embeddings.append({"chunk": text, "embedding": vector, "metadata": metadata})
+                yield ("rows", embeddings, failed_sources)
+
+        for file_path, status, records, fingerprint, info, error in documents:
+            events.append(("start", file_path, status))
+            doc_texts, doc_metadatas = prepare_chunks(records)
+            for text, metadata in zip(doc_texts, doc_metadatas):
+                text_tokens = estimate_tokens(text)
+                if texts and (len(texts) >= max_batch_items or tokens + text_tokens > max_batch_tokens):
+                    flush()
+                texts.append(text)
+                metadatas.append(metadata)
+                tokens += text_tokens
+
+            done = ("done", file_path, status, fingerprint, info, error)
+            if texts:
+                held.append(done)
+            else:
+                events.append(done)
+            yield from drain(2 * concurrency)
+
+        flush()
+        yield from drain(0)
+
+def ingest_documents(files, store_path=DEFAULT_STORE_PATH, legacy_file=LEGACY_EMBEDDINGS_FILE,
+                     workers=None, client=None, cache=None, max_batch_items=MAX_BATCH_ITEMS,
+                     max_batch_tokens=MAX_BATCH_TOKENS, concurrency=MAX_WORKERS, queue_size=QUEUE_SIZE):
+    """Stream new or changed files into the embedding store.
+
+    Files whose committed fingerprint still matches are skipped, which is
+    also how an interrupted run resumes. Returns a summary dict of file
+    lists ("added", "updated", "unchanged", "failed").
+    """
+    store = open_store(store_path, legacy_file, create=True)
+    summary = {"added": [], "updated": [], "removed": [], "unchanged": [], "failed": []}
+
+    pending = {}
+    for file_path in files:
+        status = store.document_status(file_path)
+        if status == "unchanged":
+            summary["unchanged"].append(file_path)
+        else:
+            pending[file_path] = status
+    if not pending:
+        return summary
+
+    def documents():
+        # Fingerprint before parsing so an edit made mid-run is picked up next time
+        fingerprints = {}
+        for file_path in pending:
+            try:
+                fingerprints[file_path] = file_fingerprint(file_path)
+            except OSError:
+                fingerprints[file_path] = None
+        for file_path, records, error in iter_documents(list(pending), workers):
+            # PDF metadata (author, dates...) is kept with the document for filtered searches
+            info = document_info(file_path) if error is None and file_path.lower().endswith(".pdf") else {}
+            yield file_path, pending[file_path], records, fingerprints[file_path], info, error
+
+    failed_sources = set()
+    first_new_row = {}  # file_path -> store row count when its new version started
+    last_commit = time.time()
+    events = _embed_stage(
+        threaded(documents(), queue_size), client, cache, max_batch_items, max_batch_tokens, concurrency
+    )
+    for event in events:
+        kind = event[0]
+        if kind == "start":
+            # Rows appended from here on belong to the new version; the old ones stay live until it is done
+            first_new_row[event[1]] = len(store)
+        elif kind == "rows":
+            _, embeddings, batch_failed = event
+            store.append(embeddings, commit=False)
+            failed_sources |= batch_failed
+        else:
+            _, file_path, status, fingerprint, info, error = event
+            first_row = first_new_row.pop(file_path)
+            if error is not None or fingerprint is None or file_path in failed_sources:
+                print(f"Error processing {file_path}: {error or 'some chunks could not be embedded'}")
+                # Drop only the partial new version; a changed document stays searchable as it was
+                complete = store.documents.get(file_path, {}).get("fingerprint")
+                store.remove_document_rows(file_path, first_row if complete else 0, commit=False)
+                summary["failed"].append(file_path)
+            else:
+                # The new version is complete: retire the old rows
+                store.remove_document_rows(file_path, 0, first_row, commit=False)
+                store.set_document_info(file_path, info, commit=False)
+                store.set_fingerprint(file_path, fingerprint, commit=False)
+                summary["added" if status == "new" else "updated"].append(file_path)
+                print(f"Indexed {file_path} ({len(summary['added']) + len(summary['updated'])}/{len(pending)})")
+
+            # Checkpoint: everything up to this document survives a crash
+            if time.time() - last_commit >= CHECKPOINT_INTERVAL:
+                store.commit()
+                last_commit = time.time()
+
+    store.commit()
+    return summary
+
+def sync_index(files, store_path=DEFAULT_STORE_PATH, legacy_file=LEGACY_EMBEDDINGS_FILE,
+               remove_missing=False, client=None, workers=None):
+    """Bring the store up to date with files, embedding only new or changed documents.
+
+    Unchanged files are detected by size/mtime (falling back to a content
+    hash) and skipped without being parsed. Changed files have their rows
+    replaced in place; with remove_missing, indexed documents that are not
+    in files are removed. Returns a summary dict of file lists.
+    """
+    summary = ingest_documents(files, store_path, legacy_file, workers=workers, client=client)
+
+    store = open_store(store_path, legacy_file, create=True)
+    if remove_missing:
+        wanted = set(files)
+        for source_file in list(store.documents):
+            if source_file not in wanted:
+                store.remove_document(source_file)
+                summary["removed"].append(source_file)
+
+    store.compact_if_needed()
+    # Keyword search covers the new rows as soon as the sync is done (built on the first sync of an older store)
+    if len(store):
+        store.update_lexical()
+        store.update_quantized()
+    print(
+        f"Index sync: {len(summary['added'])} added, {len(summary['updated'])} updated, "
+        f"{len(summary['removed'])} removed, {len(summary['unchanged'])} unchanged, "
+        f"{len(summary['failed'])} failed"
+    )
+    return summary
+
+if __name__ == "__main__":
+    # Nightly sync of a document folder: python ingest_pipeline.py <folder> [store_dir]
+    if len(sys.argv) < 2:
+        print("Usage: python ingest_pipeline.py <documents_folder> [store_dir]")
+        sys.exit(1)
+    folder = sys.argv[1]
+    folder_files = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(folder)
+        for name in names
+        if name.lower().endswith(".pdf")
+    )
+    sync_index(folder_files, sys.argv[2] if len(sys.argv) > 2 else DEFAULT_STORE_PATH, remove_missing=True)
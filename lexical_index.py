@@ -0,0 +1,278 @@
+"""
+BM25 inverted index over chunk texts.
+
+Embeddings find paraphrases but are weak on exact identifiers (part
+numbers, SSIDs, error codes like "E-042"); a lexical index finds those
+directly and needs no API call, so it also answers retrieval offline.
+
+Tokens are casefolded runs of letters and digits; identifiers joined by
+"-", "_", ".", ":" or "/" are indexed whole and as their parts, so
+"AB-1234" matches "AB-1234", "ab" and "1234". Stopwords are indexed but
+never scored, so "what is the ..." does not match every chunk. The index
+is stored in CSR form (sorted vocabulary, per-term row/term-frequency
+postings, per-row token counts) in one .npz file next to the vectors.
+
+Like the ANN index, it covers the first ``built_rows`` rows of one store
+generation: ``update`` indexes rows appended since, tokenizing and sorting
+only the new rows' postings and scattering them behind each term's
+existing ones (appended rows always have larger ids, so the merged
+postings stay row-ordered). The CSR arrays are still copied once per
+update, which is linear in the index size. Tombstoned rows are
+filtered at query time, and compaction rebuilds it. Term statistics still
+count tombstoned rows until then, which only shifts scores slightly.
+
+Usage:
+    python lexical_index.py build <store_dir>
+    python lexical_index.py search <store_dir> "query text" [--k 5]
+"""
+
+import os
+import re
+import sys
+import math
+import argparse
+import numpy as np
+from ann_index import top_k_rows
+
+LEXICAL_FILE = "lexical_bm25.npz"
+
+# BM25 parameters (the usual defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Longer tokens (base64 blobs, URLs) are not worth indexing
+MAX_TOKEN_CHARS = 40
+
+# Rows tokenized per step while building
+BUILD_BLOCK_ROWS = 20000
+
+# Query words that match nearly every chunk and say nothing about the topic (still indexed, never scored)
+STOPWORDS = frozenset("""
+a about an and are as at be been but by can could did do does for from had has have how i if in into is it
+its me my no not of on or our so than that the their them then there these they this those to was we were
+what when where which who why will with would you your
+""".split())
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:[-_.:/][^\W_]+)*")
+PART_PATTERN = re.compile(r"[^\W_]+")
+
+def tokenize(text):
+    """Casefolded tokens of text, compound identifiers also split into their parts"""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.casefold()):
+        token = match.group()
+        if len(token) > MAX_TOKEN_CHARS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(PART_PATTERN.findall(token))
+    return tokens
+
+def _postings(texts, first_row):
+    """(terms, rows, tfs) triplets and per-row token counts for a block of texts"""
+    terms, rows, tfs = [], [], []
+    lengths = np.zeros(len(texts), dtype=np.int32)
+    for i, text in enumerate(texts):
+        counts = {}
+        for token in tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+        lengths[i] = sum(counts.values())
+        terms.extend(counts)
+        rows.extend([first_row + i] * len(counts))
+        tfs.extend(counts.values())
+    return terms, rows, tfs, lengths
+
+class LexicalIndex:
+    """BM25 scoring over CSR postings.
+
+    ``vocabulary`` is the sorted term list; the postings of term t are
+    ``rows[offsets[t]:offsets[t + 1]]`` with term frequencies ``tfs`` at
+    the same positions, and ``lengths[row]`` is the token count of a row.
+    """
+
+    def __init__(self, vocabulary, offsets, rows, tfs, lengths, generation=0):
+        self.vocabulary = list(vocabulary)
+        self.term_ids = {term: i for i, term in enumerate(self.vocabulary)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.tfs = np.asarray(tfs, dtype=np.float32)
+        self.lengths = np.asarray(lengths, dtype=np.int32)
+        self.generation = generation
+        self.set_deleted(None)
+
+    @property
+    def built_rows(self):
+        return len(self.lengths)
+
+    def set_deleted(self, deleted):
+        """Exclude tombstoned rows (boolean mask) from results and from the length statistics"""
+        self.deleted = deleted
+        lengths = self.lengths if deleted is None else self.lengths[~deleted[:len(self.lengths)]]
+        self.live_rows = len(lengths)
+        self.average_length = float(lengths.mean()) if len(lengths) else 1.0
+
+    @classmethod
+    def empty(cls, generation=0):
+        return cls([], [0], [], [], [], generation)
+
+    @classmethod
+    def build(cls, texts, generation=0):
+        """Index a row-indexable sequence of chunk texts"""
+        return cls.empty(generation).update(texts)
+
+    def update(self, texts, stop=None):
+        """Return an index that also covers rows built_rows..stop of texts (all remaining by default)"""
+        stop = len(texts) if stop is None else stop
+        start = self.built_rows
+        if stop <= start:
+            return self
+
+        # Step 1: postings of the new rows only (generated in row order)
+        new_terms, new_rows, new_tfs, new_lengths = [], [], [], [np.zeros(0, dtype=np.int32)]
+        for block_start in range(start, stop, BUILD_BLOCK_ROWS):
+            block_stop = min(block_start + BUILD_BLOCK_ROWS, stop)
+            terms, rows, tfs, lengths = _postings([texts[row] for row in range(block_start, block_stop)], block_start)
+            new_terms.extend(terms)
+            new_rows.extend(rows)
+            new_tfs.extend(tfs)
+            new_lengths.append(lengths)
+
+        # Step 2: merged vocabulary (two sorted runs, which sorted() merges in linear time)
+        added = sorted(set(new_terms).difference(self.term_ids))
+        vocabulary = sorted(self.vocabulary + added) if added else self.vocabulary
+        term_ids = {term: i for i, term in enumerate(vocabulary)} if added else self.term_ids
+        remap = np.array([term_ids[term] for term in self.vocabulary], dtype=np.int64)
+
+        # Step 3: only the new postings are sorted by term (stably, so rows stay ascending)
+        terms = np.array([term_ids[term] for term in new_terms], dtype=np.int64)
+        order = np.argsort(terms, kind="stable")
+        terms = terms[order]
+        rows = np.array(new_rows, dtype=np.int64)[order]
+        tfs = np.array(new_tfs, dtype=np.float32)[order]
+
+        # Step 4: every new row comes after the old ones, so a term's new postings go after its old ones
+        old_counts = np.zeros(len(vocabulary), dtype=np.int64)
+        old_counts[remap] = np.diff(self.offsets)
+        new_counts = np.bincount(terms, minlength=len(vocabulary))
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(old_counts + new_counts, out=offsets[1:])
+
+        merged_rows = np.empty(offsets[-1], dtype=np.int64)
+        merged_tfs = np.empty(offsets[-1], dtype=np.float32)
+        old_target = np.arange(len(self.rows)) + np.repeat(offsets[remap] - self.offsets[:-1], np.diff(self.offsets))
+        merged_rows[old_target] = self.rows
+        merged_tfs[old_target] = self.tfs
+        new_starts = np.cumsum(new_counts) - new_counts
+        new_target = offsets[terms] + old_counts[terms] + np.arange(len(terms)) - new_starts[terms]
+        merged_rows[new_target] = rows
+        merged_tfs[new_target] = tfs
+
+        index = LexicalIndex(vocabulary, offsets, merged_rows, merged_tfs,
+                             np.concatenate([self.lengths] + new_lengths), self.generation)
+        index.set_deleted(self.deleted)
+        return index
+
+    def scores(self, query, max_df_fraction=None):
+        """Dense BM25 scores of every indexed row for a query string.
+
+        Stopwords are not scored, nor (with ``max_df_fraction``) terms found
+        in more than that fraction of the rows.
+        """
+        scores = np.zeros(self.built_rows, dtype=np.float32)
+        for term in set(tokenize(query)).difference(STOPWORDS):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            rows, tfs = self.rows[start:stop], self.tfs[start:stop]
+            df = stop - start
+            if max_df_fraction is not None and df > max(1, max_df_fraction * self.live_rows):
+                continue
+            idf = math.log(1 + (self.live_rows - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[rows] / self.average_length)
+            scores[rows] += idf * tfs * (BM25_K1 + 1) / (tfs + norm)
+        return scores
+
+    def search(self, query, top_k=3, rows=None, max_df_fraction=None):
+        """Return [(row, bm25_score)] of the best matching rows, best first (only rows with a match).
+
+        ``rows`` optionally restricts the results to those (live) row ids;
+        ``max_df_fraction`` is passed to scores.
+        """
+        scores = self.scores(query, max_df_fraction)
+        if rows is not None:
+            rows = rows[rows < len(scores)]
+            matched = rows[scores[rows] > 0]
+        else:
+            if self.deleted is not None:
+                scores[self.deleted[:len(scores)]] = 0
+            matched = np.flatnonzero(scores > 0)
+        best = matched[top_k_rows(scores[matched], min(top_k, len(matched)))] if len(matched) else matched
+        return [(int(row), float(scores[row])) for row in best]
+
+    def save(self, path):
+        """Write the index to an .npz file (atomically)"""
+        encoded = [term.encode("utf-8") for term in self.vocabulary]
+        term_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(term) for term in encoded], out=term_offsets[1:])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                terms=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+                term_offsets=term_offsets,
+                offsets=self.offsets,
+                rows=self.rows,
+                tfs=self.tfs,
+                lengths=self.lengths,
+                info=np.array([self.generation], dtype=np.int64)
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            blob = data["terms"].tobytes()
+            term_offsets = data["term_offsets"]
+            vocabulary = [
+                blob[term_offsets[i]:term_offsets[i + 1]].decode("utf-8") for i in range(len(term_offsets) - 1)
+            ]
+            return cls(vocabulary, data["offsets"], data["rows"], data["tfs"], data["lengths"], int(data["info"][0]))
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked row lists: each row scores sum(1 / (k + rank)); returns [(row, score)] best first"""
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, 1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))
+
+def _main(argv):
+    from embedding_store import EmbeddingStore
+
+    parser = argparse.ArgumentParser(description="Build or query the BM25 index of an embedding store")
+    parser.add_argument("command", choices=["build", "search"])
+    parser.add_argument("store")
+    parser.add_argument("query", nargs="?")
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    store = EmbeddingStore(args.store)
+    if args.command == "build":
+        index = store.build_lexical()
+        print(f"Indexed {index.built_rows} chunks, {len(index.vocabulary)} terms")
+        return
+
+    if not args.query:
+        parser.error("search needs a query")
+    index = store.load_index()
+    if index.lexical is None:
+        print(f"No lexical index in {args.store}; build it with: python lexical_index.py build {args.store}")
+        return
+    for row, score in index.lexical.search(args.query, args.k):
+        meta = index.metadata[row]
+        print(f"{score:8.3f}  {os.path.basename(meta.get('source_file', ''))} p.{meta.get('page', '?')}: "
+              f"{index.chunks[row][:100]}")
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
@@ -1,26 +1,22 @@
-from document_loader import load_and_chunk
-from embeddings_manager import create_embeddings, save_embeddings, load_embeddings
+from embeddings_manager import load_index
+from ingest_pipeline import sync_index
 
 from vector_search import find_most_relevant
-from qa_agent import ask_gpt
-import os
+from qa_agent import ask_gpt_stream, context_budget
+from tracing import start_trace
 
 PDF_FILES = ["pdf_1.pdf", "pdf_2.pdf"]  # your two PDFs
-EMBEDDINGS_FILE = "embeddings.json"
+EMBEDDINGS_FILE = "embeddings.json"  # legacy format, converted on first run
+STORE_PATH = "embeddings_store"
+MODEL = "gpt-4o"
 
 def main():
-    # Step 1: Load PDFs and chunk text
-    print("Loading and chunking documents...")
-    chunks = load_and_chunk(PDF_FILES)
+    # Step 1: Load, chunk and embed any PDFs that are new or changed since the last run
+    print("Syncing document index...")
+    sync_index(PDF_FILES, STORE_PATH, EMBEDDINGS_FILE)
 
-    # Step 2: Create embeddings if not already saved
-    if os.path.exists(EMBEDDINGS_FILE):
-        print("Loading embeddings from file...")
-        embeddings = load_embeddings(EMBEDDINGS_FILE)
-    else:
-        print("Creating embeddings...")
-        embeddings = create_embeddings(chunks)
-        save_embeddings(embeddings, EMBEDDINGS_FILE)
+    # Step 2: Open the saved index
+    index = load_index(STORE_PATH)
 
     # Step 3: Live Q&A loop
     print("Ready! Ask a question about your documents.")
@@ -28,9 +24,20 @@ def main():
         query = input("\nQuestion (or 'exit' to quit): ")
         if query.lower() == "exit":
             break
-        context = find_most_relevant(query, embeddings)
-        answer = ask_gpt(query, context)
-        print(f"\nAnswer:\n{answer}")
+        with start_trace("ask", question=query, model=MODEL) as trace:
+            context = find_most_relevant(query, index, token_budget=context_budget(MODEL), model=MODEL)
+
+            # Print the answer as it is generated; Ctrl+C stops it without leaving the loop
+            print("\nAnswer:")
+            answer = ask_gpt_stream(query, context, model=MODEL, index_version=index.version)
+            try:
+                for delta in answer:
+                    print(delta, end="", flush=True)
+            except KeyboardInterrupt:
+                answer.close()
+                print("\n[Answer cancelled]", end="")
+            print()
+        print(f"({trace.summary()})")
 
 if __name__ == "__main__":
     main()
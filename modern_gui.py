@@ -2,18 +2,23 @@ import customtkinter as ctk
 import tkinter as tk
 from tkinter import filedialog, messagebox, font as tkfont
 import threading
+import asyncio
 import os
 import re
-from document_loader import load_and_chunk
-from embeddings_manager import create_embeddings, save_embeddings, load_embeddings
-from vector_search import find_most_relevant
-from qa_agent import ask_gpt, get_available_models, get_model_recommendation
+from embeddings_manager import remove_from_index, load_index, index_exists
+from ingest_pipeline import sync_index
+from qa_pipeline import QAPipeline, AsyncRunner
+from qa_agent import get_available_models, get_model_recommendation
 from pdf_metadata import extract_pdf_metadata, get_pdf_preview
+from vector_search import SearchFilter
 
 # Set appearance mode and color theme
 ctk.set_appearance_mode("dark")  # Modes: "System" (standard), "Dark", "Light"
 ctk.set_default_color_theme("blue")  # Themes: "blue" (standard), "green", "dark-blue"
 
+# Streamed answer text is re-rendered at most this often (ms)
+STREAM_RENDER_INTERVAL_MS = 50
+
 def render_markdown_to_tk_text(textbox: tk.Text, content: str):
     """Render markdown content to a tkinter Text widget with formatting"""
     textbox.configure(state="normal")
@@ -64,10 +69,16 @@ class ModernDocumentQAGUI:
         # Data storage
         self.loaded_pdfs = []
         self.pdf_metadata = {}  # Store PDF metadata
-        self.embeddings = []
-        self.embeddings_file = "embeddings.json"
+        self.index = None  # VectorIndex opened from the embedding store
+        self.store_path = "embeddings_store"
+        self.embeddings_file = "embeddings.json"  # legacy format, converted on first load
         self.selected_model = "gpt-4o"  # Default to better model
         self.available_models = get_available_models()
+        self.answer_state = None  # The answer currently streaming, if any
+        
+        # One event loop thread and one pooled async client serve every question
+        self.runner = AsyncRunner()
+        self.pipeline = QAPipeline(None, model=self.selected_model)
         
         self.setup_ui()
         
@@ -180,9 +191,21 @@ class ModernDocumentQAGUI:
             selectbackground="#3B8ED0",
             font=("Arial", 11),
             relief="flat",
-            borderwidth=0
+            borderwidth=0,
+            selectmode=tk.EXTENDED,
+            exportselection=False  # keep the selection while typing a question
         )
         self.pdf_listbox.grid(row=1, column=0, sticky="ew", padx=15, pady=(0, 10))
+        self.pdf_listbox.bind("<<ListboxSelect>>", lambda event: self._update_scope_label())
+        
+        # Selected documents limit which PDFs answers come from
+        self.scope_label = ctk.CTkLabel(
+            list_frame,
+            text="Answering from all documents (select some to narrow it down)",
+            font=ctk.CTkFont(size=11),
+            text_color="#A0A0A0"
+        )
+        self.scope_label.grid(row=3, column=0, sticky="w", padx=15, pady=(0, 10))
         
         # Remove PDF button
         self.remove_btn = ctk.CTkButton(
@@ -342,19 +365,51 @@ class ModernDocumentQAGUI:
             self.status_label.configure(text=f"✅ Loaded {len(self.loaded_pdfs)} PDF(s). Click 'Process Documents' to create embeddings.")
         
     def remove_pdf(self):
-        """Remove selected PDF from the list"""
+        """Remove the selected PDFs from the list"""
         selection = self.pdf_listbox.curselection()
         if selection:
-            index = selection[0]
-            file_path = self.loaded_pdfs[index]
-            
-            # Remove from all data structures
-            self.pdf_listbox.delete(index)
-            del self.loaded_pdfs[index]
-            if file_path in self.pdf_metadata:
-                del self.pdf_metadata[file_path]
+            removed_from_index = False
+            try:
+                # Highest index first so the remaining indexes stay valid
+                for index in sorted(selection, reverse=True):
+                    file_path = self.loaded_pdfs[index]
+                    
+                    # Remove from all data structures
+                    self.pdf_listbox.delete(index)
+                    del self.loaded_pdfs[index]
+                    if file_path in self.pdf_metadata:
+                        del self.pdf_metadata[file_path]
+                    
+                    # Drop the document's vectors from the index as well
+                    if self.index and file_path in self.index.documents:
+                        remove_from_index(file_path, self.store_path)
+                        removed_from_index = True
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to remove PDF from index:\n{e}")
+            finally:
+                # Reopen the index once, after all removals
+                if removed_from_index:
+                    self.index = load_index(self.store_path)
             
-            self.status_label.configure(text=f"🗑️ Removed PDF. {len(self.loaded_pdfs)} PDF(s) remaining.")
+            self.status_label.configure(
+                text=f"🗑️ Removed {len(selection)} PDF(s). {len(self.loaded_pdfs)} PDF(s) remaining."
+            )
+            self._update_scope_label()
+    
+    def selected_pdfs(self):
+        """File paths of the documents selected in the list"""
+        return [self.loaded_pdfs[i] for i in self.pdf_listbox.curselection() if i < len(self.loaded_pdfs)]
+    
+    def _update_scope_label(self):
+        """Show which documents the next answer will come from"""
+        selected = self.selected_pdfs()
+        if not selected:
+            text = "Answering from all documents (select some to narrow it down)"
+        elif len(selected) == 1:
+            text = f"Answering from {os.path.basename(selected[0])} only"
+        else:
+            text = f"Answering from {len(selected)} selected documents"
+        self.scope_label.configure(text=text)
     
     def show_pdf_details(self):
         """Show detailed information about loaded PDFs"""
@@ -483,17 +538,6 @@ class ModernDocumentQAGUI:
             messagebox.showwarning("No PDFs", "Please load some PDF files first.")
             return
         
-        # Check if embeddings already exist
-        if os.path.exists(self.embeddings_file) and self.embeddings:
-            response = messagebox.askyesno(
-                "Embeddings Exist", 
-                "Embeddings already exist. Do you want to recreate them?\n\n"
-                "Click 'Yes' to reprocess all PDFs and create new embeddings.\n"
-                "Click 'No' to keep existing embeddings."
-            )
-            if not response:
-                return
-        
         # Disable button and show processing status
         self.process_btn.configure(state='disabled', text="⏳ Processing...")
         self.status_label.configure(text="⚙️ Processing PDFs and creating embeddings...")
@@ -506,28 +550,32 @@ class ModernDocumentQAGUI:
     def _process_pdfs_thread(self):
         """Process PDFs in background thread"""
         try:
-            # Load and chunk documents
-            chunks = load_and_chunk(self.loaded_pdfs)
-            
-            # Create embeddings
-            embeddings = create_embeddings(chunks)
+            # Chunk and embed only new or changed PDFs, updating the index in place
+            summary = sync_index(self.loaded_pdfs, self.store_path, self.embeddings_file)
             
-            # Save embeddings
-            save_embeddings(embeddings, self.embeddings_file)
+            # Reopen the updated store as a memory-mapped index
+            index = load_index(self.store_path)
             
             # Update GUI in main thread
-            self.root.after(0, self._processing_complete, embeddings)
+            self.root.after(0, self._processing_complete, index, summary)
             
         except Exception as e:
             self.root.after(0, self._processing_error, str(e))
     
-    def _processing_complete(self, embeddings):
+    def _processing_complete(self, index, summary):
         """Called when PDF processing is complete"""
-        self.embeddings = embeddings
+        self.index = index
         self.process_btn.configure(state='normal', text="⚡ Process Documents")
-        self.status_label.configure(text=f"🎉 Successfully processed {len(self.loaded_pdfs)} PDF(s). Ready for questions!")
+        self.status_label.configure(
+            text=f"🎉 Processed {len(self.loaded_pdfs)} PDF(s): {len(summary['added'])} new, "
+                 f"{len(summary['updated'])} updated, {len(summary['unchanged'])} unchanged. Ready for questions!"
+        )
         self.ask_btn.configure(state='normal')
-        messagebox.showinfo("Success", "PDFs processed successfully! You can now ask questions.")
+        if summary['failed']:
+            failed_names = ', '.join(os.path.basename(path) for path in summary['failed'])
+            messagebox.showwarning("Some PDFs Failed", f"These PDFs could not be processed:\n{failed_names}")
+        else:
+            messagebox.showinfo("Success", "PDFs processed successfully! You can now ask questions.")
     
     def _processing_error(self, error_msg):
         """Called when PDF processing encounters an error"""
@@ -537,9 +585,9 @@ class ModernDocumentQAGUI:
     
     def load_existing_embeddings(self):
         """Load existing embeddings and detect PDFs automatically"""
-        if os.path.exists(self.embeddings_file):
+        if index_exists(self.store_path, self.embeddings_file):
             try:
-                self.embeddings = load_embeddings(self.embeddings_file)
+                self.index = load_index(self.store_path, self.embeddings_file)
                 
                 # Extract PDF information from embeddings metadata
                 self.detect_pdfs_from_embeddings()
@@ -563,17 +611,12 @@ class ModernDocumentQAGUI:
     
     def detect_pdfs_from_embeddings(self):
         """Detect PDF files from embeddings metadata"""
-        if not self.embeddings:
+        if not self.index:
             return
         
-        detected_pdfs = set()
-        
-        for embedding in self.embeddings:
-            metadata = embedding.get('metadata', {})
-            source_file = metadata.get('source_file', '')
-            
-            if source_file and source_file not in detected_pdfs:
-                detected_pdfs.add(source_file)
+        # The index keeps row ranges per source file, so no record needs decoding
+        for source_file in self.index.documents:
+            if source_file:
                 
                 # Add to loaded PDFs list
                 if source_file not in self.loaded_pdfs:
@@ -604,7 +647,7 @@ class ModernDocumentQAGUI:
     
     def refresh_embeddings(self):
         """Refresh embeddings from file"""
-        if os.path.exists(self.embeddings_file):
+        if index_exists(self.store_path, self.embeddings_file):
             # Clear current data
             self.loaded_pdfs.clear()
             self.pdf_metadata.clear()
@@ -626,8 +669,8 @@ class ModernDocumentQAGUI:
     
     def ask_question(self):
         """Ask a question using the loaded embeddings"""
-        if not self.embeddings:
-            messagebox.showwarning("No Data", "Please process some PDFs first or ensure embeddings.json exists.")
+        if not self.index:
+            messagebox.showwarning("No Data", "Please process some PDFs first or ensure an embedding store exists.")
             return
         
         question = self.question_entry.get().strip()
@@ -635,43 +678,93 @@ class ModernDocumentQAGUI:
             messagebox.showwarning("No Question", "Please enter a question.")
             return
         
-        # Disable ask button and show processing
+        # Ignore new questions (e.g. Enter) while an answer streams; the button stops it
+        if self.answer_state is not None:
+            return
+        
+        # Turn the ask button into a stop button and show processing
         model_name = self.available_models[self.selected_model]['name']
-        self.ask_btn.configure(state='disabled', text=f"🤔 Thinking with {model_name}...")
+        self.ask_btn.configure(text=f"⏹ Stop ({model_name} answering...)", command=self.cancel_question)
         self.answer_text.configure(state="normal")
         self.answer_text.delete("1.0", "end")
         self.answer_text.insert("1.0", f"Processing your question with {model_name}...")
         self.answer_text.configure(state="disabled")
         
-        # Run question answering in separate thread
-        thread = threading.Thread(target=self._ask_question_thread, args=(question,))
-        thread.daemon = True
-        thread.start()
+        # Each question gets its own state so a cancelled stream can never write into the next one
+        state = {"parts": [], "render_pending": False, "lock": threading.Lock()}
+        self.answer_state = state
+        
+        # The documents selected in the list (if any) are the only ones searched
+        selected = self.selected_pdfs()
+        search_filter = SearchFilter(source_files=selected) if selected else None
+        
+        # Run question answering on the pipeline's event loop
+        self.pipeline.index = self.index
+        state["future"] = self.runner.submit(self._answer_question(question, state, search_filter))
+    
+    def cancel_question(self):
+        """Stop the answer that is currently streaming"""
+        state = self.answer_state
+        if state is None:
+            return
+        state["future"].cancel()
+        self._finish_question(state, "\n\n*Answer cancelled.*")
     
-    def _ask_question_thread(self, question):
-        """Ask question in background thread"""
+    async def _answer_question(self, question, state, search_filter=None):
+        """Retrieve context and stream the answer into the GUI (runs on the pipeline loop)"""
         try:
-            # Find most relevant context
-            context = find_most_relevant(question, self.embeddings)
-            
-            # Get answer from GPT using selected model
-            answer = ask_gpt(question, context, model=self.selected_model)
+            async for delta in self.pipeline.answer_stream(question, model=self.selected_model,
+                                                           search_filter=search_filter):
+                self._queue_delta(state, delta)
             
             # Update GUI in main thread
-            self.root.after(0, self._question_complete, answer)
+            self.root.after(0, self._question_complete, state)
             
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            self.root.after(0, self._question_error, str(e))
+            self.root.after(0, self._question_error, state, str(e))
     
-    def _question_complete(self, answer):
+    def _queue_delta(self, state, delta):
+        """Buffer a streamed delta and schedule one render for everything that arrives meanwhile"""
+        with state["lock"]:
+            state["parts"].append(delta)
+            if state["render_pending"]:
+                return
+            state["render_pending"] = True
+        self.root.after(STREAM_RENDER_INTERVAL_MS, self._render_stream, state)
+    
+    def _render_stream(self, state):
+        """Render the answer streamed so far (runs in the main thread)"""
+        with state["lock"]:
+            state["render_pending"] = False
+            text = "".join(state["parts"])
+        if state is not self.answer_state:
+            return
+        render_markdown_to_tk_text(self.answer_text, text)
+        self.answer_text.see("end")
+    
+    def _finish_question(self, state, suffix=""):
+        """Render the final answer and turn the stop button back into the ask button"""
+        if state is not self.answer_state:
+            return
+        self.answer_state = None
+        self.ask_btn.configure(state='normal', text="🔍 Ask Question", command=self.ask_question)
+        with state["lock"]:
+            text = "".join(state["parts"])
+        render_markdown_to_tk_text(self.answer_text, text + suffix)
+    
+    def _question_complete(self, state):
         """Called when question answering is complete"""
-        self.ask_btn.configure(state='normal', text="🔍 Ask Question")
-        render_markdown_to_tk_text(self.answer_text, answer)
+        self._finish_question(state)
     
-    def _question_error(self, error_msg):
+    def _question_error(self, state, error_msg):
         """Called when question answering encounters an error"""
-        self.ask_btn.configure(state='normal', text="🔍 Ask Question")
-        render_markdown_to_tk_text(self.answer_text, f"**Error:** {error_msg}")
+        if state is not self.answer_state:
+            return
+        with state["lock"]:
+            state["parts"] = []
+        self._finish_question(state, f"**Error:** {error_msg}")
     
     def run(self):
         """Start the GUI application"""
@@ -0,0 +1,173 @@
+"""
+One parse per PDF.
+
+Opening a PdfReader reads the file's cross-reference table and page tree,
+which takes seconds for a large scanned manual. PdfDocument opens the
+reader on first use and serves page text, metadata and the first-page
+preview from that one reader, so ingestion, the file list and the preview
+window no longer parse the same file three times.
+
+Metadata and the preview are also kept in a sidecar cache (PdfInfoCache,
+pdf_cache.sqlite) keyed by (path, mtime, size). Ingestion fills it in
+while the file is open anyway, and a later session listing the same
+unchanged files reads them from the cache without parsing at all.
+
+Usage:
+    document = PdfDocument("manual.pdf")
+    info = document.metadata()       # cached after the first session
+    for text in document.iter_pages():
+        ...
+"""
+
+import os
+from datetime import datetime
+from PyPDF2 import PdfReader
+from cache_manager import PdfInfoCache
+
+# First-page characters kept in the cache for previews
+PREVIEW_CACHE_CHARS = 2000
+
+_pdf_cache = None
+
+def get_pdf_cache():
+    """Return the shared PDF info cache, opening it on first use"""
+    global _pdf_cache
+    if _pdf_cache is None:
+        _pdf_cache = PdfInfoCache()
+    return _pdf_cache
+
+def set_pdf_cache(cache):
+    """Replace the shared PDF info cache (None re-opens the default, False disables it)"""
+    global _pdf_cache
+    _pdf_cache = cache
+
+def _pdf_date(value):
+    """'YYYY-MM-DD HH:MM:SS' for a PDF date string ('D:20230501100000+02'00'), else the value unchanged"""
+    if isinstance(value, str) and value.startswith('D:'):
+        date_str = value[2:]  # Remove 'D:' prefix
+        if len(date_str) >= 14 and date_str[:14].isdigit():
+            return (f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:8]} "
+                    f"{date_str[8:10]}:{date_str[10:12]}:{date_str[12:14]}")
+    return value
+
+class PdfDocument:
+    """A PDF opened at most once, serving page texts, metadata and preview lazily.
+
+    ``cache`` is a PdfInfoCache (the shared one by default, False for none).
+    """
+
+    def __init__(self, file_path, cache=None):
+        self.file_path = file_path
+        stat = os.stat(file_path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        cache = get_pdf_cache() if cache is None else cache
+        # An empty cache is falsy (it has a length), so disabled is kept as None
+        self.cache = None if cache is False else cache
+        self._reader = None
+        self._entry = None
+        self._first_page = None
+
+    @property
+    def reader(self):
+        """The PdfReader, created on first access"""
+        if self._reader is None:
+            self._reader = PdfReader(self.file_path)
+        return self._reader
+
+    def _cached(self):
+        """The sidecar entry of this exact file version, or None"""
+        if self._entry is None and self.cache is not None:
+            self._entry = self.cache.get_entry(self.file_path, self.mtime, self.size)
+        return self._entry
+
+    @property
+    def page_count(self):
+        entry = self._cached()
+        if entry is not None:
+            return entry["metadata"]["num_pages"]
+        return len(self.reader.pages)
+
+    def page_text(self, index):
+        """Stripped text of one page (0-based)"""
+        text = self.reader.pages[index].extract_text().strip()
+        if index == 0:
+            self._first_page = text
+        return text
+
+    def iter_pages(self, keep_empty=False, start=0, stop=None):
+        """Yield the stripped text of each non-empty page in [start, stop) (every page with keep_empty)"""
+        stop = len(self.reader.pages) if stop is None else stop
+        for index in range(start, stop):
+            text = self.page_text(index)
+            if text or keep_empty:
+                yield text
+
+    def _read_metadata(self):
+        metadata = self.reader.metadata
+        pdf_info = {
+            'filename': os.path.basename(self.file_path),
+            'filepath': self.file_path,
+            'file_size_mb': round(self.size / (1024 * 1024), 2),
+            'num_pages': len(self.reader.pages),
+            'title': metadata.get('/Title', 'No title') if metadata else 'No title',
+            'author': metadata.get('/Author', 'Unknown') if metadata else 'Unknown',
+            'subject': metadata.get('/Subject', 'No subject') if metadata else 'No subject',
+            'creator': metadata.get('/Creator', 'Unknown') if metadata else 'Unknown',
+            'producer': metadata.get('/Producer', 'Unknown') if metadata else 'Unknown',
+            'creation_date': metadata.get('/CreationDate', 'Unknown') if metadata else 'Unknown',
+            'modification_date': metadata.get('/ModDate', 'Unknown') if metadata else 'Unknown',
+            'last_modified': datetime.fromtimestamp(self.mtime).strftime('%Y-%m-%d %H:%M:%S')
+        }
+        # Plain strings (PyPDF2 returns its own string objects) with readable dates
+        return {
+            key: value if isinstance(value, (int, float)) else _pdf_date(str(value))
+            for key, value in pdf_info.items()
+        }
+
+    def _read_preview(self):
+        text = self._first_page
+        if text is None:
+            text = self.page_text(0) if len(self.reader.pages) else ""
+        return ' '.join(text.split())[:PREVIEW_CACHE_CHARS]
+
+    def entry(self):
+        """Metadata and preview of this file version, from the cache or read (and cached) now"""
+        entry = self._cached()
+        if entry is None:
+            entry = self._entry = {
+                "path": self.file_path,
+                "mtime": self.mtime,
+                "size": self.size,
+                "metadata": self._read_metadata(),
+                "preview": self._read_preview()
+            }
+            if self.cache is not None:
+                self.cache.put_entry(entry)
+        return entry
+
+    def metadata(self):
+        """File and PDF metadata (title, author, dates, num_pages...) as a dict"""
+        # The cache is keyed by absolute path; report the path as given
+        return dict(self.entry()["metadata"], filename=os.path.basename(self.file_path), filepath=self.file_path)
+
+    def preview(self, max_chars=200):
+        """Whitespace-collapsed start of the first page's text"""
+        preview = self.entry()["preview"]
+        if len(preview) > max_chars:
+            preview = preview[:max_chars] + "..."
+        return preview
+
+    def remember(self):
+        """Cache metadata and preview while the reader is open (cheap after reading the pages)"""
+        if self.cache is not None and self._reader is not None:
+            self.entry()
+
+    def close(self):
+        self._reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
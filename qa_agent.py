@@ -1,6 +1,9 @@
 import os
 from dotenv import load_dotenv
 from openai import OpenAI
+from cache_manager import AnswerCache
+from tracing import span, start_trace, usage_tokens
+from vector_search import retrieve
 
 # Load environment variables from .env
 load_dotenv()
@@ -15,36 +18,46 @@ AVAILABLE_MODELS = {
         "description": "Fast and cost-effective, good for simple questions",
         "cost": "Low",
         "accuracy": "Good",
-        "max_tokens": 4000
+        "max_tokens": 4000,
+        "context_window": 128000,
+        "context_tokens": 6000
     },
     "gpt-4o": {
         "name": "GPT-4o",
         "description": "Balanced performance and cost, excellent for most tasks",
         "cost": "Medium",
         "accuracy": "Excellent",
-        "max_tokens": 4000
+        "max_tokens": 4000,
+        "context_window": 128000,
+        "context_tokens": 4000
     },
     "gpt-3.5-turbo": {
         "name": "GPT-3.5 Turbo",
         "description": "Legacy fast and cost-effective model, good for lightweight tasks",
         "cost": "Very Low",
         "accuracy": "Medium",
-        "max_tokens": 4000
+        "max_tokens": 4000,
+        "context_window": 16385,
+        "context_tokens": 3000
     },
     "gpt-4": {
         "name": "GPT-4",
         "description": "Highest accuracy, best for complex reasoning",
         "cost": "High",
         "accuracy": "Outstanding",
-        "max_tokens": 4000
+        "max_tokens": 4000,
+        "context_window": 8192,
+        "context_tokens": 3000
     }
 }
 
-def ask_gpt(question, context, model="gpt-4o", temperature=0.1):
-    """Ask GPT a question with provided context using specified model"""
-    try:
-        # Enhanced system prompt for better accuracy
-        system_prompt = """You are an expert technical assistant specializing in document analysis and question answering. 
+# context_tokens is the budget for retrieved document text in each prompt:
+# well inside the context window (which also holds the system prompt, the
+# question and max_tokens of answer), and small enough to keep prompts cheap.
+DEFAULT_CONTEXT_TOKENS = 3000
+
+# Enhanced system prompt for better accuracy
+SYSTEM_PROMPT = """You are an expert technical assistant specializing in document analysis and question answering. 
 
 Your task is to provide accurate, helpful answers based ONLY on the provided context. Follow these guidelines:
 
@@ -56,25 +69,181 @@ Your task is to provide accurate, helpful answers based ONLY on the provided con
 
 If the context is insufficient to answer the question completely, explain what information is missing and what you can determine from the available context."""
 
-        user_prompt = f"""Context:
+_answer_cache = None
+
+def get_answer_cache():
+    """Return the shared answer cache, opening it on first use"""
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache()
+    return _answer_cache
+
+def set_answer_cache(cache):
+    """Replace the shared answer cache (None re-opens the default, False disables it)"""
+    global _answer_cache
+    _answer_cache = cache
+
+def context_budget(model):
+    """Tokens of retrieved context to send with a question to this model"""
+    return AVAILABLE_MODELS.get(model, {}).get("context_tokens", DEFAULT_CONTEXT_TOKENS)
+
+def build_messages(question, context):
+    """Chat messages for a question and its retrieved context"""
+    user_prompt = f"""Context:
 {context}
 
 Question: {question}
 
 Please provide a comprehensive answer based on the context above. If the context doesn't contain sufficient information, please explain what information is missing."""
 
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=temperature,
-            max_tokens=AVAILABLE_MODELS[model]["max_tokens"]
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Error getting response from OpenAI using {model}: {str(e)}"
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def ask_gpt(question, context, model="gpt-4o", temperature=0.1, use_cache=True, index_version=None):
+    """Ask GPT a question with provided context using specified model.
+
+    Answers are cached by (prompt, context, question, model, temperature,
+    index_version); pass the index's ``version`` so answers are not reused
+    once the documents change, and ``use_cache=False`` to force a fresh answer.
+    """
+    with span("chat", model=model) as stage:
+        cache = get_answer_cache() if use_cache else False
+        cache_key = (SYSTEM_PROMPT, context, question, model, temperature, index_version)
+        if cache is not False:
+            answer = cache.get_answer(*cache_key)
+            stage.set(cache_hit=answer is not None)
+            if answer is not None:
+                return answer
+
+        messages = build_messages(question, context)
+        try:
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=AVAILABLE_MODELS[model]["max_tokens"]
+            )
+            answer = response.choices[0].message.content
+        except Exception as e:
+            stage.error = type(e).__name__
+            return f"Error getting response from OpenAI using {model}: {str(e)}"
+        record_usage(stage, response, messages, answer)
+
+        # Errors are never cached, only real answers
+        if cache is not False and answer:
+            cache.put_answer(*cache_key, answer=answer)
+        return answer
+
+def ask_gpt_stream(question, context, model="gpt-4o", temperature=0.1, use_cache=True, index_version=None,
+                   cancel=None):
+    """Like ask_gpt, but yield the answer as text deltas while it is generated.
+
+    Set the ``cancel`` event (or close the generator) to stop mid-stream; the
+    request is closed and a partial answer is not cached. A cached answer is
+    yielded in one piece.
+    """
+    with span("chat", model=model, stream=True) as stage:
+        cache = get_answer_cache() if use_cache else False
+        cache_key = (SYSTEM_PROMPT, context, question, model, temperature, index_version)
+        if cache is not False:
+            answer = cache.get_answer(*cache_key)
+            stage.set(cache_hit=answer is not None)
+            if answer is not None:
+                yield answer
+                return
+
+        messages = build_messages(question, context)
+        parts = []
+        usage_chunk = None
+        stream = None
+        try:
+            stream = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=AVAILABLE_MODELS[model]["max_tokens"],
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            for chunk in stream:
+                if cancel is not None and cancel.is_set():
+                    stage.set(cancelled=True)
+                    return
+                # The usage arrives in a final chunk without choices
+                if getattr(chunk, "usage", None):
+                    usage_chunk = chunk
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not parts:
+                        stage.set(first_token_ms=round(stage.elapsed_ms(), 3))
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            stage.error = type(e).__name__
+            yield f"Error getting response from OpenAI using {model}: {str(e)}"
+            return
+        finally:
+            # Closing the stream drops the connection, which stops generation server-side
+            if stream is not None:
+                stream.close()
+            record_usage(stage, usage_chunk, messages, "".join(parts))
+
+        answer = "".join(parts)
+        if cache is not False and answer:
+            cache.put_answer(*cache_key, answer=answer)
+
+def record_usage(stage, response, messages, answer):
+    """Set tokens_in/tokens_out on a chat span, estimating them if the API did not report usage"""
+    tokens_in = usage_tokens(response, "prompt_tokens")
+    tokens_out = usage_tokens(response, "completion_tokens")
+    if tokens_in is None:
+        tokens_in = sum(len(message["content"]) // 4 + 1 for message in messages)
+        tokens_out = len(answer or "") // 4 + 1 if answer else 0
+        stage.set(tokens_estimated=True)
+    stage.set(tokens_in=tokens_in, tokens_out=tokens_out)
+
+class QAResult:
+    """An answer with the context it was based on, the search hits and the stage trace"""
+
+    def __init__(self, question, answer, context, hits, model, trace):
+        self.question = question
+        self.answer = answer
+        self.context = context
+        self.hits = hits
+        self.model = model
+        self.trace = trace
+
+    @property
+    def timings(self):
+        """Milliseconds per stage"""
+        return {span.name: round(self.trace.stage_ms(span.name), 3) for span in self.trace.spans}
+
+    def to_dict(self):
+        return {
+            "question": self.question,
+            "answer": self.answer,
+            "context": self.context,
+            "model": self.model,
+            "hits": [{"row": row, "similarity": sim} for row, sim in self.hits],
+            "trace": self.trace.to_dict()
+        }
+
+    def __str__(self):
+        return self.answer or ""
+
+def answer_question(question, index, model="gpt-4o", top_k=None, similarity_threshold=0.7, temperature=0.1,
+                    use_cache=True, search_filter=None):
+    """Retrieve context (packed to the model's token budget) and answer a question, returning a traced QAResult"""
+    attributes = {"filter": search_filter.to_dict()} if search_filter else {}
+    with start_trace("ask", question=question, model=model, **attributes) as trace:
+        context, hits, index = retrieve(question, index, top_k, similarity_threshold, use_cache,
+                                        token_budget=context_budget(model), model=model, search_filter=search_filter)
+        answer = ask_gpt(question, context, model, temperature, use_cache, index_version=getattr(index, "version", None))
+    return QAResult(question, answer, context, hits, model, trace)
 
 def get_available_models():
     """Return information about available models"""
@@ -0,0 +1,499 @@
+"""
+Asynchronous question answering pipeline.
+
+QAPipeline runs embed -> search -> generate for many questions at once on
+one event loop and one AsyncOpenAI client, whose connection pool is shared
+by every in-flight request. A semaphore caps how many questions are in
+flight, and each stage has its own timeout. Vector search runs in the
+default thread pool (NumPy releases the GIL), so scoring one question
+overlaps with network waits of the others. The query embedding and answer
+caches of the sync path are shared.
+
+With micro-batching enabled (QueryBatcher), questions arriving within a
+few milliseconds of each other share one embeddings request and one
+matrix product over the index instead of one of each per question.
+
+AsyncRunner keeps an event loop alive in a background thread so GUI code
+can submit coroutines without starting a thread per question.
+"""
+
+import os
+import asyncio
+import functools
+import threading
+import contextvars
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from vector_search import (QUERY_EMBEDDING_MODEL, CONTEXT_CANDIDATES, get_query_cache, build_context,
+                           retrieval_mode, lexical_search, fuse_hits)
+from qa_agent import (AVAILABLE_MODELS, SYSTEM_PROMPT, QAResult, build_messages, context_budget, get_answer_cache,
+                      record_usage)
+from tracing import span, start_trace, usage_tokens
+
+load_dotenv()
+
+# Questions processed at the same time
+DEFAULT_CONCURRENCY = 32
+
+# Per-stage timeouts in seconds
+EMBED_TIMEOUT = 15.0
+SEARCH_TIMEOUT = 10.0
+ANSWER_TIMEOUT = 120.0
+
+# Micro-batching: the most questions per batch, and how long to wait for more
+MAX_BATCH_QUERIES = 32
+BATCH_WAIT_SECONDS = 0.005
+
+# Inputs per embeddings request when embedding many questions
+MAX_EMBED_INPUTS = 256
+
+class StageTimeout(TimeoutError):
+    """A pipeline stage took longer than its timeout"""
+
+    def __init__(self, stage, seconds):
+        super().__init__(f"{stage} stage timed out after {seconds:g}s")
+        self.stage = stage
+        self.seconds = seconds
+
+async def _with_timeout(stage, awaitable, seconds):
+    try:
+        return await asyncio.wait_for(awaitable, seconds)
+    except asyncio.TimeoutError:
+        raise StageTimeout(stage, seconds) from None
+
+class QueryBatcher:
+    """Collects concurrent retrievals and serves them with one embed call and one search_many"""
+
+    def __init__(self, pipeline, max_batch=MAX_BATCH_QUERIES, max_wait=BATCH_WAIT_SECONDS):
+        self.pipeline = pipeline
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.batched_queries = 0
+        self._queue = None
+        self._worker = None
+
+    async def search(self, question, index, top_k):
+        """Queue a question; resolves to its search hits once its batch is scored"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            # A fresh context, so batch spans are not attributed to the trace of whichever question came first
+            self._worker = asyncio.get_running_loop().create_task(self._run(), context=contextvars.Context())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((question, index, top_k, future))
+        return await future
+
+    async def _collect(self):
+        """Wait for one request, then take whatever else arrives within max_wait"""
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = [item for item in await self._collect() if not item[3].cancelled()]
+            if not batch:
+                continue
+            # Questions against different index objects (after a reload) are scored separately
+            groups = {}
+            for item in batch:
+                groups.setdefault(id(item[1]), []).append(item)
+            for group in groups.values():
+                try:
+                    results = await self._search_group(group)
+                except Exception as e:
+                    for *_, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (*_, future), hits in zip(group, results):
+                    if not future.done():
+                        future.set_result(hits)
+
+    async def _search_group(self, group):
+        index = group[0][1]
+        top_k = max(item[2] for item in group)
+        results = await self.pipeline.search_many([item[0] for item in group], top_k, index)
+        self.batches += 1
+        self.batched_queries += len(group)
+        return [hits[:item[2]] for item, hits in zip(group, results)]
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "queries": self.batched_queries,
+            "mean_batch_size": self.batched_queries / self.batches if self.batches else 0.0
+        }
+
+def _filter_attributes(search_filter):
+    """Trace attributes describing a search filter (none when unfiltered)"""
+    return {"filter": search_filter.to_dict()} if search_filter else {}
+
+class QAPipeline:
+    """Answer questions against a VectorIndex with overlapped retrieval and generation"""
+
+    def __init__(self, index, model="gpt-4o", client=None, concurrency=DEFAULT_CONCURRENCY,
+                 embed_timeout=EMBED_TIMEOUT, search_timeout=SEARCH_TIMEOUT, answer_timeout=ANSWER_TIMEOUT,
+                 top_k=3, similarity_threshold=0.7, temperature=0.1, use_cache=True, batching=False,
+                 context_candidates=CONTEXT_CANDIDATES, token_budget=None, mode=None):
+        self.index = index
+        self.model = model
+        self.client = client or AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.concurrency = concurrency
+        self.embed_timeout = embed_timeout
+        self.search_timeout = search_timeout
+        self.answer_timeout = answer_timeout
+        self.top_k = top_k
+        self.context_candidates = context_candidates
+        self.token_budget = token_budget
+        self.mode = mode
+        self.similarity_threshold = similarity_threshold
+        self.temperature = temperature
+        self.use_cache = use_cache
+        self.batcher = QueryBatcher(self) if batching else None
+        self._semaphore = None
+        self._semaphore_loop = None
+
+    @property
+    def semaphore(self):
+        # One semaphore per event loop, created on first use from that loop
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _blocking(self, function, *args, **kwargs):
+        """Run a blocking call (SQLite cache reads and writes) off the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+    async def embed(self, question):
+        """Embed a question, using the shared query embedding cache"""
+        with span("embed_query", model=QUERY_EMBEDDING_MODEL) as stage:
+            cache = get_query_cache() if self.use_cache else False
+            if cache is not False:
+                vector = await self._blocking(cache.get_vector, QUERY_EMBEDDING_MODEL, question)
+                stage.set(cache_hit=vector is not None)
+                if vector is not None:
+                    return vector
+
+            response = await _with_timeout(
+                "embed",
+                self.client.embeddings.create(model=QUERY_EMBEDDING_MODEL, input=question),
+                self.embed_timeout
+            )
+            stage.set(tokens_in=usage_tokens(response, "prompt_tokens"))
+            vector = response.data[0].embedding
+            if cache is not False:
+                await self._blocking(cache.put_vector, QUERY_EMBEDDING_MODEL, question, vector)
+            return vector
+
+    async def embed_many(self, questions):
+        """Embed many questions with as few requests as possible, skipping cached ones"""
+        with span("embed_query", model=QUERY_EMBEDDING_MODEL, queries=len(questions)) as stage:
+            cache = get_query_cache() if self.use_cache else False
+            vectors = [None] * len(questions)
+            if cache is not False:
+                vectors = await self._blocking(
+                    lambda: [cache.get_vector(QUERY_EMBEDDING_MODEL, q) for q in questions]
+                )
+            missing = sorted({q for q, vector in zip(questions, vectors) if vector is None})
+            stage.set(cache_hits=sum(vector is not None for vector in vectors))
+            if not missing:
+                return vectors
+
+            async def embed_batch(batch):
+                response = await _with_timeout(
+                    "embed",
+                    self.client.embeddings.create(model=QUERY_EMBEDDING_MODEL, input=batch),
+                    self.embed_timeout
+                )
+                tokens = usage_tokens(response, "prompt_tokens")
+                if tokens:
+                    stage.set(tokens_in=stage.attributes.get("tokens_in", 0) + tokens)
+                return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+            batches = [missing[i:i + MAX_EMBED_INPUTS] for i in range(0, len(missing), MAX_EMBED_INPUTS)]
+            embedded = {}
+            for batch, batch_vectors in zip(batches, await asyncio.gather(*(embed_batch(b) for b in batches))):
+                embedded.update(zip(batch, batch_vectors))
+            if cache is not False:
+                await self._blocking(
+                    lambda: [cache.put_vector(QUERY_EMBEDDING_MODEL, q, vector) for q, vector in embedded.items()]
+                )
+            return [embedded[q] if vector is None else vector for q, vector in zip(questions, vectors)]
+
+    async def search_many(self, questions, top_k=None, index=None, rows=None):
+        """Hits for many questions: batched embedding, then one matrix product per row block"""
+        index = index or self.index
+        vectors = await self.embed_many(questions)
+        loop = asyncio.get_running_loop()
+        search = functools.partial(index.search_many, vectors, top_k or self.top_k, rows=rows)
+        with span("search", chunks=len(index) if rows is None else len(rows), queries=len(questions),
+                  approximate=index.ann is not None and rows is None):
+            return await _with_timeout("search", loop.run_in_executor(None, search), self.search_timeout)
+
+    def retrieval_mode(self, index, mode=None):
+        """"vector", "lexical" or "hybrid" for this index (see vector_search.retrieve)"""
+        return retrieval_mode(index, mode or self.mode)
+
+    async def _in_thread(self, function, *args):
+        # Off the event loop, in this task's context so spans still reach its trace
+        loop = asyncio.get_running_loop()
+        call = functools.partial(contextvars.copy_context().run, function, *args)
+        return await _with_timeout("search", loop.run_in_executor(None, call), self.search_timeout)
+
+    async def search_block(self, questions, top_k=None, index=None, mode=None, search_filter=None):
+        """Hits for many questions in the index's retrieval mode (vector hits via search_many)"""
+        index = index or self.index
+        top_k = top_k or self.top_k
+        mode = self.retrieval_mode(index, mode)
+        rows = index.filter_rows(search_filter)
+        if mode == "lexical":
+            return [await self._in_thread(lexical_search, index, question, top_k, rows) for question in questions]
+        all_hits = await self.search_many(questions, max(top_k, CONTEXT_CANDIDATES) if mode == "hybrid" else top_k,
+                                          index, rows)
+        if mode == "vector":
+            return all_hits
+        return [
+            await self._in_thread(fuse_hits, index, question, hits, top_k, self.similarity_threshold, rows)
+            for question, hits in zip(questions, all_hits)
+        ]
+
+    async def search(self, question, top_k=None, index=None, mode=None, search_filter=None):
+        """Return the hits for a question: (row, similarity), or (row, score) for lexical and hybrid modes.
+
+        A SearchFilter limits the hits to the matching documents and pages.
+        """
+        index = index or self.index
+        top_k = top_k or self.top_k
+        mode = self.retrieval_mode(index, mode)
+        rows = index.filter_rows(search_filter)
+        if rows is not None and len(rows) == 0:
+            return []
+        if mode == "lexical":
+            return await self._in_thread(lexical_search, index, question, top_k, rows)
+        if mode == "hybrid":
+            hits = await self._vector_search(question, max(top_k, CONTEXT_CANDIDATES), index, rows)
+            return await self._in_thread(fuse_hits, index, question, hits, top_k, self.similarity_threshold, rows)
+        return await self._vector_search(question, top_k, index, rows)
+
+    async def _vector_search(self, question, top_k, index, rows=None):
+        # Filtered searches score their own subset, so they do not join a batch over the whole matrix
+        if self.batcher is not None and rows is None:
+            # Waiting for the batch, its embeddings request and its matrix product, as seen by this question
+            with span("batched_search") as stage:
+                hits = await self.batcher.search(question, index, top_k)
+                stage.set(hits=len(hits))
+                return hits
+        vector = await self.embed(question)
+        loop = asyncio.get_running_loop()
+        search = functools.partial(index.search, vector, top_k, rows=rows)
+        with span("search", chunks=len(index) if rows is None else len(rows),
+                  approximate=index.ann is not None and rows is None) as stage:
+            hits = await _with_timeout("search", loop.run_in_executor(None, search), self.search_timeout)
+            stage.set(hits=len(hits))
+            return hits
+
+    def context_budget(self, model=None):
+        """Context tokens per prompt: the fixed token_budget if one was given, else the model's"""
+        return self.token_budget or context_budget(model or self.model)
+
+    def build_context(self, index, hits, model=None, mode=None):
+        """Pack search hits into a context string within the model's token budget"""
+        # Lexical and fused hits are already filtered; only cosine similarities meet the threshold here
+        threshold = self.similarity_threshold if self.retrieval_mode(index, mode) == "vector" else None
+        return build_context(index, hits, threshold, self.context_budget(model), model or self.model)
+
+    async def retrieve(self, question, index=None, model=None, search_filter=None):
+        """Return the context string for a question (embed, then search off the event loop)"""
+        index = index or self.index
+        hits = await self.search(question, self.context_candidates, index, search_filter=search_filter)
+        return self.build_context(index, hits, model)
+
+    def _cache_key(self, question, context, model, index):
+        return (SYSTEM_PROMPT, context, question, model, self.temperature, index.version)
+
+    async def generate(self, question, context, model=None, index=None):
+        """Complete an answer for a question and its context"""
+        model = model or self.model
+        with span("chat", model=model) as stage:
+            cache = get_answer_cache() if self.use_cache else False
+            key = self._cache_key(question, context, model, index or self.index)
+            if cache is not False:
+                answer = await self._blocking(cache.get_answer, *key)
+                stage.set(cache_hit=answer is not None)
+                if answer is not None:
+                    return answer
+
+            messages = build_messages(question, context)
+            response = await _with_timeout(
+                "answer",
+                self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=self.temperature,
+                    max_tokens=AVAILABLE_MODELS[model]["max_tokens"]
+                ),
+                self.answer_timeout
+            )
+            answer = response.choices[0].message.content
+            record_usage(stage, response, messages, answer)
+            if cache is not False and answer:
+                await self._blocking(cache.put_answer, *key, answer=answer)
+            return answer
+
+    async def answer_result(self, question, model=None, search_filter=None):
+        """Answer one question end to end; returns a QAResult with hits and the stage trace"""
+        model = model or self.model
+        # The index is captured once so a reload mid-question cannot mix versions
+        index = self.index
+        with start_trace("ask", question=question, model=model, **_filter_attributes(search_filter)) as trace:
+            async with self.semaphore:
+                hits = await self.search(question, self.context_candidates, index, search_filter=search_filter)
+                context = self.build_context(index, hits, model)
+                answer = await self.generate(question, context, model, index)
+        return QAResult(question, answer, context, hits, model, trace)
+
+    async def answer_with_context(self, question, model=None, search_filter=None):
+        """Answer one question end to end; returns (answer, context)"""
+        result = await self.answer_result(question, model, search_filter)
+        return result.answer, result.context
+
+    async def answer(self, question, model=None, search_filter=None):
+        """Answer one question end to end"""
+        answer, _ = await self.answer_with_context(question, model, search_filter)
+        return answer
+
+    async def answer_stream(self, question, model=None, search_filter=None):
+        """Answer one question, yielding text deltas as they are generated.
+
+        Cancelling the consuming task closes the stream. The answer timeout
+        covers the whole generation, not each delta.
+        """
+        model = model or self.model
+        index = self.index
+        with start_trace("ask", question=question, model=model, stream=True, **_filter_attributes(search_filter)):
+            async with self.semaphore:
+                context = await self.retrieve(question, index, model, search_filter)
+                async for delta in self._generate_stream(question, context, model, index):
+                    yield delta
+
+    async def _generate_stream(self, question, context, model, index):
+        with span("chat", model=model, stream=True) as stage:
+            cache = get_answer_cache() if self.use_cache else False
+            key = self._cache_key(question, context, model, index)
+            if cache is not False:
+                answer = await self._blocking(cache.get_answer, *key)
+                stage.set(cache_hit=answer is not None)
+                if answer is not None:
+                    yield answer
+                    return
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.answer_timeout
+            messages = build_messages(question, context)
+            stream = await _with_timeout(
+                "answer",
+                self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=self.temperature,
+                    max_tokens=AVAILABLE_MODELS[model]["max_tokens"],
+                    stream=True,
+                    stream_options={"include_usage": True}
+                ),
+                self.answer_timeout
+            )
+            parts = []
+            usage_chunk = None
+            chunks = stream.__aiter__()
+            try:
+                while True:
+                    try:
+                        chunk = await _with_timeout("answer", chunks.__anext__(), deadline - loop.time())
+                    except StopAsyncIteration:
+                        break
+                    # The usage arrives in a final chunk without choices
+                    if getattr(chunk, "usage", None):
+                        usage_chunk = chunk
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if not parts:
+                            stage.set(first_token_ms=round(stage.elapsed_ms(), 3))
+                        parts.append(delta)
+                        yield delta
+            finally:
+                await stream.close()
+                record_usage(stage, usage_chunk, messages, "".join(parts))
+
+            answer = "".join(parts)
+            if cache is not False and answer:
+                await self._blocking(cache.put_answer, *key, answer=answer)
+
+    async def answer_many(self, questions, model=None, return_exceptions=True):
+        """Answer questions concurrently (up to the concurrency limit), results in input order"""
+        return await asyncio.gather(
+            *(self.answer(question, model) for question in questions), return_exceptions=return_exceptions
+        )
+
+    async def aclose(self):
+        await self.client.close()
+
+class AsyncRunner:
+    """An event loop running in a daemon thread, for submitting coroutines from sync code"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, coroutine):
+        """Schedule a coroutine; returns a concurrent.futures.Future (cancel() cancels the task)"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the loop and wait for its result"""
+        return self.submit(coroutine).result(timeout)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+
+if __name__ == "__main__":
+    # Answer the questions in a text file (one per line) concurrently
+    import sys
+    import time
+    from embeddings_manager import load_index
+
+    if len(sys.argv) < 2:
+        print("Usage: python qa_pipeline.py <questions.txt> [store_dir] [model]")
+        sys.exit(1)
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()]
+    pipeline = QAPipeline(
+        load_index(sys.argv[2] if len(sys.argv) > 2 else "embeddings_store"),
+        model=sys.argv[3] if len(sys.argv) > 3 else "gpt-4o"
+    )
+
+    async def run_all():
+        start = time.perf_counter()
+        answers = await pipeline.answer_many(questions)
+        await pipeline.aclose()
+        return answers, time.perf_counter() - start
+
+    answers, elapsed = asyncio.run(run_all())
+    for question, answer in zip(questions, answers):
+        print(f"\nQ: {question}\nA: {answer}")
+    print(f"\nAnswered {len(questions)} questions in {elapsed:.1f}s")
@@ -0,0 +1,280 @@
+"""
+HTTP query service.
+
+Loads the index once and serves it to a whole team from one warm process:
+
+    GET  /health    index size and version, cache and batching counters
+    POST /search    {"query": "...", "top_k": 3, "mode": "hybrid"} -> matching chunks
+    POST /ask       {"question": "...", "model": "gpt-4o"}   -> answer and context
+
+Both accept an optional "filter" limiting retrieval to some documents, e.g.
+{"source_files": ["manual.pdf"], "pages": [10, 20], "author": "Jane Doe",
+"creation_date": {"from": "2023-01", "to": "2023-12"}} (see SearchFilter).
+
+    POST /reload    re-open the embedding store (after a sync)
+    GET  /metrics   stage latencies, tokens and cache hits (Prometheus text format)
+
+Requests are handled on one asyncio event loop by QAPipeline with
+micro-batching on, so concurrent queries share one embeddings request and
+one matrix product over the index. Plain stdlib HTTP/1.1 with keep-alive;
+put a reverse proxy in front for TLS or authentication.
+
+Usage:
+    python qa_server.py [store_dir] [--host 127.0.0.1] [--port 8000] [--model gpt-4o] [--stub]
+        [--trace-log traces.jsonl]
+
+--stub answers with a local fake model client (deterministic embeddings,
+canned answers), which exercises the full request path without an API key.
+"""
+
+import sys
+import json
+import asyncio
+import hashlib
+import argparse
+from http import HTTPStatus
+import numpy as np
+from embeddings_manager import load_index, DEFAULT_STORE_PATH, LEGACY_EMBEDDINGS_FILE
+from qa_pipeline import QAPipeline, StageTimeout
+from qa_agent import AVAILABLE_MODELS, get_answer_cache
+from vector_search import get_query_cache, SearchFilter, RETRIEVAL_MODES
+from tracing import METRICS, set_trace_log
+
+MAX_BODY_BYTES = 1024 * 1024
+MAX_TOP_K = 50
+
+class RequestError(Exception):
+    """A client error reported with an HTTP status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+class StubClient:
+    """Stand-in for AsyncOpenAI: hashed pseudo-embeddings and canned answers, no network"""
+
+    def __init__(self, dim=1536):
+        self.dim = dim
+        self.embeddings = _Result(create=self._embed)
+        self.chat = _Result(completions=_Result(create=self._complete))
+
+    def vector(self, text):
+        seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+        return np.random.default_rng(seed).normal(size=self.dim).astype(np.float32).tolist()
+
+    async def _embed(self, model, input):
+        texts = [input] if isinstance(input, str) else input
+        return _Result(data=[_Result(index=i, embedding=self.vector(text)) for i, text in enumerate(texts)])
+
+    async def _complete(self, model, messages, stream=False, **kwargs):
+        question = messages[-1]["content"].split("Question: ", 1)[-1].split("\n", 1)[0]
+        message = _Result(content=f"(stub {model}) You asked: {question}")
+        return _Result(choices=[_Result(message=message)])
+
+    async def close(self):
+        pass
+
+class QAServer:
+    """Routes HTTP requests to a QAPipeline"""
+
+    def __init__(self, pipeline, store_path=DEFAULT_STORE_PATH, legacy_file=LEGACY_EMBEDDINGS_FILE):
+        self.pipeline = pipeline
+        self.store_path = store_path
+        self.legacy_file = legacy_file
+        self.requests = 0
+
+    @staticmethod
+    def _results(index, hits, score="similarity"):
+        return [
+            {"chunk": index.chunks[row], score: sim, "metadata": index.metadata[row]}
+            for row, sim in hits
+        ]
+
+    async def health(self, body):
+        index = self.pipeline.index
+        stats = {
+            "status": "ok",
+            "chunks": len(index),
+            "version": index.version,
+            "ann": index.ann is not None,
+            "lexical": index.lexical is not None,
+            "requests": self.requests,
+            "query_cache": get_query_cache().stats() if self.pipeline.use_cache else None,
+            "answer_cache": get_answer_cache().stats() if self.pipeline.use_cache else None
+        }
+        if self.pipeline.batcher is not None:
+            stats["batching"] = self.pipeline.batcher.stats()
+        return stats
+
+    async def search(self, body):
+        query = _required_text(body, "query")
+        top_k = _top_k(body, self.pipeline.top_k)
+        mode = body.get("mode")
+        if mode is not None and mode not in RETRIEVAL_MODES:
+            raise RequestError(400, f"mode must be one of {list(RETRIEVAL_MODES)}")
+        index = self.pipeline.index
+        try:
+            mode = self.pipeline.retrieval_mode(index, mode)
+        except ValueError as e:
+            raise RequestError(400, str(e))
+        hits = await self.pipeline.search(query, top_k, index, mode, _search_filter(body))
+        # Cosine similarity for vector hits; BM25 or fused rank scores otherwise
+        score = "similarity" if mode == "vector" else "score"
+        return {"query": query, "mode": mode, "results": self._results(index, hits, score)}
+
+    async def ask(self, body):
+        question = _required_text(body, "question")
+        model = body.get("model", self.pipeline.model)
+        if model not in AVAILABLE_MODELS:
+            raise RequestError(400, f"Unknown model {model!r}; choose one of {sorted(AVAILABLE_MODELS)}")
+        result = await self.pipeline.answer_result(question, model, _search_filter(body))
+        return {
+            "question": question,
+            "model": model,
+            "answer": result.answer,
+            "context": result.context,
+            "trace_id": result.trace.id,
+            "timings": result.timings,
+            "tokens": {"in": result.trace.total("tokens_in"), "out": result.trace.total("tokens_out")}
+        }
+
+    async def reload(self, body):
+        loop = asyncio.get_running_loop()
+        self.pipeline.index = await loop.run_in_executor(None, load_index, self.store_path, self.legacy_file)
+        return {"chunks": len(self.pipeline.index), "version": self.pipeline.index.version}
+
+    async def metrics(self, body):
+        return METRICS.render()
+
+    async def dispatch(self, method, path, body):
+        """Return (status, payload) for one request"""
+        routes = {
+            ("GET", "/health"): self.health,
+            ("POST", "/search"): self.search,
+            ("POST", "/ask"): self.ask,
+            ("POST", "/reload"): self.reload,
+            ("GET", "/metrics"): self.metrics
+        }
+        path = path.split("?", 1)[0]
+        handler = routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in routes):
+                return 405, {"error": f"{method} not allowed on {path}"}
+            return 404, {"error": f"No such endpoint: {path}"}
+        try:
+            data = json.loads(body) if body else {}
+            if not isinstance(data, dict):
+                raise RequestError(400, "Request body must be a JSON object")
+            return 200, await handler(data)
+        except json.JSONDecodeError as e:
+            return 400, {"error": f"Invalid JSON: {e}"}
+        except RequestError as e:
+            return e.status, {"error": str(e)}
+        except StageTimeout as e:
+            return 504, {"error": str(e)}
+        except Exception as e:
+            print(f"Error handling {method} {path}: {e}")
+            return 500, {"error": str(e)}
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until it closes"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    status, payload = 413, {"error": "Request body too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length)
+                    self.requests += 1
+                    status, payload = await self.dispatch(method, path, body)
+                    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                # Handlers return a dict for JSON or a str for plain text (/metrics)
+                if isinstance(payload, str):
+                    data, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+                else:
+                    data, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8000):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving {len(self.pipeline.index)} chunks on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+def _required_text(body, field):
+    value = body.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise RequestError(400, f"'{field}' must be a non-empty string")
+    return value
+
+def _top_k(body, default):
+    top_k = body.get("top_k", default)
+    # JSON true is an int in Python (True == 1); reject it rather than search for one chunk
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= MAX_TOP_K:
+        raise RequestError(400, f"top_k must be an integer between 1 and {MAX_TOP_K}")
+    return top_k
+
+def _search_filter(body):
+    try:
+        return SearchFilter.from_dict(body.get("filter"))
+    except (ValueError, TypeError) as e:
+        raise RequestError(400, f"Invalid filter: {e}")
+
+def create_server(index, client=None, model="gpt-4o", store_path=DEFAULT_STORE_PATH,
+                  legacy_file=LEGACY_EMBEDDINGS_FILE, **pipeline_options):
+    """Build a QAServer around an index; pass a stub ``client`` to run without the API"""
+    pipeline = QAPipeline(index, model=model, client=client, batching=True, **pipeline_options)
+    return QAServer(pipeline, store_path, legacy_file)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Serve document Q&A over HTTP")
+    parser.add_argument("store", nargs="?", default=DEFAULT_STORE_PATH)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model", default="gpt-4o", choices=sorted(AVAILABLE_MODELS))
+    parser.add_argument("--stub", action="store_true", help="use a local fake model client instead of the API")
+    parser.add_argument("--trace-log", help="append a JSONL trace of every /ask request to this file")
+    args = parser.parse_args(argv)
+
+    if args.trace_log:
+        set_trace_log(args.trace_log)
+    index = load_index(args.store, LEGACY_EMBEDDINGS_FILE)
+    client = StubClient(index.matrix.shape[1] or 1536) if args.stub else None
+    server = create_server(index, client=client, model=args.model, store_path=args.store, use_cache=not args.stub)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Server stopped")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
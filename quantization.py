@@ -0,0 +1,344 @@
+"""
+Compressed copies of the embedding matrix for searching.
+
+A float32 1536-dim embedding takes 6 KB. Scanning a quantized copy instead
+keeps only a fraction of that resident on the query nodes:
+
+    float16   2 bytes per dimension                      (2x smaller, slowest
+                                                          to scan: NumPy has no
+                                                          fast float16 products)
+    int8      1 byte per dimension plus a float32 scale  (~4x smaller)
+    pq        product quantization: the vector is split into subvectors of
+              PQ_SUBVECTOR_DIMS dimensions and each one is stored as the
+              id of its nearest of 256 k-means centroids, one byte each
+              (~64x smaller at the default 16 dimensions per subvector)
+
+PQ scores use asymmetric distance computation (ADC): the query stays at
+full precision and is dotted with every centroid once, so scoring a row is
+a sum of table lookups. Quantized scores are approximate, so by default the
+best top_k * RERANK_FACTOR (PQ_RERANK_FACTOR for pq, whose scores are
+coarser) candidates are re-scored against the full-precision vectors (only
+those rows of the memory-mapped matrix are read) before the top_k are
+returned.
+
+The codes are kept next to the store's vectors, not instead of them: what
+shrinks is the memory a search touches, not the disk. To shrink the disk
+too, ``build --float16-vectors`` also rewrites the store's vectors as
+float16, so re-ranking reads float16 rows and the float32 file is dropped
+(2 bytes per dimension on disk plus the codes); with ``rerank=0`` searches
+never read the vectors at all.
+
+Like the ANN and BM25 indexes, the codes cover the first ``built_rows`` rows
+of one store generation: ``update`` encodes rows appended since with the
+same codebooks, tombstoned rows are filtered at query time, and compaction
+rebuilds the codes.
+
+Usage:
+    python quantization.py build <store_dir> [--kind int8|float16|pq] [--subvector-dims 16] [--float16-vectors]
+    python quantization.py bench <store_dir> [--queries N] [--k K]
+    python quantization.py bench --synthetic 100000 --dim 1536
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from ann_index import top_k_rows, synthetic_matrix
+
+QUANTIZED_FILE = "quantized.npz"
+
+QUANTIZATION_KINDS = ("float16", "int8", "pq")
+
+# Full-precision candidates re-scored per result (0 returns the quantized scores as-is)
+RERANK_FACTOR = 4
+PQ_RERANK_FACTOR = 16
+
+# Product quantization: dimensions per subvector and centroids per subspace (one byte per code)
+PQ_SUBVECTOR_DIMS = 16
+PQ_CENTROIDS = 256
+
+# k-means training sample for the PQ codebooks
+PQ_TRAIN_POINTS = 50000
+PQ_ITERATIONS = 10
+
+# Rows encoded or scored per step (bounds the float32 copies made of each block)
+QUANT_BLOCK_ROWS = 1024
+
+def default_rerank(kind):
+    """Candidates re-scored per result by default for a kind of quantization"""
+    return PQ_RERANK_FACTOR if kind == "pq" else RERANK_FACTOR
+
+def _kmeans(points, count, iterations=PQ_ITERATIONS, seed=0):
+    """Euclidean k-means centroids of points (count of them, fewer if there are fewer points)"""
+    rng = np.random.default_rng(seed)
+    count = min(count, len(points))
+    centroids = points[rng.choice(len(points), count, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest(points, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, points)
+        sizes = np.bincount(labels, minlength=count)
+        filled = sizes > 0
+        centroids[filled] = sums[filled] / sizes[filled, None]
+        # Re-seed empty clusters with random points so every code gets used
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = points[rng.choice(len(points), len(empty), replace=False)]
+    return centroids
+
+def _nearest(points, centroids):
+    """Index of the closest centroid (squared Euclidean distance) for each point"""
+    distances = (centroids * centroids).sum(axis=1) - 2 * points @ centroids.T
+    return np.argmin(distances, axis=1)
+
+class QuantizedIndex:
+    """Quantized codes of the rows of a normalized matrix.
+
+    ``codes`` is (rows, dim) float16 or int8, or (rows, subspaces) uint8 for
+    pq; ``scales`` holds the per-row int8 scale and ``codebooks`` the
+    (subspaces, 256, subvector_dims) pq centroids. Only the first
+    ``built_rows`` rows are encoded; ``generation`` ties the codes to the
+    store data files they were built from.
+    """
+
+    def __init__(self, kind, codes, scales=None, codebooks=None, generation=0):
+        if kind not in QUANTIZATION_KINDS:
+            raise ValueError(f"Unknown quantization {kind!r}; choose one of {QUANTIZATION_KINDS}")
+        self.kind = kind
+        self.codes = codes
+        self.scales = scales
+        self.codebooks = codebooks
+        self.generation = generation
+
+    @property
+    def built_rows(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        """Memory held by the codes (and scales/codebooks)"""
+        return sum(array.nbytes for array in (self.codes, self.scales, self.codebooks) if array is not None)
+
+    @classmethod
+    def train(cls, matrix, kind="int8", subvector_dims=PQ_SUBVECTOR_DIMS, exclude=None, generation=0, seed=0):
+        """An empty index with its codebooks trained on matrix (only pq needs training)"""
+        dim = matrix.shape[1]
+        if kind == "float16":
+            return cls(kind, np.zeros((0, dim), dtype=np.float16), generation=generation)
+        if kind == "int8":
+            return cls(kind, np.zeros((0, dim), dtype=np.int8), np.zeros(0, dtype=np.float32), generation=generation)
+
+        if dim % subvector_dims:
+            raise ValueError(f"PQ subvector size {subvector_dims} does not divide the dimension {dim}")
+        rows = np.arange(len(matrix)) if exclude is None else np.flatnonzero(~exclude)
+        if len(rows) == 0:
+            raise ValueError("Cannot train PQ codebooks on an empty matrix")
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(rows, min(len(rows), PQ_TRAIN_POINTS), replace=False))
+        sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+        subspaces = dim // subvector_dims
+        print(f"Training {subspaces} PQ codebooks on {len(sample)} vectors...")
+        codebooks = np.zeros((subspaces, PQ_CENTROIDS, subvector_dims), dtype=np.float32)
+        for m in range(subspaces):
+            centroids = _kmeans(sample[:, m * subvector_dims:(m + 1) * subvector_dims], PQ_CENTROIDS, seed=seed + m)
+            codebooks[m, :len(centroids)] = centroids
+            # With fewer training points than codes the spare codes repeat a real centroid
+            codebooks[m, len(centroids):] = centroids[0]
+        return cls(kind, np.zeros((0, subspaces), dtype=np.uint8), codebooks=codebooks, generation=generation)
+
+    @classmethod
+    def build(cls, matrix, kind="int8", subvector_dims=PQ_SUBVECTOR_DIMS, exclude=None, generation=0, seed=0):
+        """Train (for pq) and encode every row of matrix"""
+        return cls.train(matrix, kind, subvector_dims, exclude, generation, seed).update(matrix)
+
+    def encode(self, block):
+        """(codes, scales) of a block of float32 rows"""
+        if self.kind == "float16":
+            return block.astype(np.float16), None
+        if self.kind == "int8":
+            scales = np.abs(block).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            return np.round(block / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        subspaces, _, subvector_dims = self.codebooks.shape
+        codes = np.empty((len(block), subspaces), dtype=np.uint8)
+        for m in range(subspaces):
+            codes[:, m] = _nearest(block[:, m * subvector_dims:(m + 1) * subvector_dims], self.codebooks[m])
+        return codes, None
+
+    def update(self, matrix, stop=None):
+        """Return an index that also encodes rows built_rows..stop of matrix (all remaining by default)"""
+        stop = len(matrix) if stop is None else stop
+        start = self.built_rows
+        if stop <= start:
+            return self
+        codes, scales = [self.codes], [self.scales] if self.scales is not None else None
+        for block_start in range(start, stop, QUANT_BLOCK_ROWS):
+            block_stop = min(block_start + QUANT_BLOCK_ROWS, stop)
+            block_codes, block_scales = self.encode(np.asarray(matrix[block_start:block_stop], dtype=np.float32))
+            codes.append(block_codes)
+            if scales is not None:
+                scales.append(block_scales)
+        return QuantizedIndex(
+            self.kind, np.concatenate(codes), np.concatenate(scales) if scales is not None else None,
+            self.codebooks, self.generation
+        )
+
+    def scores(self, query):
+        """Approximate inner products of a normalized query with every encoded row"""
+        count = self.built_rows
+        scores = np.empty(count, dtype=np.float32)
+        if self.kind == "pq":
+            # ADC: one table of query-centroid products per subspace, then lookups per row
+            subspaces, _, subvector_dims = self.codebooks.shape
+            table = np.einsum("mcd,md->mc", self.codebooks, query.reshape(subspaces, subvector_dims))
+            subspace_ids = np.arange(subspaces)
+        for start in range(0, count, QUANT_BLOCK_ROWS):
+            stop = min(start + QUANT_BLOCK_ROWS, count)
+            block = slice(start, stop)
+            if self.kind == "pq":
+                scores[start:stop] = table[subspace_ids, self.codes[block]].sum(axis=1)
+            else:
+                scores[start:stop] = self.codes[block].astype(np.float32) @ query
+                if self.scales is not None:
+                    scores[start:stop] *= self.scales[block]
+        return scores
+
+    def search(self, matrix, query, top_k, deleted=None, rerank=None):
+        """Return (rows, scores) of the best top_k rows, best first.
+
+        With ``rerank`` (default_rerank(kind) if None, 0 to turn it off) the
+        best top_k * rerank candidates by quantized score
+        are re-scored against the full-precision ``matrix``, so the scores
+        returned are exact; rows appended after the codes were built are
+        always scored exactly.
+        """
+        rerank = default_rerank(self.kind) if rerank is None else rerank
+        scores = self.scores(query)
+        if deleted is not None:
+            scores[deleted[:len(scores)]] = -np.inf
+        candidates = top_k_rows(scores, min(len(scores), top_k * rerank if rerank else top_k))
+        candidates = candidates[np.isfinite(scores[candidates])]
+        if len(matrix) > self.built_rows:
+            appended = np.arange(self.built_rows, len(matrix))
+            if deleted is not None:
+                appended = appended[~deleted[appended]]
+            candidates = np.concatenate([candidates, appended])
+            rerank = True
+        if rerank:
+            # Sorted ids read the memory-mapped matrix front to back
+            candidates = np.sort(candidates)
+            scores = np.asarray(matrix[candidates], dtype=np.float32) @ query
+        else:
+            scores = scores[candidates]
+        best = top_k_rows(scores, min(top_k, len(candidates)))
+        return candidates[best], scores[best]
+
+    def save(self, path):
+        """Write the codes to an .npz file (atomically)"""
+        empty = np.zeros(0, dtype=np.float32)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                codes=self.codes,
+                scales=self.scales if self.scales is not None else empty,
+                codebooks=self.codebooks if self.codebooks is not None else empty,
+                info=np.array([QUANTIZATION_KINDS.index(self.kind), self.generation], dtype=np.int64)
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            kind_id, generation = (int(value) for value in data["info"])
+            kind = QUANTIZATION_KINDS[kind_id]
+            return cls(
+                kind, data["codes"],
+                data["scales"] if kind == "int8" else None,
+                data["codebooks"] if kind == "pq" else None,
+                generation
+            )
+
+def recall_at_k(matrix, queries, k=10, kinds=QUANTIZATION_KINDS, subvector_dims=PQ_SUBVECTOR_DIMS, deleted=None):
+    """Recall@k, latency and bytes per vector of each quantization over the live rows, with and without re-ranking"""
+    exact = []
+    start = time.perf_counter()
+    for query in queries:
+        scores = np.asarray(matrix @ query, dtype=np.float32)
+        if deleted is not None:
+            scores[deleted] = -np.inf
+        exact.append(set(top_k_rows(scores, k).tolist()))
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    results = [{"kind": "float32", "rerank": 0, "recall": 1.0, "latency_ms": exact_ms,
+                "bytes_per_vector": matrix.shape[1] * 4}]
+    for kind in kinds:
+        if kind == "pq" and matrix.shape[1] % subvector_dims:
+            continue
+        index = QuantizedIndex.build(matrix, kind, subvector_dims, exclude=deleted)
+        for rerank in (0, default_rerank(kind)):
+            found = 0
+            start = time.perf_counter()
+            for query, truth in zip(queries, exact):
+                rows, _ = index.search(matrix, query, k, deleted, rerank)
+                found += len(truth.intersection(rows.tolist()))
+            latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            results.append({
+                "kind": kind, "rerank": rerank, "recall": found / (k * len(queries)), "latency_ms": latency_ms,
+                "bytes_per_vector": index.nbytes / max(index.built_rows, 1)
+            })
+    return results
+
+def _main(argv):
+    parser = argparse.ArgumentParser(description="Build or benchmark the quantized vectors of an embedding store")
+    parser.add_argument("command", choices=["build", "bench"])
+    parser.add_argument("store", nargs="?", default="embeddings_store")
+    parser.add_argument("--kind", choices=QUANTIZATION_KINDS, default="int8")
+    parser.add_argument("--subvector-dims", type=int, default=PQ_SUBVECTOR_DIMS, help="pq: dimensions per code")
+    parser.add_argument("--float16-vectors", action="store_true",
+                        help="build: also keep the store's vectors as float16 (drops the float32 file)")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--synthetic", type=int, default=0, help="bench on N random vectors instead of a store")
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        from embedding_store import EmbeddingStore
+        store = EmbeddingStore(args.store)
+        start = time.perf_counter()
+        if args.float16_vectors:
+            store.set_dtype("float16")
+        index = store.build_quantized(args.kind, args.subvector_dims)
+        full_bytes = index.built_rows * store.dim * 4
+        print(f"Encoded {index.built_rows} vectors as {args.kind} in {time.perf_counter() - start:.1f}s: "
+              f"{index.nbytes / 1e6:.1f} MB instead of {full_bytes / 1e6:.1f} MB "
+              f"(vectors on disk: {len(store) * store.dim * store.dtype.itemsize / 1e6:.1f} MB {store.dtype.name})")
+        return
+
+    deleted = None
+    if args.synthetic:
+        matrix = synthetic_matrix(args.synthetic, args.dim)
+    else:
+        from embedding_store import EmbeddingStore
+        store = EmbeddingStore(args.store)
+        matrix = store.vectors()
+        deleted = store.deleted_mask()
+
+    # Queries are perturbed copies of stored (live) vectors, so they resemble real questions about the corpus
+    rng = np.random.default_rng(1)
+    live = np.arange(len(matrix)) if deleted is None else np.flatnonzero(~deleted)
+    queries = np.asarray(matrix[np.sort(rng.choice(live, min(args.queries, len(live)), replace=False))],
+                         dtype=np.float32)
+    queries = queries + 0.05 * rng.normal(size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    print(f"recall@{args.k} over {len(queries)} queries, {len(live)} vectors of {matrix.shape[1]} dimensions")
+    print(f"{'kind':>8} {'rerank':>7} {'recall':>8} {'ms/query':>10} {'bytes/vec':>10}")
+    for result in recall_at_k(matrix, queries, args.k, subvector_dims=args.subvector_dims, deleted=deleted):
+        print(f"{result['kind']:>8} {result['rerank']:>7} {result['recall']:>8.3f} {result['latency_ms']:>10.2f} "
+              f"{result['bytes_per_vector']:>10.0f}")
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
@@ -1,11 +1,14 @@
 # query_manager.py
-from embeddings_manager import load_embeddings
+from embeddings_manager import load_index
 from vector_search import find_most_relevant
-from qa_agent import ask_gpt
+from qa_agent import ask_gpt_stream, context_budget
+from tracing import start_trace
+
+MODEL = "gpt-4o"
 
 def main():
-    # Load precomputed embeddings
-    embeddings = load_embeddings("embeddings.json")
+    # Open precomputed embeddings (memory-mapped; embeddings.json is converted once)
+    index = load_index("embeddings_store", "embeddings.json")
 
     print("Document Q&A System. Type 'exit' to quit.\n")
 
@@ -14,12 +17,22 @@ def main():
         if question.lower() in ["exit", "quit"]:
             break
 
-        # Find most relevant chunk(s)
-        context = find_most_relevant(question, embeddings)
+        with start_trace("ask", question=question, model=MODEL) as trace:
+            # Find most relevant chunk(s)
+            context = find_most_relevant(question, index, token_budget=context_budget(MODEL), model=MODEL)
 
-        # Ask GPT with retrieved context
-        answer = ask_gpt(question, context)
-        print(f"\nAnswer: {answer}\n")
+            # Ask GPT with retrieved context, printing the answer as it streams in
+            print("\nAnswer: ", end="", flush=True)
+            answer = ask_gpt_stream(question, context, model=MODEL, index_version=index.version)
+            try:
+                for delta in answer:
+                    print(delta, end="", flush=True)
+            except KeyboardInterrupt:
+                # Ctrl+C cancels this answer, not the session
+                answer.close()
+                print("\n[Answer cancelled]", end="")
+            print()
+        print(f"({trace.summary()})\n")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,42 @@
+"""Tests for span-based chunking and page maps"""
+
+from chunker import chunk_spans, materialize, join_pages, span_pages, PAGE_SEPARATOR
+
+SENTENCES = [f"Sentence number {i} describes step {i} of the setup." for i in range(40)]
+TEXT = " ".join(SENTENCES)
+
+def test_chunks_fit_and_cover_the_text():
+    spans = chunk_spans(TEXT, max_tokens=100, overlap_tokens=0, count=len)
+    assert all(end - start <= 100 for start, end in spans)
+    assert " ".join(materialize(TEXT, spans)) == TEXT
+    # Chunks end on sentence boundaries
+    assert all(TEXT[end - 1] == "." for _, end in spans)
+
+def test_overlap_repeats_whole_trailing_sentences():
+    spans = chunk_spans(TEXT, max_tokens=200, overlap_tokens=60, count=len)
+    assert len(spans) > 1
+    for (_, previous_end), (start, end) in zip(spans, spans[1:]):
+        assert start < previous_end
+        overlap = TEXT[start:previous_end]
+        assert overlap.startswith("Sentence") and overlap.endswith(".")
+        assert len(overlap) <= 60
+    assert spans[-1][1] == len(TEXT)
+
+def test_over_long_word_is_sliced():
+    text = "x" * 250
+    spans = chunk_spans(text, max_tokens=100, overlap_tokens=0, count=len)
+    assert "".join(materialize(text, spans)) == text
+    assert all(end - start <= 100 for start, end in spans)
+
+def test_join_pages_records_page_starts():
+    text, starts = join_pages(["first page", "second", "third page here"])
+    assert text == PAGE_SEPARATOR.join(["first page", "second", "third page here"])
+    assert [text[start:start + 5] for start in starts] == ["first", "secon", "third"]
+
+def test_span_pages_maps_spans_to_pages():
+    text, starts = join_pages(["aaaa", "bbbb", "cccc"])
+    assert span_pages(starts, 0, 4) == (0, 0)
+    assert span_pages(starts, 2, 7) == (0, 1)
+    assert span_pages(starts, 5, len(text)) == (1, 2)
+    # A span ending right at a page's start does not cover that page
+    assert span_pages(starts, 0, starts[1]) == (0, 0)
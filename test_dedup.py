@@ -0,0 +1,34 @@
+"""Tests for duplicate chunk detection"""
+
+from dedup import find_duplicates, collapse_duplicates, DUPLICATE_THRESHOLD
+
+NOTICE = ("Warning: disconnect power before servicing the unit. Failure to follow these instructions "
+          "can result in serious injury. Refer all servicing to qualified personnel and keep this "
+          "manual for future reference. Error code E-042 means the fan has stopped.")
+
+def test_exact_copies_collapse_with_provenance():
+    records = [
+        {"text": NOTICE, "page": 1, "chunk_id": "a"},
+        {"text": "Something else entirely about the network settings.", "page": 2, "chunk_id": "b"},
+        {"text": "  " + NOTICE.upper().replace(" ", "  "), "page": 3, "page_end": 4, "chunk_id": "c"},
+    ]
+    kept = collapse_duplicates(records)
+    assert [record["chunk_id"] for record in kept] == ["a", "b"]
+    assert kept[0]["duplicates"] == [{"page": 3, "page_end": 4, "chunk_id": "c"}]
+    assert "duplicates" not in records[0]
+
+def test_one_token_difference_is_not_merged_by_default():
+    other = NOTICE.replace("E-042", "E-043")
+    assert find_duplicates([NOTICE, other]) == [0, 1]
+    kept = collapse_duplicates([{"text": NOTICE}, {"text": other}])
+    assert [record["text"] for record in kept] == [NOTICE, other]
+
+def test_near_duplicates_merge_only_when_opted_in():
+    other = NOTICE.replace("qualified personnel", "qualified staff")
+    assert find_duplicates([NOTICE, other]) == [0, 1]
+    assert find_duplicates([NOTICE, other], DUPLICATE_THRESHOLD) == [0, 0]
+
+def test_unrelated_texts_are_kept():
+    texts = [f"Chapter {i} describes setting number {i * 7} of the router in detail." for i in range(50)]
+    texts = [f"{text} Topic {'abcdefghij'[i % 10] * (i + 1)} only here." for i, text in enumerate(texts)]
+    assert find_duplicates(texts, DUPLICATE_THRESHOLD) == list(range(50))
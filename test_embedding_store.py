@@ -0,0 +1,74 @@
+"""Tests for the binary embedding store: removal, compaction and float16 vectors"""
+
+import os
+import numpy as np
+import pytest
+from embedding_store import EmbeddingStore, save_store
+
+DIM = 8
+
+def _embeddings(source_file, count, seed):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "chunk": f"{source_file} chunk {i}",
+            "embedding": rng.normal(size=DIM).tolist(),
+            "metadata": {"source_file": source_file, "page": i + 1}
+        }
+        for i in range(count)
+    ]
+
+def _rows(store):
+    """(chunk, page, vector) of every live row"""
+    index = store.load_index(use_ann=False, use_quantized=False)
+    deleted = store.deleted_mask()
+    return [
+        (index.chunks[row], int(store.pages()[row]), np.asarray(index.matrix[row], dtype=np.float32))
+        for row in range(len(store)) if deleted is None or not deleted[row]
+    ]
+
+@pytest.fixture
+def store(tmp_path):
+    path = str(tmp_path / "store")
+    save_store(_embeddings("a.pdf", 5, 0) + _embeddings("b.pdf", 4, 1), path)
+    store = EmbeddingStore(path)
+    store.append(_embeddings("c.pdf", 3, 2))
+    return store
+
+def test_compaction_preserves_live_rows(store):
+    store.remove_document("b.pdf")
+    before = _rows(store)
+    store.compact()
+
+    store = EmbeddingStore(store.path)
+    after = _rows(store)
+    assert len(store) == 8 and store.deleted_mask() is None
+    assert [(chunk, page) for chunk, page, _ in after] == [(chunk, page) for chunk, page, _ in before]
+    assert all(np.array_equal(a[2], b[2]) for a, b in zip(after, before))
+    assert store.documents["a.pdf"]["rows"] == [[0, 5]]
+    assert store.documents["c.pdf"]["rows"] == [[5, 8]]
+    assert "b.pdf" not in store.documents
+
+def test_compaction_rebuilds_indexes_for_new_row_ids(store):
+    store.remove_document("a.pdf")
+    store.compact()
+    index = EmbeddingStore(store.path).load_index()
+    assert index.lexical is not None and index.lexical.built_rows == 7
+    row, _ = index.lexical.search("c.pdf chunk 2", 1)[0]
+    assert index.chunks[row] == "c.pdf chunk 2"
+
+def test_float16_vectors_keep_rows_and_search(store):
+    before = _rows(store)
+    store.set_dtype("float16")
+
+    store = EmbeddingStore(store.path)
+    assert store.dtype == np.float16
+    assert os.path.getsize(os.path.join(store.path, store.manifest["files"]["vectors"])) == len(store) * DIM * 2
+    after = _rows(store)
+    assert [chunk for chunk, _, _ in after] == [chunk for chunk, _, _ in before]
+    assert all(np.allclose(a[2], b[2], atol=1e-3) for a, b in zip(after, before))
+
+    store.append(_embeddings("d.pdf", 2, 3))
+    index = EmbeddingStore(store.path).load_index()
+    query = np.asarray(index.matrix[10], dtype=np.float32)
+    assert index.search(query, 1)[0][0] == 10
@@ -0,0 +1,61 @@
+"""Tests for streaming ingestion: a failed update keeps the old version searchable"""
+
+import os
+import numpy as np
+from types import SimpleNamespace
+from embedding_store import EmbeddingStore
+from ingest_pipeline import ingest_documents
+
+class FlakyClient:
+    """Embeddings client stub that fails every batch containing the word 'unreachable'"""
+
+    def __init__(self):
+        self.embeddings = SimpleNamespace(create=self._create)
+
+    def _create(self, model, input):
+        if any("unreachable" in text for text in input):
+            raise ValueError("embedding service unavailable")
+        data = []
+        for i, text in enumerate(input):
+            rng = np.random.default_rng(sum(text.encode("utf-8")))
+            data.append(SimpleNamespace(index=i, embedding=rng.normal(size=8).tolist()))
+        return SimpleNamespace(data=data)
+
+def _ingest(files, tmp_path):
+    return ingest_documents(files, str(tmp_path / "store"), str(tmp_path / "embeddings.json"),
+                            client=FlakyClient(), cache=False)
+
+def _live_chunks(tmp_path, source_file):
+    store = EmbeddingStore(str(tmp_path / "store"))
+    index = store.load_index(use_lexical=False)
+    deleted = store.deleted_mask()
+    return [
+        index.chunks[row] for row in range(len(store))
+        if (deleted is None or not deleted[row]) and index.metadata[row]["source_file"] == source_file
+    ]
+
+def _write(path, text, mtime):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.utime(path, (mtime, mtime))
+
+def test_failed_update_keeps_old_rows(tmp_path):
+    manual = str(tmp_path / "manual.txt")
+    _write(manual, "Reset the router with the button on the back.", 1_000_000)
+    assert _ingest([manual], tmp_path)["added"] == [manual]
+
+    _write(manual, "This unreachable version cannot be embedded right now.", 2_000_000)
+    summary = _ingest([manual], tmp_path)
+    assert summary["failed"] == [manual]
+    assert _live_chunks(tmp_path, manual) == ["Reset the router with the button on the back."]
+
+    # Still changed, so the next run retries it; a successful update replaces the old rows
+    _write(manual, "Hold the button for ten seconds to reset.", 3_000_000)
+    assert _ingest([manual], tmp_path)["updated"] == [manual]
+    assert _live_chunks(tmp_path, manual) == ["Hold the button for ten seconds to reset."]
+
+def test_failed_new_document_is_not_indexed(tmp_path):
+    notes = str(tmp_path / "notes.txt")
+    _write(notes, "An unreachable note.", 1_000_000)
+    assert _ingest([notes], tmp_path)["failed"] == [notes]
+    assert notes not in EmbeddingStore(str(tmp_path / "store")).documents
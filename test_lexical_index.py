@@ -0,0 +1,52 @@
+"""Tests for the BM25 index and its incremental updates"""
+
+import numpy as np
+from lexical_index import LexicalIndex, tokenize
+
+TEXTS = [
+    "Reset the router with the button on the back.",
+    "Error E-042 means the fan has stopped.",
+    "Connect to the SSID printed on the label.",
+    "The fan speed can be set in the settings menu.",
+    "Firmware 2.1.7 fixes error E-043 on startup.",
+    "Unplug the router before cleaning the vents.",
+]
+
+def _same(a, b):
+    assert a.vocabulary == b.vocabulary
+    for name in ("offsets", "rows", "tfs", "lengths"):
+        assert np.array_equal(getattr(a, name), getattr(b, name)), name
+
+def test_tokenize_keeps_identifiers_whole_and_split():
+    assert tokenize("Error E-042") == ["error", "e-042", "e", "042"]
+
+def test_incremental_update_matches_full_build():
+    full = LexicalIndex.build(TEXTS)
+    incremental = LexicalIndex.build(TEXTS[:2]).update(TEXTS, 4).update(TEXTS)
+    _same(full, incremental)
+    assert incremental.update(TEXTS) is incremental
+
+def test_update_with_only_known_terms():
+    texts = TEXTS + ["Reset the router."]
+    _same(LexicalIndex.build(texts), LexicalIndex.build(TEXTS).update(texts))
+
+def test_search_finds_identifiers_and_skips_deleted_rows():
+    index = LexicalIndex.build(TEXTS)
+    assert index.search("e-042")[0][0] == 1
+    deleted = np.zeros(len(TEXTS), dtype=bool)
+    deleted[1] = True
+    index.set_deleted(deleted)
+    assert 1 not in [row for row, _ in index.search("fan e-042")]
+
+def test_save_and_load_round_trip(tmp_path):
+    index = LexicalIndex.build(TEXTS, generation=3)
+    index.save(str(tmp_path / "lexical.npz"))
+    loaded = LexicalIndex.load(str(tmp_path / "lexical.npz"))
+    _same(index, loaded)
+    assert loaded.generation == 3
+
+def test_stopwords_and_common_terms_do_not_match():
+    index = LexicalIndex.build(TEXTS)
+    assert index.search("what is the capital of france") == []
+    # "the" and "fan" are in more than a fifth of the rows, so only the identifier counts
+    assert [row for row, _ in index.search("the fan e-043", max_df_fraction=0.2)] == [4]
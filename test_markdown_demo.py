@@ -123,8 +123,12 @@ The system uses **Retrieval-Augmented Generation (RAG)** to:
 # Load documents
 chunks = load_and_chunk(pdf_files)
 
-# Create embeddings
-embeddings = create_embeddings(chunks)
+# Create embeddings (keep what succeeded if some chunks fail)
+try:
+    embeddings = create_embeddings(chunks)
+except EmbeddingError as e:
+    print(f"{len(e.failed)} chunks not embedded")
+    embeddings = e.embeddings
 
 # Ask questions
 answer = ask_gpt(question, context)
@@ -0,0 +1,28 @@
+"""Tests for page text cleaning"""
+
+from text_cleaner import TextCleaner
+
+BODY = "\n".join(f"Paragraph {word} explains one setting of the router." for word in
+                 ["one", "two", "three", "four", "five", "six", "seven", "eight"])
+
+def test_page_numbers_are_removed():
+    cleaner = TextCleaner()
+    assert cleaner.clean("Page 3 of 40\n" + BODY) == cleaner.clean(BODY)
+    assert cleaner.clean(BODY + "\n- 7 -", page_number=7) == cleaner.clean(BODY)
+
+def test_offset_page_numbers_are_learned():
+    # Printed numbers start at 1 on the third page (two pages of front matter)
+    pages = [BODY + f"\n{page - 2}" for page in range(1, 11)]
+    cleaned = TextCleaner(headers=False).clean_pages(pages)
+    assert all(text == TextCleaner().clean(BODY) for text in cleaned[2:])
+
+def test_lone_years_and_quantities_stay():
+    cleaner = TextCleaner()
+    pages = [BODY + f"\n{page}" for page in range(1, 11)]
+    pages[4] = "2023\n" + pages[4]
+    pages[6] = pages[6] + "\n500"
+    cleaned = cleaner.clean_pages(pages)
+    assert cleaned[4].startswith("2023 ")
+    assert cleaned[6].endswith(" 500")
+    assert not cleaned[5].endswith(" 6")
+    assert cleaner.clean("2023\n" + BODY).startswith("2023 ")
@@ -0,0 +1,40 @@
+"""Tests for hybrid retrieval and the legacy list input"""
+
+import numpy as np
+from vector_search import VectorIndex, fuse_hits, legacy_index
+
+TEXTS = [
+    "Reset the router with the button on the back.",
+    "Error E-042 means the fan has stopped.",
+    "Connect to the SSID printed on the label.",
+    "The fan speed can be set in the settings menu.",
+    "Firmware 2.1.7 fixes error E-043 on startup.",
+    "Unplug the router before cleaning the vents.",
+]
+
+def _index():
+    rng = np.random.default_rng(0)
+    embeddings = [
+        {"chunk": text, "embedding": rng.normal(size=8).tolist(), "metadata": {"source_file": "manual.pdf", "page": i}}
+        for i, text in enumerate(TEXTS)
+    ]
+    return VectorIndex.from_embeddings(embeddings, lexical=True)
+
+def test_unrelated_query_keeps_below_threshold_chunks_out():
+    vector_hits = [(row, 0.1) for row in range(len(TEXTS))]
+    hits = fuse_hits(_index(), "what is the capital of france", vector_hits, top_k=20, similarity_threshold=0.7)
+    # Nothing clears the threshold or matches a selective keyword: only the single best chunk is returned
+    assert len(hits) == 1
+
+def test_identifier_match_bypasses_the_threshold():
+    vector_hits = [(0, 0.5), (3, 0.4)]
+    hits = fuse_hits(_index(), "what does error E-042 mean", vector_hits, top_k=20, similarity_threshold=0.7)
+    assert [row for row, _ in hits] == [1]
+
+def test_legacy_list_index_is_built_once():
+    embeddings = [{"chunk": text, "embedding": [float(i), 1.0], "metadata": {}} for i, text in enumerate(TEXTS)]
+    index = legacy_index(embeddings)
+    assert legacy_index(embeddings) is index
+    embeddings.append({"chunk": "New chunk.", "embedding": [1.0, 0.0], "metadata": {}})
+    rebuilt = legacy_index(embeddings)
+    assert rebuilt is not index and len(rebuilt) == len(TEXTS) + 1
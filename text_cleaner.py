@@ -0,0 +1,175 @@
+"""
+Page text cleaning before chunking.
+
+Each page goes through the same steps, in this order, with patterns
+compiled once:
+
+1. ligature normalization: presentation forms such as "ﬁ" and "ﬂ" become
+   plain letters, soft hyphens are dropped and no-break spaces become
+   spaces (one regex scan; str.translate is much slower on non-ASCII tables)
+2. edge lines: the first and last EDGE_LINES lines of a page are dropped
+   when they are page numbers or running headers/footers learned from the
+   document. "Page 3" and "3 of 40" always count as page numbers; a bare
+   number ("12", "- 7 -") only when it is the page's own number or its
+   number shifted by an offset the document repeats (front matter
+   numbered separately), so a lone year or quantity such as "2023" at
+   the top of a page stays
+3. hyphenation repair: "configu-\\nration" becomes "configuration" (only
+   a lowercase letter, a hyphen at the end of a line and a lowercase
+   letter after it, so "Wi-Fi" and "IEEE-\\n802" are left alone)
+4. whitespace: every run of whitespace, newlines included, becomes a
+   single space
+
+Newlines are only collapsed in the last step, so the line-based steps see
+the page's real lines. Running headers and footers are learned from the
+pages of one document: an edge line that, with its digits masked, repeats
+at the top or bottom of at least HEADER_MIN_FRACTION of the pages (and at
+least HEADER_MIN_PAGES of them) is boilerplate for that document. Bare
+numbers are left out of that (masked, every number looks alike); the
+page-number offsets are learned the same way instead.
+
+Usage:
+    from text_cleaner import TextCleaner
+    cleaned_pages = TextCleaner().clean_pages(page_texts)
+"""
+
+import re
+
+# Lines at the top and bottom of a page checked for page numbers and running headers/footers
+EDGE_LINES = 3
+
+# An edge line repeated on this fraction of a document's pages (and on at least this many) is a header/footer
+HEADER_MIN_FRACTION = 0.5
+HEADER_MIN_PAGES = 3
+
+LIGATURES = {
+    "\ufb00": "ff", "\ufb01": "fi", "\ufb02": "fl", "\ufb03": "ffi", "\ufb04": "ffl",
+    "\ufb05": "st", "\ufb06": "st", "\u0132": "IJ", "\u0133": "ij",
+    # Soft hyphens and zero-width characters go, no-break and thin spaces become spaces
+    "\u00ad": "", "\u200b": "", "\ufeff": "",
+    "\u00a0": " ", "\u2009": " ", "\u202f": " ",
+}
+
+# Groups: "page" prefix, the number, the page total ("of 40", "/ 40")
+PAGE_NUMBER_PATTERN = re.compile(
+    r"[-–—\s]*(page\s*)?(\d{1,4})(\s*(?:of|/)\s*\d{1,4})?[-–—\s]*",
+    re.IGNORECASE
+)
+LIGATURE_PATTERN = re.compile("[" + "".join(LIGATURES) + "]")
+# Starts with the literal hyphen so the scan skips ahead quickly; the lookbehind checks the letter before it
+HYPHENATION_PATTERN = re.compile(r"-(?<=[a-z]-)[ \t]*\n\s*(?=[a-z])")
+DIGITS_PATTERN = re.compile(r"\d+")
+
+def _replace_ligature(match):
+    return LIGATURES[match.group()]
+
+def normalize_ligatures(text):
+    """Text with ligatures, soft hyphens and odd spaces replaced"""
+    return LIGATURE_PATTERN.sub(_replace_ligature, text)
+
+def _line_key(line):
+    """Edge line compared across pages: ligatures normalized, collapsed whitespace, casefolded, digits masked"""
+    return DIGITS_PATTERN.sub("#", " ".join(normalize_ligatures(line).split()).casefold())
+
+def _bare_number(line):
+    """The number of a line that is only a number ("12", "- 7 -"), else None"""
+    match = PAGE_NUMBER_PATTERN.fullmatch(line)
+    if match is None or match.group(1) or match.group(3):
+        return None
+    return int(match.group(2))
+
+def _edge_lines(lines):
+    """Indexes of the first and last EDGE_LINES non-blank lines (each line once)"""
+    top = []
+    for i, line in enumerate(lines):
+        if len(top) == EDGE_LINES:
+            break
+        if line.strip():
+            top.append(i)
+    bottom = []
+    for i in range(len(lines) - 1, top[-1] if top else -1, -1):
+        if len(bottom) == EDGE_LINES:
+            break
+        if lines[i].strip():
+            bottom.append(i)
+    return top + bottom
+
+class TextCleaner:
+    """Configurable page cleaner; every step can be switched off"""
+
+    def __init__(self, ligatures=True, page_numbers=True, headers=True, hyphenation=True):
+        self.ligatures = ligatures
+        self.page_numbers = page_numbers
+        self.headers = headers
+        self.hyphenation = hyphenation
+
+    def learn_boilerplate(self, pages):
+        """Keys of the edge lines repeated across a document's pages (its running headers and footers)"""
+        if not self.headers:
+            return set()
+        counts = {}
+        for text in pages:
+            lines = text.split("\n")
+            for key in {_line_key(lines[i]) for i in _edge_lines(lines) if _bare_number(lines[i]) is None}:
+                counts[key] = counts.get(key, 0) + 1
+        needed = max(HEADER_MIN_PAGES, HEADER_MIN_FRACTION * len(pages))
+        return {key for key, count in counts.items() if count >= needed}
+
+    def learn_page_offsets(self, pages):
+        """Offsets between printed and actual page numbers (page i is pages[i - 1]) that a document repeats"""
+        if not self.page_numbers:
+            return set()
+        counts = {}
+        for page_number, text in enumerate(pages, 1):
+            lines = text.split("\n")
+            numbers = {_bare_number(lines[i]) for i in _edge_lines(lines)}
+            for offset in {number - page_number for number in numbers if number is not None}:
+                counts[offset] = counts.get(offset, 0) + 1
+        needed = max(HEADER_MIN_PAGES, HEADER_MIN_FRACTION * len(pages))
+        return {offset for offset, count in counts.items() if count >= needed}
+
+    def _is_page_number(self, line, page_number, offsets):
+        match = PAGE_NUMBER_PATTERN.fullmatch(line)
+        if match is None:
+            return False
+        if match.group(1) or match.group(3):
+            return True
+        number = int(match.group(2))
+        return page_number is not None and (number == page_number or number - page_number in offsets)
+
+    def clean(self, text, boilerplate=None, page_number=None, page_offsets=()):
+        """Cleaned text of one page.
+
+        ``boilerplate`` holds the learned header/footer keys of its document.
+        Bare numbers are only removed as the page's ``page_number`` (1-based)
+        or that number shifted by one of ``page_offsets``.
+        """
+        # Step 1: ligatures, soft hyphens and odd spaces
+        if self.ligatures:
+            text = normalize_ligatures(text)
+
+        # Step 2: page numbers and running headers/footers among the edge lines
+        if self.page_numbers or boilerplate:
+            lines = text.split("\n")
+            for i in _edge_lines(lines):
+                line = lines[i]
+                if (self.page_numbers and self._is_page_number(line, page_number, page_offsets)) or \
+                        (boilerplate and _line_key(line) in boilerplate):
+                    lines[i] = ""
+            text = "\n".join(lines)
+
+        # Step 3: words hyphenated over a line break
+        if self.hyphenation:
+            text = HYPHENATION_PATTERN.sub("", text)
+
+        # Step 4: collapse whitespace
+        return " ".join(text.split())
+
+    def clean_pages(self, pages):
+        """Clean all page texts of one document (every page, in order), removing the headers/footers they repeat"""
+        pages = list(pages)
+        boilerplate = self.learn_boilerplate(pages)
+        offsets = self.learn_page_offsets(pages)
+        return [self.clean(text, boilerplate, page_number, offsets) for page_number, text in enumerate(pages, 1)]
+
+DEFAULT_CLEANER = TextCleaner()
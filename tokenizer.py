@@ -0,0 +1,56 @@
+"""
+Token counting for prompt budgets.
+
+Uses tiktoken when it is installed, which gives exact counts for OpenAI
+models; otherwise (or if the encoding cannot be loaded, e.g. offline) falls
+back to the ~4 characters per token estimate used for embedding batches.
+"""
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+DEFAULT_ENCODING = "cl100k_base"
+
+_encodings = {}
+
+def get_encoding(model=None):
+    """The tiktoken encoding for a model, or None when tiktoken is unavailable"""
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(DEFAULT_ENCODING)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding(DEFAULT_ENCODING)
+        except Exception as e:
+            print(f"Warning: tiktoken encoding unavailable ({e}), estimating token counts")
+            _encodings[model] = None
+    return _encodings[model]
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+def count_tokens(text, model=None):
+    """Tokens in text for a model (exact with tiktoken, estimated otherwise)"""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text, max_tokens, model=None):
+    """The longest prefix of text that fits in max_tokens, cut at a word boundary where possible"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = get_encoding(model)
+    if encoding is None:
+        prefix = text[:max(0, (max_tokens - 1) * 4)]
+    else:
+        prefix = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    space = prefix.rfind(" ")
+    return prefix[:space] if space > len(prefix) // 2 else prefix
@@ -0,0 +1,296 @@
+"""
+Per-stage tracing and metrics for question answering.
+
+Each stage of answering a question (query embedding, similarity search,
+context assembly, chat completion) runs inside ``span(stage)``, which times
+it and records what it did: tokens in/out, cache hits, chunks scored or
+used. Spans are kept in three places:
+
+- the current Trace, if one was started with ``start_trace`` (a
+  contextvar, so concurrent asyncio tasks each see their own trace)
+- the process-wide METRICS registry, rendered in the Prometheus text
+  format by ``METRICS.render()`` (served on /metrics by qa_server.py)
+- the JSONL trace log, one line per finished trace, when enabled with
+  ``set_trace_log(path)`` or the DOCQA_TRACE_LOG environment variable;
+  view_usage.py turns it into a usage and latency report
+
+Spans outside a trace still count towards METRICS, so code that never
+starts a trace pays only for a couple of perf_counter calls.
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TRACE_LOG_ENV = "DOCQA_TRACE_LOG"
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_trace = contextvars.ContextVar("docqa_trace", default=None)
+_trace_log = os.getenv(TRACE_LOG_ENV) or None
+_trace_log_lock = threading.Lock()
+
+class Span:
+    """One timed stage with its attributes (tokens_in, tokens_out, cache_hit, chunks, ...)"""
+
+    def __init__(self, name, attributes=None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.offset_ms = 0.0
+        self.duration_ms = None
+        self._start = time.perf_counter()
+
+    def set(self, **attributes):
+        """Record attributes; None values are ignored"""
+        self.attributes.update((key, value) for key, value in attributes.items() if value is not None)
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self._start) * 1000
+
+    def finish(self):
+        self.duration_ms = self.elapsed_ms()
+
+    def to_dict(self):
+        data = {"name": self.name, "offset_ms": round(self.offset_ms, 3), "duration_ms": round(self.duration_ms or 0.0, 3)}
+        data.update(self.attributes)
+        if self.error:
+            data["error"] = self.error
+        return data
+
+class Trace:
+    """The spans recorded while answering one question"""
+
+    def __init__(self, name, **attributes):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.timestamp = time.time()
+        self.spans = []
+        self.error = None
+        self.duration_ms = None
+        self._start = time.perf_counter()
+
+    def add(self, span):
+        span.offset_ms = (span._start - self._start) * 1000
+        self.spans.append(span)
+
+    def set(self, **attributes):
+        self.attributes.update((key, value) for key, value in attributes.items() if value is not None)
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+
+    def stage_ms(self, name):
+        """Total time spent in spans called ``name``"""
+        return sum(span.duration_ms or 0.0 for span in self.spans if span.name == name)
+
+    def total(self, attribute):
+        """Sum of a numeric attribute over all spans (e.g. "tokens_in")"""
+        return sum(span.attributes.get(attribute) or 0 for span in self.spans)
+
+    def summary(self):
+        """One line of stage timings and tokens, for printing after an answer"""
+        parts = []
+        for name in dict.fromkeys(span.name for span in self.spans):
+            hit = any(span.attributes.get("cache_hit") for span in self.spans if span.name == name)
+            parts.append(f"{name} {self.stage_ms(name):.0f} ms" + (" (cached)" if hit else ""))
+        tokens_in, tokens_out = self.total("tokens_in"), self.total("tokens_out")
+        if tokens_in or tokens_out:
+            parts.append(f"{tokens_in} tokens in / {tokens_out} out")
+        return ", ".join(parts)
+
+    def to_dict(self):
+        data = {
+            "trace_id": self.id,
+            "name": self.name,
+            "timestamp": round(self.timestamp, 3),
+            "duration_ms": round(self.duration_ms or 0.0, 3),
+            "tokens_in": self.total("tokens_in"),
+            "tokens_out": self.total("tokens_out"),
+            "spans": [span.to_dict() for span in self.spans]
+        }
+        data.update(self.attributes)
+        if self.error:
+            data["error"] = self.error
+        return data
+
+def _label_value(value):
+    """A label value escaped for the Prometheus text format (backslash, double quote, newline)"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    """Process-wide stage latency histograms and counters"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.durations = {}  # stage -> [bucket counts..., +Inf count, sum seconds]
+            self.counters = {}   # (metric, labels) -> value
+
+    def _count(self, metric, labels, value=1):
+        key = (metric, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, span):
+        seconds = (span.duration_ms or 0.0) / 1000
+        attributes = span.attributes
+        with self.lock:
+            histogram = self.durations.setdefault(span.name, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[len(self.buckets)] += 1
+            histogram[-1] += seconds
+
+            labels = {"stage": span.name}
+            if attributes.get("model"):
+                labels["model"] = attributes["model"]
+            for direction in ("in", "out"):
+                tokens = attributes.get(f"tokens_{direction}")
+                if tokens:
+                    self._count("docqa_tokens_total", dict(labels, direction=direction), tokens)
+            if "cache_hit" in attributes:
+                result = "hit" if attributes["cache_hit"] else "miss"
+                self._count("docqa_cache_lookups_total", {"stage": span.name, "result": result})
+            if attributes.get("chunks"):
+                self._count("docqa_chunks_total", {"stage": span.name}, attributes["chunks"])
+            if span.error:
+                self._count("docqa_stage_errors_total", {"stage": span.name, "error": span.error})
+
+    def snapshot(self):
+        """Stage counts and mean latencies as a dict"""
+        with self.lock:
+            return {
+                stage: {
+                    "count": histogram[len(self.buckets)],
+                    "mean_ms": histogram[-1] * 1000 / histogram[len(self.buckets)] if histogram[len(self.buckets)] else 0.0
+                }
+                for stage, histogram in self.durations.items()
+            }
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = [
+            "# HELP docqa_stage_duration_seconds Time spent in each question answering stage",
+            "# TYPE docqa_stage_duration_seconds histogram"
+        ]
+        with self.lock:
+            for stage, histogram in sorted(self.durations.items()):
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f'docqa_stage_duration_seconds_bucket{{stage="{_label_value(stage)}",le="{bound:g}"}} {count}')
+                count = histogram[len(self.buckets)]
+                lines.append(f'docqa_stage_duration_seconds_bucket{{stage="{_label_value(stage)}",le="+Inf"}} {count}')
+                lines.append(f'docqa_stage_duration_seconds_sum{{stage="{_label_value(stage)}"}} {histogram[-1]:.6f}')
+                lines.append(f'docqa_stage_duration_seconds_count{{stage="{_label_value(stage)}"}} {count}')
+
+            help_text = {
+                "docqa_tokens_total": "Tokens sent to (in) and generated by (out) the model",
+                "docqa_cache_lookups_total": "Query embedding and answer cache lookups",
+                "docqa_chunks_total": "Chunks scored by searches and used in contexts",
+                "docqa_stage_errors_total": "Stages that raised an error"
+            }
+            for metric, description in help_text.items():
+                series = sorted((labels, value) for (name, labels), value in self.counters.items() if name == metric)
+                if not series:
+                    continue
+                lines.append(f"# HELP {metric} {description}")
+                lines.append(f"# TYPE {metric} counter")
+                for labels, value in series:
+                    label_text = ",".join(f'{key}="{_label_value(value_)}"' for key, value_ in labels)
+                    lines.append(f"{metric}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+def usage_tokens(response, field):
+    """A token count from an API response's usage, or None if it was not reported"""
+    usage = getattr(response, "usage", None)
+    return getattr(usage, field, None) if usage is not None else None
+
+def set_trace_log(path):
+    """Append finished traces to this JSONL file (None stops logging)"""
+    global _trace_log
+    _trace_log = path
+
+def get_trace_log():
+    return _trace_log
+
+def current_trace():
+    """The trace being recorded in this context, or None"""
+    return _current_trace.get()
+
+@contextmanager
+def span(name, **attributes):
+    """Time a stage; yields the Span so the stage can ``set()`` what it did"""
+    record = Span(name, attributes)
+    try:
+        yield record
+    except (GeneratorExit, KeyboardInterrupt, asyncio.CancelledError):
+        # A closed stream or a cancelled question is not a failure of the stage
+        record.set(cancelled=True)
+        raise
+    except BaseException as e:
+        record.error = type(e).__name__
+        raise
+    finally:
+        record.finish()
+        METRICS.observe(record)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(record)
+
+@contextmanager
+def start_trace(name, **attributes):
+    """Record the spans of one question; the trace is written to the trace log when it ends"""
+    trace = Trace(name, **attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except (GeneratorExit, KeyboardInterrupt, asyncio.CancelledError):
+        trace.set(cancelled=True)
+        raise
+    except BaseException as e:
+        trace.error = type(e).__name__
+        raise
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # An async generator finalized from another task; its context is discarded anyway
+            pass
+        trace.finish()
+        write_trace(trace)
+
+def write_trace(trace, path=None):
+    path = path or _trace_log
+    if not path:
+        return
+    line = json.dumps(trace.to_dict(), ensure_ascii=False) + "\n"
+    try:
+        with _trace_log_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        print(f"Warning: could not write trace log {path}: {e}")
+
+def read_traces(path):
+    """Yield the traces in a JSONL trace log, skipping damaged lines"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
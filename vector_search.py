@@ -2,6 +2,11 @@ import os
 import numpy as np
 from dotenv import load_dotenv
 from openai import OpenAI
+from ann_index import top_k_rows
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from cache_manager import QueryEmbeddingCache
+from tracing import span, usage_tokens
+from tokenizer import count_tokens, truncate_to_tokens
 
 # Load environment variables from .env
 load_dotenv()
@@ -9,55 +14,588 @@ load_dotenv()
 # Initialize OpenAI client with API key from .env
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+QUERY_EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Rows scored per matrix product when searching many queries at once
+SEARCH_BLOCK_ROWS = 131072
+
+# Hits considered when a token budget, rather than top_k, decides how much context is sent
+CONTEXT_CANDIDATES = 20
+
+# Retrieval modes: vector similarity, BM25 keyword matching (no API call), or both fused
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+
+# Reciprocal rank fusion constant (60 is the value from the original paper)
+RRF_K = 60
+
+# In hybrid retrieval only query terms found in at most this fraction of the chunks count as keyword matches
+LEXICAL_MAX_DF_FRACTION = 0.2
+
+# Shared text between neighbouring chunks shorter than this is not treated as overlap
+MIN_OVERLAP_CHARS = 20
+
+# What one passage header costs, for budgeting
+CONTEXT_HEADER_SAMPLE = "[Context 10 from document_name.pdf, pages 100-101]\n\n"
+
+# Resolved filters kept per index (row subsets of recent filters, e.g. the GUI's selection)
+FILTER_CACHE_SIZE = 32
+
+_query_cache = None
+
+# (embeddings list, its length, its last item, VectorIndex) of the last legacy list searched
+_legacy_index = None
+
+def get_query_cache():
+    """Return the shared query embedding cache, opening it on first use"""
+    global _query_cache
+    if _query_cache is None:
+        _query_cache = QueryEmbeddingCache()
+    return _query_cache
+
+def set_query_cache(cache):
+    """Replace the shared query embedding cache (None re-opens the default, False disables it)"""
+    global _query_cache
+    _query_cache = cache
+
+def embed_query(query, model=QUERY_EMBEDDING_MODEL, use_cache=True):
+    """Embed a question, reusing the cached vector for a repeated (normalized) question"""
+    with span("embed_query", model=model) as stage:
+        cache = get_query_cache() if use_cache else False
+        if cache is not False:
+            vector = cache.get_vector(model, query)
+            stage.set(cache_hit=vector is not None)
+            if vector is not None:
+                return vector
+
+        response = client.embeddings.create(model=model, input=query)
+        stage.set(tokens_in=usage_tokens(response, "prompt_tokens"))
+        vector = response.data[0].embedding
+        if cache is not False:
+            cache.put_vector(model, query, vector)
+        return vector
+
 def cosine_similarity(a, b):
     """Calculate cosine similarity between two vectors"""
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
-def find_most_relevant(query, embeddings, top_k=3, similarity_threshold=0.7):
-    """Find the most relevant chunks for a query"""
-    # Create embedding for the query
-    q_emb = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=query
-    ).data[0].embedding
-
-    # Compute similarities for all chunks
-    similarities = []
-    for i, e in enumerate(embeddings):
-        sim = cosine_similarity(q_emb, e["embedding"])
-        similarities.append((i, sim, e))
-    
-    # Sort by similarity (highest first)
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    
-    # Filter by threshold and get top_k
-    relevant_chunks = []
-    for i, sim, chunk_data in similarities[:top_k]:
-        if sim >= similarity_threshold:
-            relevant_chunks.append({
-                'chunk': chunk_data['chunk'],
-                'similarity': sim,
-                'metadata': chunk_data.get('metadata', {})
-            })
-    
-    # If no chunks meet threshold, return the best one anyway
-    if not relevant_chunks and similarities:
-        best_idx, best_sim, best_chunk = similarities[0]
-        relevant_chunks.append({
-            'chunk': best_chunk['chunk'],
-            'similarity': best_sim,
-            'metadata': best_chunk.get('metadata', {})
-        })
-    
-    # Combine all relevant chunks into context
-    if len(relevant_chunks) == 1:
-        return relevant_chunks[0]['chunk']
-    else:
-        # Combine multiple chunks with clear separation
-        combined_context = ""
-        for i, chunk_info in enumerate(relevant_chunks):
-            source = chunk_info['metadata'].get('source_file', 'Unknown')
-            page = chunk_info['metadata'].get('page', 'Unknown')
-            combined_context += f"[Context {i+1} from {os.path.basename(source)}, page {page}]\n"
-            combined_context += chunk_info['chunk'] + "\n\n"
-        return combined_context.strip()
+def normalize_rows(matrix):
+    """Scale each row of a matrix to unit length (zero rows are left as-is)"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def document_row_ranges(metadata, start=0, documents=None):
+    """Group consecutive rows by source_file into [start, stop) ranges"""
+    documents = {} if documents is None else documents
+    for row, meta in enumerate(metadata, start):
+        ranges = documents.setdefault(meta.get("source_file", ""), [])
+        if ranges and ranges[-1][1] == row:
+            ranges[-1][1] = row + 1
+        else:
+            ranges.append([row, row + 1])
+    return documents
+
+def page_numbers(metadata):
+    """int32 page number of every row (0 where the metadata has none)"""
+    return np.array([meta.get("page", 0) or 0 for meta in metadata], dtype=np.int32)
+
+def _matches_value(value, wanted):
+    """Match one metadata value: equal (strings case-insensitively), any of a list, or within {"from", "to"}"""
+    if isinstance(wanted, (list, tuple, set, frozenset)):
+        return any(_matches_value(value, option) for option in wanted)
+    if isinstance(wanted, dict):
+        low, high = wanted.get("from"), wanted.get("to")
+        if isinstance(value, str):
+            # Prefix comparison, so {"to": "2023"} includes every date in 2023
+            return (low is None or value >= str(low)) and (high is None or value[:len(str(high))] <= str(high))
+        try:
+            return (low is None or value >= low) and (high is None or value <= high)
+        except TypeError:
+            return False
+    if isinstance(value, str) and isinstance(wanted, str):
+        return value.casefold() == wanted.casefold()
+    return value == wanted
+
+class SearchFilter:
+    """Restricts retrieval to some documents, a page range and/or document metadata values.
+
+    ``source_files`` are document paths (or just their file names),
+    ``pages`` is a page number or an inclusive (first, last) range (a chunk
+    running over a page break counts as being on the page it starts on),
+    and
+    ``metadata`` maps document info fields stored at ingestion (author,
+    title, creation_date, ... see pdf_metadata.document_info) to a value
+    (strings match case-insensitively), a list of accepted values, or a
+    {"from": ..., "to": ...} range; dates are "YYYY-MM-DD HH:MM:SS" strings
+    and a bound may be any prefix of one, e.g. {"from": "2023-06"}.
+    """
+
+    def __init__(self, source_files=None, pages=None, metadata=None):
+        if isinstance(source_files, str):
+            source_files = [source_files]
+        self.source_files = sorted(set(source_files)) if source_files else None
+        if isinstance(pages, int):
+            pages = (pages, pages)
+        self.pages = (int(pages[0]), int(pages[1])) if pages else None
+        self.metadata = dict(metadata or {})
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a filter from a JSON object: "source_files", "pages", and any other key as a metadata field"""
+        if not data:
+            return None
+        if not isinstance(data, dict):
+            raise ValueError("filter must be an object")
+        fields = dict(data)
+        source_files = fields.pop("source_files", None) or fields.pop("source_file", None)
+        pages = fields.pop("pages", None)
+        if pages is not None and not isinstance(pages, int) and (
+                not isinstance(pages, (list, tuple)) or len(pages) != 2):
+            raise ValueError("pages must be a page number or a [first, last] range")
+        return cls(source_files, pages, fields.pop("metadata", None) or fields)
+
+    def to_dict(self):
+        data = dict(self.metadata)
+        if self.source_files:
+            data["source_files"] = self.source_files
+        if self.pages:
+            data["pages"] = list(self.pages)
+        return data
+
+    def __bool__(self):
+        return bool(self.source_files or self.pages or self.metadata)
+
+    def __repr__(self):
+        return f"SearchFilter({self.to_dict()})"
+
+    def key(self):
+        """Hashable identity of the filter, for caching its resolved rows"""
+        return repr(sorted((name, repr(value)) for name, value in self.to_dict().items()))
+
+    def matches_document(self, source_file, info):
+        """Whether a document passes the source and metadata conditions"""
+        if self.source_files is not None:
+            name = os.path.basename(source_file)
+            if source_file not in self.source_files and name not in self.source_files:
+                return False
+        for field, wanted in self.metadata.items():
+            value = (info or {}).get(field)
+            if value is None or not _matches_value(value, wanted):
+                return False
+        return True
+
+    def rows(self, index):
+        """Sorted live row ids of index that pass the filter"""
+        # Document conditions select whole row ranges, so only the matching documents are touched
+        ranges = [
+            row_range for source, source_ranges in index.documents.items()
+            if self.matches_document(source, index.document_info_for(source))
+            for row_range in source_ranges
+        ]
+        parts = [np.arange(start, stop, dtype=np.int64) for start, stop in sorted(ranges)]
+        rows = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+        if self.pages is not None and len(rows):
+            pages = index.pages[rows] if index.pages is not None else page_numbers(index.metadata[row] for row in rows)
+            first, last = self.pages
+            rows = rows[(pages >= first) & (pages <= last)]
+        if index.deleted is not None and len(rows):
+            rows = rows[~index.deleted[rows]]
+        return rows
+
+class VectorIndex:
+    """Brute-force cosine search over one contiguous matrix of normalized embeddings.
+
+    Rows of ``matrix`` line up with ``chunks`` and ``metadata``, so a search
+    is a single matrix-vector product followed by a partial top-k selection.
+    ``chunks`` and ``metadata`` may be any row-indexable sequence, and a
+    matrix that is already normalized (e.g. a memory-mapped store) is used
+    as-is without copying. ``documents`` maps each source_file to its row
+    ranges so callers can list sources without decoding every record.
+    ``deleted`` is an optional boolean mask of tombstoned rows that are
+    never returned, and ``version`` identifies the store revision the index
+    was opened from. ``ann`` is an optional IVFIndex over the same rows;
+    when set, searches scan only its closest lists unless ``exact`` is asked for.
+    ``lexical`` is an optional LexicalIndex (BM25) over the chunk texts,
+    which enables hybrid and lexical-only retrieval. ``pages`` is an
+    optional int32 page number per row and ``document_info`` maps
+    source_file to its PDF metadata; both back SearchFilter, which narrows
+    a search to the rows of the matching documents and pages.
+    ``quantized`` is an optional QuantizedIndex (float16, int8 or pq codes
+    of the same rows); full scans then read the compact codes instead of
+    the float32 matrix and re-score only the best ``rerank`` * top_k
+    candidates at full precision. A float16 matrix (a store kept as float16)
+    is used as-is too and converted to float32 one block at a time.
+    """
+
+    def __init__(self, matrix, chunks, metadata, normalized=False, documents=None, deleted=None, version=0,
+                 ann=None, lexical=None, pages=None, document_info=None, quantized=None, rerank=None):
+        matrix = np.asarray(matrix)
+        if matrix.dtype != np.float16 or not normalized:
+            matrix = np.asarray(matrix, dtype=np.float32)
+        if not normalized:
+            matrix = normalize_rows(matrix)
+        self.matrix = matrix if matrix.dtype == np.float16 else np.ascontiguousarray(matrix, dtype=np.float32)
+        self.chunks = chunks
+        self.metadata = metadata
+        self.documents = document_row_ranges(metadata) if documents is None else documents
+        self.deleted = deleted
+        self.version = version
+        self.ann = ann
+        self.lexical = lexical
+        if lexical is not None:
+            lexical.set_deleted(deleted)
+        self.pages = pages
+        self.document_info = document_info or {}
+        self.quantized = quantized
+        self.rerank = rerank
+        self.live_count = len(chunks) - (int(deleted.sum()) if deleted is not None else 0)
+        self._filter_rows = {}
+
+    @classmethod
+    def from_embeddings(cls, embeddings, lexical=False):
+        """Build an index from the list-of-dicts format produced by create_embeddings (optionally with BM25)"""
+        chunks = [e["chunk"] for e in embeddings]
+        metadata = [e.get("metadata", {}) for e in embeddings]
+        if embeddings:
+            matrix = np.array([e["embedding"] for e in embeddings], dtype=np.float32)
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        return cls(matrix, chunks, metadata, lexical=LexicalIndex.build(chunks) if lexical else None,
+                   pages=page_numbers(metadata))
+
+    def __len__(self):
+        return self.live_count
+
+    def document_info_for(self, source_file):
+        """PDF metadata of a document (the metadata of its first chunk when none was stored)"""
+        info = self.document_info.get(source_file)
+        if info is None and self.documents.get(source_file):
+            info = self.metadata[self.documents[source_file][0][0]]
+        return info
+
+    def filter_rows(self, search_filter):
+        """Live rows passing a SearchFilter (None for no filter), cached per filter"""
+        if not search_filter:
+            return None
+        key = search_filter.key()
+        rows = self._filter_rows.get(key)
+        if rows is None:
+            if len(self._filter_rows) >= FILTER_CACHE_SIZE:
+                self._filter_rows.clear()
+            rows = self._filter_rows[key] = search_filter.rows(self)
+        return rows
+
+    def search(self, query_embedding, top_k=3, exact=False, nprobe=None, rows=None):
+        """Return up to top_k (row, similarity) pairs, best match first.
+
+        With an ANN index attached the result is approximate; ``nprobe``
+        trades recall for speed and ``exact=True`` forces a full scan.
+        ``rows`` (e.g. from filter_rows) restricts the search to those live
+        rows, which are scored exactly and are the only ones read.
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+        top_k = min(top_k, self.live_count)
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        if rows is not None:
+            if len(rows) == 0:
+                return []
+            scores = np.asarray(self.matrix[rows], dtype=np.float32) @ query
+            best = top_k_rows(scores, min(top_k, len(rows)))
+            return [(int(rows[i]), float(scores[i])) for i in best]
+
+        if self.ann is not None and not exact:
+            rows, scores = self.ann.search(self.matrix, query, top_k, nprobe, self.deleted)
+            # Too few live rows in the probed lists: fall back to the full scan
+            if len(rows) == top_k:
+                return [(int(row), float(score)) for row, score in zip(rows, scores)]
+
+        if self.quantized is not None and not exact:
+            rows, scores = self.quantized.search(self.matrix, query, top_k, self.deleted, self.rerank)
+            return [(int(row), float(score)) for row, score in zip(rows, scores)]
+
+        if self.matrix.dtype == np.float32:
+            scores = self.matrix @ query
+        else:
+            scores = np.concatenate([
+                np.asarray(self.matrix[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32) @ query
+                for start in range(0, len(self.matrix), SEARCH_BLOCK_ROWS)
+            ])
+        if self.deleted is not None:
+            scores[self.deleted] = -np.inf
+
+        # Only the top_k rows need ordering, so partition first and sort the rest
+        rows = top_k_rows(scores, top_k)
+
+        return [(int(row), float(scores[row])) for row in rows]
+
+    def search_many(self, query_embeddings, top_k=3, exact=False, nprobe=None, rows=None):
+        """Search several queries at once; returns one list of (row, similarity) pairs per query.
+
+        The exact path scores all queries with one matrix product per block
+        of rows, so the matrix is read once per batch instead of once per
+        query. Rows match search() for each query (scores may differ in
+        the last bit, as matrix and vector products round differently).
+        ``rows`` restricts every query to those live rows, as in search().
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if len(queries) == 0:
+            return []
+        if len(self) == 0 or top_k <= 0 or (rows is not None and len(rows) == 0):
+            return [[] for _ in queries]
+        if (self.ann is not None or self.quantized is not None) and not exact and rows is None:
+            return [self.search(query, top_k, nprobe=nprobe) for query in queries]
+        # A filtered search reads just its rows, gathered into one smaller matrix
+        matrix = self.matrix if rows is None else np.asarray(self.matrix[rows], dtype=np.float32)
+        deleted = self.deleted if rows is None else None
+        top_k = min(top_k, self.live_count, len(matrix))
+        queries = normalize_rows(queries)
+
+        # Keep each block's top_k per query, then pick the overall top_k from those
+        candidate_rows, candidate_scores = [], []
+        for start in range(0, len(matrix), SEARCH_BLOCK_ROWS):
+            stop = min(start + SEARCH_BLOCK_ROWS, len(matrix))
+            scores = np.asarray(matrix[start:stop], dtype=np.float32) @ queries.T
+            if deleted is not None:
+                scores[deleted[start:stop]] = -np.inf
+            k = min(top_k, stop - start)
+            best = np.argpartition(-scores, k - 1, axis=0)[:k]
+            candidate_rows.append(best + start)
+            candidate_scores.append(np.take_along_axis(scores, best, axis=0))
+        candidate_rows = np.concatenate(candidate_rows)
+        candidate_scores = np.concatenate(candidate_scores)
+        if rows is not None:
+            candidate_rows = rows[candidate_rows]
+
+        results = []
+        for column in range(len(queries)):
+            # Row order first, so ties resolve the same way as in search()
+            order = np.argsort(candidate_rows[:, column], kind="stable")
+            rows = candidate_rows[order, column]
+            scores = candidate_scores[order, column]
+            best = top_k_rows(scores, top_k)
+            results.append([(int(rows[i]), float(scores[i])) for i in best])
+        return results
+
+def build_context(index, hits, similarity_threshold=0.7, token_budget=None, model=None):
+    """Pack search hits above the threshold (or else the best hit) into one context string.
+
+    Hits are taken best first while they fit in ``token_budget`` (no limit
+    if None). Neighbouring chunks that share a page are merged into one
+    passage with their overlap removed, so the budget is not spent twice
+    on the same text.
+    """
+    with span("context", budget=token_budget) as stage:
+        # Filter by threshold (None for hits that were already filtered, e.g. fused ones);
+        # if no chunks meet it, use the best one anyway
+        if similarity_threshold is None:
+            relevant = list(hits)
+        else:
+            relevant = [(row, sim) for row, sim in hits if sim >= similarity_threshold]
+        if not relevant and hits:
+            relevant = hits[:1]
+
+        passages = pack_passages(index, relevant, token_budget, model)
+        if len(passages) == 1:
+            context = passages[0]["text"]
+        else:
+            # Combine multiple passages with clear separation
+            context = "\n\n".join(
+                f"[Context {i + 1} from {os.path.basename(passage['metadata'].get('source_file', 'Unknown'))}, "
+                f"{page_label(passage['metadata'], index.metadata[passage['last']])}]\n{passage['text']}"
+                for i, passage in enumerate(passages)
+            )
+        stage.set(
+            chunks=sum(passage["last"] - passage["first"] + 1 for passage in passages),
+            passages=len(passages),
+            tokens=sum(passage["tokens"] for passage in passages),
+            chars=len(context)
+        )
+        return context
+
+def overlap_length(left, right):
+    """Length of the longest suffix of left that is also a prefix of right (0 if under MIN_OVERLAP_CHARS)"""
+    probe = right[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    pos = left.find(probe)
+    while pos != -1:
+        if right.startswith(left[pos:]):
+            return len(left) - pos
+        pos = left.find(probe, pos + 1)
+    return 0
+
+def _join(left, right):
+    overlap = overlap_length(left, right)
+    return left + right[overlap:] if overlap else left + " " + right
+
+def page_label(first_meta, last_meta=None):
+    """'page 3', or 'pages 3-4' for text running from first_meta's chunk to last_meta's"""
+    first = first_meta.get("page", "Unknown")
+    last = (last_meta or first_meta).get("page_end", (last_meta or first_meta).get("page", first))
+    return f"page {first}" if last == first else f"pages {first}-{last}"
+
+def _same_page(index, a, b):
+    """Whether rows a and b (a right before b) are neighbouring chunks that share a page"""
+    meta_a, meta_b = index.metadata[a], index.metadata[b]
+    return (meta_a.get("source_file") == meta_b.get("source_file")
+            and meta_b.get("page") in (meta_a.get("page"), meta_a.get("page_end")))
+
+def pack_passages(index, hits, token_budget=None, model=None):
+    """Greedily pack (row, score) hits, given best first, into passages within a token budget.
+
+    Returns passages ({"first", "last", "text", "tokens", "score",
+    "metadata"}) ordered by their best score. A hit that would overflow the
+    budget is skipped so a shorter one further down can still fit; if even
+    the best hit is too long on its own it is truncated.
+    """
+    header_tokens = count_tokens(CONTEXT_HEADER_SAMPLE, model)
+    starts, ends = {}, {}  # first row -> passage, last row -> passage
+    used = 0
+    for row, sim in hits:
+        if row in starts or row in ends:
+            continue
+        left = ends.get(row - 1) if row - 1 in ends and _same_page(index, row - 1, row) else None
+        right = starts.get(row + 1) if row + 1 in starts and _same_page(index, row, row + 1) else None
+
+        text = index.chunks[row]
+        if left:
+            text = _join(left["text"], text)
+        if right:
+            text = _join(text, right["text"])
+        merged = [passage for passage in (left, right) if passage]
+        tokens = count_tokens(text, model)
+        cost = tokens + header_tokens - sum(passage["tokens"] + header_tokens for passage in merged)
+
+        if token_budget is not None and used + cost > token_budget:
+            if starts:
+                continue
+            text = truncate_to_tokens(text, token_budget - header_tokens, model)
+            if not text:
+                break
+            tokens = count_tokens(text, model)
+            cost = tokens + header_tokens
+
+        passage = {
+            "first": left["first"] if left else row,
+            "last": right["last"] if right else row,
+            "text": text,
+            "tokens": tokens,
+            "score": max([sim] + [p["score"] for p in merged]),
+            "metadata": index.metadata[left["first"] if left else row]
+        }
+        for old in merged:
+            del starts[old["first"]], ends[old["last"]]
+        starts[passage["first"]] = passage
+        ends[passage["last"]] = passage
+        used += cost
+
+    return sorted(starts.values(), key=lambda passage: -passage["score"])
+
+def search_index(index, query_embedding, top_k=3, rows=None):
+    """index.search, recorded as the "search" stage"""
+    chunks = len(index) if rows is None else len(rows)
+    with span("search", chunks=chunks, approximate=index.ann is not None and rows is None) as stage:
+        hits = index.search(query_embedding, top_k=top_k, rows=rows)
+        stage.set(hits=len(hits))
+        return hits
+
+def lexical_search(index, query, top_k=3, rows=None, max_df_fraction=None):
+    """BM25 hits [(row, score)] for a query; no API call, so it also works offline"""
+    if index.lexical is None:
+        raise ValueError("This index has no lexical (BM25) index; build one with: python lexical_index.py build <store>")
+    with span("lexical_search", chunks=len(index) if rows is None else len(rows)) as stage:
+        hits = index.lexical.search(query, top_k, rows, max_df_fraction)
+        stage.set(hits=len(hits))
+        return hits
+
+def fuse_hits(index, query, vector_hits, top_k=3, similarity_threshold=0.7, rows=None):
+    """Fuse vector hits with BM25 hits for the same query by reciprocal rank fusion.
+
+    Returns up to top_k [(row, fused_score)], best first. Keyword matches
+    are kept regardless of their cosine similarity (that is the point: an
+    exact part number can embed poorly); vector-only hits still have to
+    meet ``similarity_threshold``. Only selective terms make a keyword
+    match: stopwords and terms in more than LEXICAL_MAX_DF_FRACTION of the
+    chunks are ignored, so a question sharing only common words with a
+    chunk does not pull it in below the threshold.
+    """
+    lexical_hits = lexical_search(index, query, max(top_k, len(vector_hits)), rows, LEXICAL_MAX_DF_FRACTION)
+    keep = {row for row, _ in lexical_hits}
+    keep.update(row for row, sim in vector_hits if similarity_threshold is None or sim >= similarity_threshold)
+    fused = reciprocal_rank_fusion([[row for row, _ in vector_hits], [row for row, _ in lexical_hits]], RRF_K)
+    hits = [(row, score) for row, score in fused if row in keep][:top_k]
+    return hits or fused[:1]
+
+def retrieval_mode(index, mode=None):
+    """The mode to search an index with: the one asked for, else hybrid when it has a lexical index"""
+    if mode is None:
+        return "hybrid" if index.lexical is not None else "vector"
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode {mode!r}; choose one of {RETRIEVAL_MODES}")
+    if mode != "vector" and index.lexical is None:
+        raise ValueError(f"{mode} retrieval needs a lexical (BM25) index; build one with: "
+                         f"python lexical_index.py build <store>")
+    return mode
+
+def legacy_index(embeddings):
+    """VectorIndex of a legacy list of embedding dicts, built once per list rather than per query.
+
+    The last list's index is reused while the list keeps its length and
+    last item (appending to it or replacing it rebuilds the index).
+    Callers that search many times should still build a VectorIndex once.
+    """
+    global _legacy_index
+    last = embeddings[-1] if len(embeddings) else None
+    cached = _legacy_index
+    if cached is not None and cached[0] is embeddings and cached[1] == len(embeddings) and cached[2] is last:
+        return cached[3]
+    index = VectorIndex.from_embeddings(embeddings)
+    _legacy_index = (embeddings, len(embeddings), last, index)
+    return index
+
+def retrieve(query, embeddings, top_k=None, similarity_threshold=0.7, use_cache=True, token_budget=None,
+             model=None, mode=None, search_filter=None):
+    """Return (context, hits, index) for a query.
+
+    Without a ``token_budget`` the best ``top_k`` (default 3) chunks are
+    used; with one, the best CONTEXT_CANDIDATES are packed until it is full.
+    ``mode`` is "vector", "lexical" (BM25 only, no embedding request) or
+    "hybrid" (both, fused); by default hybrid when the index has a
+    lexical index and vector otherwise. A SearchFilter restricts every
+    mode to the matching documents and pages.
+    """
+    if top_k is None:
+        top_k = 3 if token_budget is None else CONTEXT_CANDIDATES
+    # Accept the legacy list of embedding dicts as well as a prebuilt index
+    index = embeddings if isinstance(embeddings, VectorIndex) else legacy_index(embeddings)
+    mode = retrieval_mode(index, mode)
+    rows = index.filter_rows(search_filter)
+    if rows is not None and len(rows) == 0:
+        return "", [], index
+
+    if mode == "lexical":
+        hits = lexical_search(index, query, top_k, rows)
+        return build_context(index, hits, None, token_budget, model), hits, index
+
+    # Create embedding for the query (repeated questions come from the cache)
+    q_emb = embed_query(query, use_cache=use_cache)
+
+    # Score every chunk (or the ANN index's candidates) and keep the best top_k
+    # (hybrid fuses deeper candidate lists than it returns)
+    hits = search_index(index, q_emb, max(top_k, CONTEXT_CANDIDATES) if mode == "hybrid" else top_k, rows)
+    if mode == "hybrid":
+        hits = fuse_hits(index, query, hits, top_k, similarity_threshold, rows)
+        return build_context(index, hits, None, token_budget, model), hits, index
+    return build_context(index, hits, similarity_threshold, token_budget, model), hits, index
+
+def find_most_relevant(query, embeddings, top_k=None, similarity_threshold=0.7, use_cache=True, token_budget=None,
+                       model=None, mode=None, search_filter=None):
+    """Find the most relevant chunks for a query (pass a model's context budget to pack more of them)"""
+    return retrieve(query, embeddings, top_k, similarity_threshold, use_cache, token_budget, model, mode,
+                    search_filter)[0]
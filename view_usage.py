@@ -1,20 +1,143 @@
+"""
+Usage and latency report from the trace log.
+
+Reads the JSONL trace log written by tracing.py (enable it with
+DOCQA_TRACE_LOG=traces.jsonl, or --trace-log for qa_server.py and
+batch_qa.py) and prints, per stage, call counts and p50/p95/p99 latency,
+tokens in/out per model, cache hit rates and the slowest questions.
+
+Usage:
+    python view_usage.py [traces.jsonl] [--days 7] [--model gpt-4o] [--prometheus]
+
+--prometheus prints the same data as Prometheus text metrics instead.
+"""
+
 import os
-import json
-from openai import OpenAI
-from dotenv import load_dotenv
+import sys
+import time
+import argparse
+import numpy as np
+from tracing import Metrics, Span, TRACE_LOG_ENV, read_traces
+
+DEFAULT_TRACE_LOG = "traces.jsonl"
+
+def load_traces(path, days=None, model=None):
+    """Traces from the log, optionally only the last ``days`` and one model"""
+    since = time.time() - days * 86400 if days else 0
+    return [
+        trace for trace in read_traces(path)
+        if trace.get("timestamp", 0) >= since and (model is None or trace.get("model") == model)
+    ]
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(np.mean(values))}
+
+def summarize(traces):
+    """Aggregate traces into per-stage latencies, token usage and cache hit rates"""
+    stages = {}
+    tokens = {}
+    caches = {}
+    errors = {}
+    for trace in traces:
+        for span in trace.get("spans", []):
+            name = span["name"]
+            stages.setdefault(name, []).append(span["duration_ms"])
+            if span.get("error"):
+                errors[name] = errors.get(name, 0) + 1
+            if "cache_hit" in span:
+                counts = caches.setdefault(name, [0, 0])
+                counts[0 if span["cache_hit"] else 1] += 1
+            if span.get("tokens_in") or span.get("tokens_out"):
+                usage = tokens.setdefault((name, span.get("model", "")), {"calls": 0, "in": 0, "out": 0, "estimated": 0})
+                usage["calls"] += 1
+                usage["in"] += span.get("tokens_in") or 0
+                usage["out"] += span.get("tokens_out") or 0
+                usage["estimated"] += bool(span.get("tokens_estimated"))
+    return {
+        "total": percentiles([trace["duration_ms"] for trace in traces]),
+        "stages": {name: dict(percentiles(values), count=len(values)) for name, values in stages.items()},
+        "tokens": tokens,
+        "caches": caches,
+        "errors": errors
+    }
+
+def print_report(traces, path, top=5):
+    first = time.strftime("%Y-%m-%d %H:%M", time.localtime(min(t["timestamp"] for t in traces)))
+    last = time.strftime("%Y-%m-%d %H:%M", time.localtime(max(t["timestamp"] for t in traces)))
+    summary = summarize(traces)
+    failed = sum(1 for trace in traces if trace.get("error"))
+
+    print(f"Usage report for {path}")
+    print(f"{len(traces)} questions from {first} to {last} ({failed} failed)")
+
+    # Step 1: latency per stage
+    total = summary["total"]
+    print(f"\n{'Stage':<16} {'calls':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'mean ms':>10} {'errors':>7}")
+    print(f"{'(whole question)':<16} {len(traces):>7} {total['p50']:>10.1f} {total['p95']:>10.1f} "
+          f"{total['p99']:>10.1f} {total['mean']:>10.1f} {failed:>7}")
+    for name, stats in summary["stages"].items():
+        print(f"{name:<16} {stats['count']:>7} {stats['p50']:>10.1f} {stats['p95']:>10.1f} "
+              f"{stats['p99']:>10.1f} {stats['mean']:>10.1f} {summary['errors'].get(name, 0):>7}")
+
+    # Step 2: tokens per stage and model
+    if summary["tokens"]:
+        print(f"\n{'Stage':<16} {'Model':<24} {'calls':>7} {'tokens in':>12} {'tokens out':>12}")
+        for (name, model), usage in sorted(summary["tokens"].items()):
+            note = f"  ({usage['estimated']} estimated)" if usage["estimated"] else ""
+            print(f"{name:<16} {model:<24} {usage['calls']:>7} {usage['in']:>12,} {usage['out']:>12,}{note}")
+
+    # Step 3: cache hit rates
+    if summary["caches"]:
+        print()
+        for name, (hits, misses) in summary["caches"].items():
+            print(f"{name} cache: {hits} hits, {misses} misses ({hits / (hits + misses):.0%} hit rate)")
+
+    # Step 4: slowest questions
+    print(f"\nSlowest {min(top, len(traces))} questions:")
+    for trace in sorted(traces, key=lambda t: t["duration_ms"], reverse=True)[:top]:
+        slowest = max(trace.get("spans") or [{"name": "-", "duration_ms": 0}], key=lambda s: s["duration_ms"])
+        question = (trace.get("question") or "")[:60]
+        print(f"  {trace['duration_ms']:>9.1f} ms  (mostly {slowest['name']})  {question}")
 
-# Load environment variables from .env
-load_dotenv()
+def to_prometheus(traces):
+    """Replay the logged spans into a Metrics registry and render it"""
+    metrics = Metrics()
+    for trace in traces:
+        for data in trace.get("spans", []):
+            attributes = {key: value for key, value in data.items()
+                          if key not in ("name", "offset_ms", "duration_ms", "error")}
+            span = Span(data["name"], attributes)
+            span.duration_ms = data["duration_ms"]
+            span.error = data.get("error")
+            metrics.observe(span)
+    return metrics.render()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def main(argv):
+    parser = argparse.ArgumentParser(description="Summarize question answering usage and latency from the trace log")
+    parser.add_argument("trace_log", nargs="?", default=os.getenv(TRACE_LOG_ENV) or DEFAULT_TRACE_LOG)
+    parser.add_argument("--days", type=float, help="only traces from the last N days")
+    parser.add_argument("--model", help="only questions answered by this model")
+    parser.add_argument("--top", type=int, default=5, help="how many of the slowest questions to list")
+    parser.add_argument("--prometheus", action="store_true", help="print Prometheus text metrics instead")
+    args = parser.parse_args(argv)
 
-client = OpenAI()
+    if not os.path.exists(args.trace_log):
+        print(f"No trace log at {args.trace_log}. Set {TRACE_LOG_ENV}=traces.jsonl (or pass --trace-log "
+              f"to qa_server.py / batch_qa.py) to start recording.")
+        return 1
+    traces = load_traces(args.trace_log, args.days, args.model)
+    if not traces:
+        print("No traces match.")
+        return 0
 
-response = client.responses.create(
-  model="gpt-4.1",
-  input="Tell me a three sentence bedtime story about a unicorn."
-)
+    if args.prometheus:
+        print(to_prometheus(traces), end="")
+    else:
+        print_report(traces, args.trace_log, args.top)
+    return 0
 
-# Convert to dictionary and pretty-print
-print(json.dumps(response.model_dump(), indent=4))
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))